@@ -1,12 +1,23 @@
 import fernet from 'fernet';
 
+// one key, or "new key,old key" while the bot's COLDKEY_SECRET is rotated, in the same order
+const keys = process.env.FERNET_KEY.split(',').map(key => new fernet.Secret(key.trim()));
+
 export function decrypt(encrypted_mnemonic) {
-    const key = new fernet.Secret(process.env.FERNET_KEY);
-    var token = new fernet.Token({
-        secret: key,
-        token: encrypted_mnemonic,
-        ttl: 0
-    })
-    const mnemonic = token.decode();
-    return mnemonic;
-}
\ No newline at end of file
+    var error;
+    for (const key of keys) {
+        var token = new fernet.Token({
+            secret: key,
+            token: encrypted_mnemonic,
+            ttl: 0
+        })
+        try {
+            const mnemonic = token.decode();
+            return mnemonic;
+        } catch (e) {
+            // encrypted with another of the keys
+            error = e;
+        }
+    }
+    throw error;
+}
@@ -0,0 +1,62 @@
+import argparse
+import asyncio
+import csv
+from typing import List, Tuple
+
+import pymongo
+from src.balance import Balance
+
+from src.airdrop import Airdrop, AirdropCheckpoint
+from src.api import API
+from src.config import main_config as config
+from src.db import Address, Database
+
+parser = argparse.ArgumentParser(description="Airdrop TAO from a treasury address to Discord users. Re-run with the same run id to resume.")
+parser.add_argument("run_id", help="Name of the airdrop run, used to checkpoint and resume it")
+parser.add_argument("-r", "--recipients", help="CSV file of discord user id, amount in tao", required=True)
+parser.add_argument("-t", "--treasury", help="Custodial ss58 address to pay from", required=True)
+parser.add_argument("--max-in-flight", help="Extrinsics submitted at once", type=int, default=4)
+parser.add_argument("--weight-fraction", help="Fraction of the max extrinsic weight a batch may use", type=float, default=0.5)
+parser.add_argument("--max-batch", help="Upper bound on transfers per batch", type=int, default=None)
+
+
+def load_recipients(path: str) -> List[Tuple[str, Balance]]:
+    recipients: List[Tuple[str, Balance]] = []
+    with open(path, newline="") as f:
+        for row in csv.reader(f):
+            if len(row) < 2 or not row[0].strip().isdigit():
+                # header or blank line
+                continue
+            recipients.append((row[0].strip(), Balance.from_tao(float(row[1]))))
+    return recipients
+
+
+def connect():
+    return API(config, testing=config.TESTING).subtensor.substrate
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    _api = API(config, testing=config.TESTING)
+    mongo_uri = config.MONGO_URI_TEST if config.TESTING else config.MONGO_URI
+    _db = Database(pymongo.MongoClient(mongo_uri), _api, config.TESTING)
+
+    treasury: Address = _db.get_address(args.treasury, config.COLDKEY_SECRET)
+    if treasury is None:
+        print(f"{args.treasury} is not a custodial address")
+        exit(1)
+
+    checkpoint = AirdropCheckpoint(_db, args.run_id, args.treasury)
+    added: int = checkpoint.load(load_recipients(args.recipients))
+    print(f"Loaded {added} new recipients into run {args.run_id}")
+    asyncio.run(checkpoint.resolve_addresses(config.COLDKEY_SECRET))
+
+    airdrop = Airdrop(checkpoint, treasury, connect, args.max_in_flight, args.weight_fraction, args.max_batch)
+    try:
+        counts = airdrop.run()
+    except Exception as e:
+        print(e)
+        print(f"Airdrop interrupted, re-run with run id {args.run_id} to resume")
+        exit(1)
+    print(f"Airdrop {args.run_id} finished: {counts}")
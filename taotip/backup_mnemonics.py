@@ -0,0 +1,46 @@
+import argparse
+import getpass
+import os
+
+import pymongo
+
+from src.backup import MODES, Backup
+from src.config import main_config as config
+from src.db import Database
+
+parser = argparse.ArgumentParser(description="Back up every custodial address and its mnemonic to an encrypted, compressed file. Re-run with the same output to resume.")
+parser.add_argument("output", help="Backup file to write")
+parser.add_argument("-m", "--mode", help="fernet: re-encrypted with the key in --key-file; polkadot: polkadot-js JSON per address, encrypted with a passphrase", choices=MODES, default="fernet")
+parser.add_argument("-k", "--key-file", help="File with the Fernet key to encrypt the backup with (e.g. from generate_secret.py), for fernet mode")
+parser.add_argument("--workers", help="Processes decrypting and encrypting", type=int, default=os.cpu_count())
+parser.add_argument("--chunk-size", help="Addresses per chunk of the file", type=int, default=1000)
+parser.add_argument("--mongo-uri", help="Defaults to the configured one", default=None)
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    key = None
+    passphrase = None
+    if args.mode == "fernet":
+        if args.key_file is None:
+            parser.error("fernet mode needs --key-file")
+        with open(args.key_file, "rb") as f:
+            key = f.read().strip()
+        # as printed by generate_secret.py
+        if key.startswith(b"b'"):
+            key = key[2:-1]
+    else:
+        passphrase = os.environ.get("BACKUP_PASSPHRASE") or getpass.getpass("Passphrase for the exported keys: ")
+
+    mongo_uri = args.mongo_uri or (config.MONGO_URI_TEST if config.TESTING else config.MONGO_URI)
+    db = Database(pymongo.MongoClient(mongo_uri), None, config.TESTING).db
+
+    try:
+        backup = Backup(db.addresses, args.output, config.COLDKEY_SECRET, args.mode, key, passphrase, args.workers, args.chunk_size)
+        count = backup.run()
+    except (Exception, KeyboardInterrupt) as e:
+        print(repr(e))
+        print("Backup interrupted, run the same command again to resume")
+        exit(1)
+    print(f"Backed up {count} addresses to {args.output}")
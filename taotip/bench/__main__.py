@@ -0,0 +1,126 @@
+"""
+Runs the benchmarks offline, against a fake chain and mongomock (or a throwaway local Mongo).
+
+    python -m taotip.bench --scales 1000,100000 --benchmarks tip,withdraw
+    python -m taotip.bench --compare taotip/bench/results/<previous>.json
+
+Each benchmark and scale runs in its own process, so peak RSS is its own.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+from datetime import datetime
+from queue import Empty
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+from .benchmarks import BENCHMARKS, run_case, run_case_to_queue
+
+RESULTS_DIR: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def run_isolated(name: str, scale: int, options: SimpleNamespace) -> Dict:
+    context = multiprocessing.get_context("spawn")
+    queue: multiprocessing.Queue = context.Queue()
+    process = context.Process(target=run_case_to_queue, args=(queue, name, scale, options))
+    process.start()
+    while True:
+        try:
+            result: Dict = queue.get(timeout=1.0)
+            break
+        except Empty:
+            if not process.is_alive():
+                result = {"benchmark": name, "scale": scale, "error": f"exited with code {process.exitcode}"}
+                break
+    process.join()
+    return result
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+
+def print_results(results: List[Dict], previous: Optional[Dict] = None) -> None:
+    baseline: Dict = {}
+    if previous is not None:
+        baseline = {(r["benchmark"], r["scale"]): r for r in previous["results"] if "error" not in r}
+
+    print(f"{'benchmark':<14} {'scale':>9} {'items/s':>12} {'p50 ms':>10} {'p99 ms':>10} {'RSS MB':>8}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['benchmark']:<14} {r['scale']:>9} failed: {r['error']}")
+            continue
+        line: str = f"{r['benchmark']:<14} {r['scale']:>9} {r['throughput']:>12.1f} {r['p50_ms']:>10.2f} {r['p99_ms']:>10.2f} {r['peak_rss_mb']:>8.1f}"
+        before: Optional[Dict] = baseline.get((r["benchmark"], r["scale"]))
+        if before is not None and before["throughput"] and before["p99_ms"]:
+            line += "   throughput {:+.1f}%, p99 {:+.1f}%".format(
+                (r["throughput"] / before["throughput"] - 1) * 100,
+                (r["p99_ms"] / before["p99_ms"] - 1) * 100,
+            )
+        print(line)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m taotip.bench", description="Offline benchmarks of the tip, withdraw, deposit sweep and welcome paths")
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARKS), help="comma separated, out of: " + ", ".join(BENCHMARKS))
+    parser.add_argument("--scales", default="1000", help="comma separated numbers of addresses, e.g. 1000,100000,1000000")
+    parser.add_argument("--ops", type=int, default=200, help="tips or withdrawals per benchmark; sweeps and welcome runs are ops / 100")
+    parser.add_argument("--mongo-uri", default=None, help="a local Mongo to use instead of mongomock; its taotip_bench database is dropped")
+    parser.add_argument("--rpc-latency", type=float, default=0.0, help="seconds added to every fake chain call")
+    parser.add_argument("--discord-latency", type=float, default=0.0, help="seconds added to every fake Discord call")
+    parser.add_argument("--welcome-concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="where to save the results, by default under taotip/bench/results")
+    parser.add_argument("--compare", default=None, help="results of a previous run to compare with")
+    parser.add_argument("--in-process", action="store_true", help="run every case in this process (peak RSS is then cumulative)")
+    args = parser.parse_args()
+
+    names: List[str] = [name for name in args.benchmarks.split(",") if name]
+    unknown: List[str] = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(unknown)}")
+    scales: List[int] = [int(scale) for scale in args.scales.split(",") if scale]
+
+    options: SimpleNamespace = SimpleNamespace(
+        ops=args.ops, mongo_uri=args.mongo_uri, rpc_latency=args.rpc_latency, discord_latency=args.discord_latency,
+        welcome_concurrency=args.welcome_concurrency, seed=args.seed,
+    )
+
+    results: List[Dict] = []
+    for scale in scales:
+        for name in names:
+            print(f"Running {name} with {scale} addresses...", file=sys.stderr)
+            results.append(run_case(name, scale, options) if args.in_process else run_isolated(name, scale, options))
+
+    commit: Optional[str] = git_commit()
+    report: Dict = {
+        "commit": commit,
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "mongo": "local" if args.mongo_uri else "mongomock",
+        "options": vars(options),
+        "results": results,
+    }
+
+    output: str = args.output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{commit or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(report, f, indent=2)
+
+    previous: Optional[Dict] = None
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+    print_results(results, previous)
+    print(f"Saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import asyncio
+import functools
+import random
+import resource
+import sys
+import time
+from types import SimpleNamespace
+from typing import Awaitable, Callable, Dict, List
+from unittest.mock import patch
+
+from taotip.src import event_handlers
+from taotip.src.balance import Balance
+from taotip.src.context import RequestContext
+from taotip.src.db import Database, Tip, Transaction
+from taotip.src.dispatch import DMDispatcher, RouteRateLimiter
+
+from .fakes import FakeAPI, FakeDiscord, make_db, new_key, seed
+
+SEED_BALANCE: Balance = Balance.from_tao(1000.0)
+
+
+def percentile(samples: List[float], p: float) -> float:
+    ordered: List[float] = sorted(samples)
+    if len(ordered) == 0:
+        return 0.0
+    return ordered[min(int(len(ordered) * p), len(ordered) - 1)]
+
+
+def peak_rss_mb() -> float:
+    # kilobytes on Linux, bytes on macOS
+    peak: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+async def measure(op: Callable[[], Awaitable[int]], ops: int) -> Dict:
+    """
+    Runs op `ops` times. op returns how many items it processed (e.g. addresses scanned).
+    """
+    latencies: List[float] = []
+    items: int = 0
+    start: float = time.perf_counter()
+    for _ in range(ops):
+        op_start: float = time.perf_counter()
+        items += await op()
+        latencies.append(time.perf_counter() - op_start)
+    seconds: float = time.perf_counter() - start
+    return {
+        "ops": ops,
+        "items": items,
+        "seconds": round(seconds, 6),
+        "throughput": round(items / seconds, 3) if seconds > 0 else None, # items per second
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 3),
+    }
+
+
+async def bench_tip(_db: Database, api: FakeAPI, users: List[str], key: bytes, ops: int, options: SimpleNamespace) -> Dict:
+    amount: Balance = Balance.from_tao(0.001)
+
+    async def op() -> int:
+        sender, recipient = random.sample(users, 2)
+        if not await Tip(sender, recipient, amount).send(_db, key, RequestContext()):
+            raise Exception(f"tip from {sender} was not sent")
+        return 1
+
+    return await measure(op, ops)
+
+
+async def bench_withdraw(_db: Database, api: FakeAPI, users: List[str], key: bytes, ops: int, options: SimpleNamespace) -> Dict:
+    amount: int = Balance.from_tao(0.001).rao
+
+    async def op() -> int:
+        user: str = random.choice(users)
+        await Transaction(user, amount).withdraw(_db, "5BenchWithdrawDestination", key, RequestContext())
+        return 1
+
+    return await measure(op, ops)
+
+
+async def bench_deposit_sweep(_db: Database, api: FakeAPI, users: List[str], key: bytes, ops: int, options: SimpleNamespace) -> Dict:
+    addresses: List[str] = list(api.subtensor.balances)
+    deposits: int = max(len(addresses) // 100, 1)
+
+    async def op() -> int:
+        # 1% of the addresses received a deposit since the last sweep
+        for address in random.sample(addresses, deposits):
+            api.subtensor.balances[address] += Balance.from_tao(1.0).rao
+        api.subtensor.block += 1
+        await api.check_for_deposits(_db)
+        return len(addresses)
+
+    # a sweep reads every address, a few are enough
+    return await measure(op, max(ops // 100, 1))
+
+
+async def bench_welcome(_db: Database, api: FakeAPI, users: List[str], key: bytes, ops: int, options: SimpleNamespace) -> Dict:
+    discord: FakeDiscord = FakeDiscord(options.discord_latency)
+    config: SimpleNamespace = SimpleNamespace(
+        BITTENSOR_DISCORD_SERVER=1, WELCOME_CONCURRENCY=options.welcome_concurrency,
+        HELP_STR="help", EXPORT_URL="https://example.com", MAINTAINER="<@!1>",
+    )
+    # Discord's rate limits would make this a benchmark of the limiter
+    dispatcher = functools.partial(DMDispatcher, limiter=RouteRateLimiter(10 ** 9, {route: (10 ** 9, 1.0) for route in RouteRateLimiter().routes}))
+
+    async def op() -> int:
+        _db.db.addresses.update_many({}, {"$set": {"welcomed": False}})
+        await event_handlers.welcome_new_users(_db, discord, config)
+        return len(users)
+
+    with patch("taotip.src.dispatch.interactions.get", discord.get), patch.object(event_handlers, "DMDispatcher", dispatcher):
+        return await measure(op, max(ops // 100, 1))
+
+
+BENCHMARKS: Dict[str, Callable[..., Awaitable[Dict]]] = {
+    "tip": bench_tip,
+    "withdraw": bench_withdraw,
+    "deposit_sweep": bench_deposit_sweep,
+    "welcome": bench_welcome,
+}
+
+
+async def run_benchmark(name: str, scale: int, options: SimpleNamespace) -> Dict:
+    """
+    Seeds `scale` users with an address each, then runs the benchmark.
+    """
+    random.seed(options.seed)
+    api: FakeAPI = FakeAPI(options.rpc_latency)
+    _db: Database = make_db(options.mongo_uri, api)
+    key: bytes = new_key()
+
+    seed_start: float = time.perf_counter()
+    users: List[str] = seed(_db, api.subtensor, key, scale, SEED_BALANCE)
+    seed_seconds: float = time.perf_counter() - seed_start
+
+    result: Dict = await BENCHMARKS[name](_db, api, users, key, options.ops, options)
+    result.update({
+        "benchmark": name,
+        "scale": scale,
+        "seed_seconds": round(seed_seconds, 3),
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+    })
+    return result
+
+
+def run_case(name: str, scale: int, options: SimpleNamespace) -> Dict:
+    return asyncio.run(run_benchmark(name, scale, options))
+
+
+def run_case_to_queue(queue, name: str, scale: int, options: SimpleNamespace) -> None:
+    """
+    run_case in a child process.
+    """
+    try:
+        queue.put(run_case(name, scale, options))
+    except Exception as e:
+        queue.put({"benchmark": name, "scale": scale, "error": repr(e)})
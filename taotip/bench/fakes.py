@@ -0,0 +1,182 @@
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import pymongo
+from cryptography.fernet import Fernet
+
+from taotip.src.api import API
+from taotip.src.balance import Balance
+from taotip.src.context import NO_CONTEXT, RequestContext
+from taotip.src.db import Address, Database
+
+FEE_RAO: int = 125_000 # about what a transfer costs on chain
+
+
+class FakeSubtensor:
+    """
+    An in-memory chain: free balances by address and a block height.
+    `latency` seconds are spent (blocking, like the real client) on every call.
+    """
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+        self.balances: Dict[str, int] = {} # address -> rao
+        self.block: int = 1
+
+    def _wait(self) -> None:
+        if self.latency > 0:
+            time.sleep(self.latency)
+
+    def connect(self, failure: bool = True) -> bool:
+        return True
+
+    def get_balance(self, address: str) -> Balance:
+        self._wait()
+        return Balance.from_rao(self.balances.get(address, 0))
+
+    def get_current_block(self) -> int:
+        self._wait()
+        return self.block
+
+    def apply(self, sender: str, transfers: List[Tuple[str, int]], fee: int) -> None:
+        total: int = sum(amount for _, amount in transfers) + fee
+        if self.balances.get(sender, 0) < total:
+            raise Exception("transaction failed")
+        self.balances[sender] -= total
+        for dest, amount in transfers:
+            self.balances[dest] = self.balances.get(dest, 0) + amount
+        self.block += 1
+
+
+class FakePayload:
+    def __init__(self, call: Dict) -> None:
+        self.call = call
+
+    def to_hex(self) -> str:
+        return "0x" + repr(self.call).encode().hex()
+
+
+class FakeAPI(API):
+    """
+    API against a FakeSubtensor. Keys are real (mnemonics are decrypted and payloads signed)
+    but extrinsics are applied to the fake chain without checking the signature.
+    """
+    def __init__(self, latency: float = 0.0, fee_rao: int = FEE_RAO) -> None:
+        self.network = "Fake"
+        self.subtensor = FakeSubtensor(latency)
+        self.fee_rao = fee_rao
+
+    def get_wallet_balance(self, coldkeyadd: str, rctx: RequestContext = NO_CONTEXT) -> Balance:
+        return rctx.get(("balance", coldkeyadd), lambda: self.subtensor.get_balance(coldkeyadd))
+
+    def verify_coldkeyadd(self, coldkeyadd: str) -> bool:
+        return True
+
+    def init_transaction(self, coldkeyadd: str, dest: str, amount: Balance, rctx: RequestContext = NO_CONTEXT) -> Tuple[Any, Any, Any]:
+        return self.init_batch_transaction(coldkeyadd, [(dest, amount)], rctx)
+
+    def init_batch_transaction(self, coldkeyadd: str, transfers: List[Tuple[str, Balance]], rctx: RequestContext = NO_CONTEXT) -> Tuple[Any, Any, Any]:
+        self.subtensor._wait()
+        call: Dict = {"sender": coldkeyadd, "transfers": [(dest, amount.rao) for dest, amount in transfers]}
+        return call, FakePayload(call), {"partialFee": self.fee_rao}
+
+    def send_transaction(self, transaction, rctx: RequestContext = NO_CONTEXT) -> Optional[Dict]:
+        try:
+            # waits for inclusion on the real chain
+            self.subtensor._wait()
+            call: Dict = transaction["call"]
+            self.subtensor.apply(transaction["coldkeyadd"], call["transfers"], self.fee_rao)
+            rctx.invalidate(("balance", transaction["coldkeyadd"]), ("block",))
+            return {
+                'message': 'Transaction sent',
+                'response': None,
+                'balance': self.get_wallet_balance(transaction["coldkeyadd"], rctx),
+                'block': self.subtensor.block,
+            }
+        except Exception as e:
+            print(e, "fakes.send_transaction")
+            return None
+
+
+class FakeMember:
+    def __init__(self, user: str, latency: float) -> None:
+        self.id = user
+        self.name = f"user{user}"
+        self.latency = latency
+
+    async def send(self, message: str) -> None:
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+
+
+class FakeDiscord:
+    """
+    What welcome_new_users needs of interactions: the client and guild member lookups.
+    Every lookup and DM takes `latency` seconds, without blocking the loop.
+    """
+    def __init__(self, latency: float = 0.0) -> None:
+        self.latency = latency
+
+    async def wait_until_ready(self) -> None:
+        pass
+
+    async def get(self, client, obj, object_id: int, parent_id: int = None) -> FakeMember:
+        if self.latency > 0:
+            await asyncio.sleep(self.latency)
+        return FakeMember(str(object_id), self.latency)
+
+
+def seed(_db: Database, chain: FakeSubtensor, key: bytes, n: int, balance: Balance, distinct_keys: int = 8, batch_size: int = 10_000) -> List[str]:
+    """
+    Creates n users with an address, a balance on chain and in the read model.
+
+    Generating a keypair per address would dominate seeding, so addresses are made up
+    and share `distinct_keys` real, encrypted mnemonics; signing still uses a real key.
+
+    Returns:
+        the users
+    """
+    from substrateinterface import Keypair
+
+    mnemonics: List[bytes] = [
+        Address("", Keypair.generate_mnemonic(12), key).get_encrypted_mnemonic() for _ in range(distinct_keys)
+    ]
+    _db.db.addresses.create_index("address")
+    _db.db.addresses.create_index("user")
+    _db.db.balances.create_index("address")
+
+    users: List[str] = []
+    for start in range(0, n, batch_size):
+        addresses: List[Dict] = []
+        balances: List[Dict] = []
+        for i in range(start, min(start + batch_size, n)):
+            user: str = str(100_000_000 + i)
+            address: str = f"5Bench{i:040d}"
+            users.append(user)
+            addresses.append({"address": address, "mnemonic": mnemonics[i % distinct_keys], "user": user, "welcomed": True})
+            balances.append({"address": address, "user": user, "balance": balance.rao, "block": chain.block, "time": None})
+            chain.balances[address] = balance.rao
+        _db.db.addresses.insert_many(addresses)
+        _db.db.balances.insert_many(balances)
+    return users
+
+
+BENCH_DATABASE: str = "taotip_bench"
+
+
+def make_db(mongo_uri: Optional[str], api: FakeAPI) -> Database:
+    """
+    A Database on mongomock, or on a local Mongo if a uri is given. There it uses its own
+    database, dropped before each run, never the bot's "test" or "prod" ones.
+    """
+    if mongo_uri:
+        client = pymongo.MongoClient(mongo_uri)
+        client.drop_database(BENCH_DATABASE)
+    else:
+        import mongomock
+        client = mongomock.MongoClient()
+    return Database(client, api, testing=True, estimated_fee=Balance.from_rao(api.fee_rao), database=BENCH_DATABASE)
+
+
+def new_key() -> bytes:
+    return Fernet.generate_key()
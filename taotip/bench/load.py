@@ -0,0 +1,309 @@
+"""
+Drives event_handlers with concurrent synthetic interactions at increasing rates, to find how
+many commands one bot process sustains before acknowledgements miss Discord's 3 second deadline.
+
+    python -m taotip.bench.load --rates 5,10,20,50 --duration 10 --rpc-latency 0.05 --mongo-latency 0.002
+
+Commands go through the CommandExecutor like in main.py (--no-executor calls the handlers directly).
+Latencies are measured from when a command was due, so a blocked loop shows up in them.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from unittest.mock import AsyncMock, MagicMock
+
+import interactions
+
+from taotip.src import event_handlers
+from taotip.src.balance import Balance
+from taotip.src.cache import entity_cache
+from taotip.src.db import Database
+from taotip.src.executor import CommandExecutor
+
+from .__main__ import RESULTS_DIR, git_commit
+from .benchmarks import SEED_BALANCE, percentile
+from .fakes import FakeAPI, make_db, new_key, seed
+
+DEADLINE: float = 3.0 # seconds Discord gives to acknowledge an interaction
+GUILD_ID: int = 1
+CHANNEL_ID: int = 2
+
+COMMANDS: Tuple[str, ...] = ("tip", "balance", "withdraw", "deposit")
+
+
+class SlowCollection:
+    """
+    A collection whose calls first block for `latency` seconds, like a round trip with pymongo.
+    """
+    def __init__(self, collection, latency: float) -> None:
+        self._collection = collection
+        self._latency = latency
+
+    def __getattr__(self, name: str) -> Any:
+        attr: Any = getattr(self._collection, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            time.sleep(self._latency)
+            return attr(*args, **kwargs)
+        return call
+
+
+class SlowDatabase:
+    """
+    Wraps Database.db so every collection call takes `latency` seconds more.
+    """
+    def __init__(self, db, latency: float) -> None:
+        self._db = db
+        self._latency = latency
+
+    def __getattr__(self, name: str) -> SlowCollection:
+        return SlowCollection(getattr(self._db, name), self._latency)
+
+    def __getitem__(self, name: str) -> SlowCollection:
+        return SlowCollection(self._db[name], self._latency)
+
+
+class Interaction:
+    """
+    Timestamps of one synthetic command, relative to when it was due.
+    """
+    __slots__ = ("command", "due", "ack", "done", "error")
+
+    def __init__(self, command: str, due: float) -> None:
+        self.command = command
+        self.due = due
+        self.ack: Optional[float] = None # first defer or send
+        self.done: Optional[float] = None # handler returned
+        self.error: Optional[str] = None
+
+
+def make_user(user_id: str) -> MagicMock:
+    return MagicMock(spec=interactions.User, id=user_id, bot=False, mention=f"<@{user_id}>")
+
+
+def make_ctx(interaction: Interaction, user: MagicMock) -> MagicMock:
+    """
+    A CommandContext from a guild channel, mocked like test_main.py does.
+    """
+    def acknowledged(*args, **kwargs) -> None:
+        if interaction.ack is None:
+            interaction.ack = time.perf_counter()
+
+    return MagicMock(
+        spec=interactions.CommandContext,
+        user=user,
+        author=user,
+        guild_id=GUILD_ID,
+        channel_id=CHANNEL_ID,
+        send=AsyncMock(side_effect=acknowledged),
+        defer=AsyncMock(side_effect=acknowledged),
+        message=MagicMock(delete=AsyncMock()),
+    )
+
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights: Dict[str, float] = {}
+    for part in mix.split(","):
+        command, weight = part.split("=")
+        if command not in COMMANDS:
+            raise ValueError(f"unknown command {command}")
+        weights[command] = float(weight)
+    return weights
+
+
+class LoadGenerator:
+    def __init__(self, _db: Database, config: SimpleNamespace, users: List[str], mix: Dict[str, float], use_executor: bool = True, max_concurrent: int = 16) -> None:
+        self._db = _db
+        self.config = config
+        self.users = users
+        self.commands: List[str] = list(mix)
+        self.weights: List[float] = list(mix.values())
+        self.executor: Optional[CommandExecutor] = CommandExecutor(max_concurrent, timeout=10.0) if use_executor else None
+        self.bot: MagicMock = MagicMock(spec=interactions.Client)
+
+    def handler(self, command: str, ctx: MagicMock, user: MagicMock) -> Callable:
+        if command == "tip":
+            recipient: MagicMock = make_user(random.choice(self.users))
+            return lambda: event_handlers.tip_user(self.config, self._db, self.bot, ctx, user, recipient, Balance.from_tao(0.001))
+        if command == "balance":
+            return lambda: event_handlers.do_balance_check(self.config, self._db, ctx, user)
+        if command == "withdraw":
+            return lambda: event_handlers.do_withdraw(self.config, self._db, ctx, user, "5LoadWithdrawDestination", Balance.from_tao(0.001))
+        return lambda: event_handlers.do_deposit(self.config, self._db, ctx, user)
+
+    async def interact(self, interaction: Interaction) -> None:
+        user: MagicMock = make_user(random.choice(self.users))
+        ctx: MagicMock = make_ctx(interaction, user)
+        handler: Callable = self.handler(interaction.command, ctx, user)
+
+        async def run() -> None:
+            try:
+                await handler()
+            finally:
+                interaction.done = time.perf_counter()
+
+        try:
+            if self.executor is not None:
+                await self.executor.run(ctx, run)
+            else:
+                await run()
+        except Exception as e:
+            interaction.error = repr(e)
+            interaction.done = interaction.done or time.perf_counter()
+
+    async def run(self, rate: float, duration: float, poisson: bool = False) -> List[Interaction]:
+        """
+        Starts commands at `rate` per second for `duration` seconds, open loop: a command is
+        started when it is due, whether or not earlier ones are done.
+        """
+        interactions_: List[Interaction] = []
+        tasks: List[asyncio.Task] = []
+        start: float = time.perf_counter()
+        due: float = start
+        for _ in range(max(int(rate * duration), 1)):
+            delay: float = due - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            interaction: Interaction = Interaction(random.choices(self.commands, self.weights)[0], due)
+            interactions_.append(interaction)
+            tasks.append(asyncio.ensure_future(self.interact(interaction)))
+            due += random.expovariate(rate) if poisson else 1.0 / rate
+        await asyncio.gather(*tasks)
+        # the executor doesn't wait for handlers past its timeout
+        while any(interaction.done is None for interaction in interactions_):
+            await asyncio.sleep(0.05)
+        return interactions_
+
+
+def summarize(rate: float, duration: float, interactions_: List[Interaction]) -> Dict:
+    def latencies(selected: List[Interaction], attr: str) -> Dict:
+        values: List[float] = [getattr(i, attr) - i.due for i in selected if getattr(i, attr) is not None]
+        return {
+            "p50_ms": round(percentile(values, 0.50) * 1000, 1),
+            "p90_ms": round(percentile(values, 0.90) * 1000, 1),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 1),
+            "max_ms": round(max(values, default=0.0) * 1000, 1),
+        }
+
+    acked: List[float] = [i.ack - i.due for i in interactions_ if i.ack is not None]
+    missed: int = sum(1 for latency in acked if latency > DEADLINE) + sum(1 for i in interactions_ if i.ack is None)
+    first_due: float = min(i.due for i in interactions_)
+    last_done: float = max(i.done for i in interactions_)
+    return {
+        "rate": rate,
+        "commands": len(interactions_),
+        "completed_per_s": round(len(interactions_) / max(last_done - first_due, duration), 2),
+        "errors": sum(1 for i in interactions_ if i.error is not None),
+        "deadline_missed": missed,
+        "deadline_missed_pct": round(100.0 * missed / len(interactions_), 2),
+        "ack": latencies(interactions_, "ack"),
+        "done": latencies(interactions_, "done"),
+        "by_command": {
+            command: {"ack": latencies(selected, "ack"), "done": latencies(selected, "done")}
+            for command in COMMANDS
+            for selected in [[i for i in interactions_ if i.command == command]]
+            if selected
+        },
+    }
+
+
+async def run_load(options: SimpleNamespace) -> List[Dict]:
+    random.seed(options.seed)
+    api: FakeAPI = FakeAPI(options.rpc_latency)
+    _db: Database = make_db(options.mongo_uri, api)
+    key: bytes = new_key()
+    users: List[str] = seed(_db, api.subtensor, key, options.users, SEED_BALANCE)
+    if options.mongo_latency > 0:
+        _db.db = SlowDatabase(_db.db, options.mongo_latency)
+
+    # the guild channel commands come from, as the gateway would have cached it
+    entity_cache.channel_types.set(str(CHANNEL_ID), interactions.ChannelType.GUILD_TEXT)
+    config: SimpleNamespace = SimpleNamespace(
+        COLDKEY_SECRET=key, MAINTAINER="<@!1>", BITTENSOR_DISCORD_SERVER=GUILD_ID, SHOW_BALANCE_STALENESS=True,
+    )
+    generator: LoadGenerator = LoadGenerator(_db, config, users, options.mix, options.executor, options.max_concurrent)
+
+    results: List[Dict] = []
+    for rate in options.rates:
+        print(f"{rate} commands/s for {options.duration}s...", file=sys.stderr)
+        output = contextlib.nullcontext() if options.verbose else contextlib.redirect_stdout(io.StringIO())
+        with output:
+            interactions_: List[Interaction] = await generator.run(rate, options.duration, options.poisson)
+        result: Dict = summarize(rate, options.duration, interactions_)
+        results.append(result)
+        print(f"  ack p99 {result['ack']['p99_ms']}ms, {result['deadline_missed_pct']}% past {DEADLINE:.0f}s", file=sys.stderr)
+        if result["deadline_missed_pct"] > options.stop_above:
+            print("  saturated, not going higher", file=sys.stderr)
+            break
+    return results
+
+
+def print_curve(results: List[Dict]) -> None:
+    print(f"{'rate/s':>8} {'done/s':>8} {'ack p50':>9} {'ack p99':>9} {'done p99':>9} {'>3s %':>7} {'errors':>7}")
+    width: int = 40
+    longest: float = max((r["ack"]["p99_ms"] for r in results), default=0.0) or 1.0
+    for r in results:
+        bar: str = "#" * int(width * r["ack"]["p99_ms"] / longest)
+        print(f"{r['rate']:>8.1f} {r['completed_per_s']:>8.1f} {r['ack']['p50_ms']:>9.1f} {r['ack']['p99_ms']:>9.1f} {r['done']['p99_ms']:>9.1f} {r['deadline_missed_pct']:>7.2f} {r['errors']:>7} {bar}")
+
+    sustained: List[Dict] = [r for r in results if r["deadline_missed_pct"] <= 1.0]
+    if sustained:
+        print(f"Sustained up to {max(r['rate'] for r in sustained)} commands/s with 99% acknowledged within {DEADLINE:.0f}s")
+    else:
+        print(f"No rate had 99% acknowledged within {DEADLINE:.0f}s")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m taotip.bench.load", description="Saturation curve of concurrent commands against event_handlers")
+    parser.add_argument("--rates", default="5,10,20,50,100", help="comma separated commands per second, run in order")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds at each rate")
+    parser.add_argument("--mix", default="tip=0.4,balance=0.4,withdraw=0.1,deposit=0.1", help="command=weight, out of: " + ", ".join(COMMANDS))
+    parser.add_argument("--users", type=int, default=1000, help="seeded users with an address and a balance")
+    parser.add_argument("--rpc-latency", type=float, default=0.05, help="seconds added to every fake chain call (blocking)")
+    parser.add_argument("--mongo-latency", type=float, default=0.001, help="seconds added to every Mongo call (blocking)")
+    parser.add_argument("--mongo-uri", default=None, help="a local Mongo to use instead of mongomock; its taotip_bench database is dropped")
+    parser.add_argument("--max-concurrent", type=int, default=16, help="the executor's COMMAND_CONCURRENCY")
+    parser.add_argument("--no-executor", dest="executor", action="store_false", help="call the handlers directly, without deferring")
+    parser.add_argument("--poisson", action="store_true", help="exponential gaps between commands instead of even ones")
+    parser.add_argument("--stop-above", type=float, default=50.0, help="stop once this percentage of commands miss the deadline")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="where to save the results, by default under taotip/bench/results")
+    parser.add_argument("--verbose", action="store_true", help="keep the handlers' output")
+    args = parser.parse_args()
+
+    try:
+        mix: Dict[str, float] = parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    options: SimpleNamespace = SimpleNamespace(
+        rates=[float(rate) for rate in args.rates.split(",") if rate], duration=args.duration, mix=mix, users=args.users,
+        rpc_latency=args.rpc_latency, mongo_latency=args.mongo_latency, mongo_uri=args.mongo_uri,
+        max_concurrent=args.max_concurrent, executor=args.executor, poisson=args.poisson,
+        stop_above=args.stop_above, seed=args.seed, verbose=args.verbose,
+    )
+    results: List[Dict] = asyncio.run(run_load(options))
+
+    commit: Optional[str] = git_commit()
+    output: str = args.output or os.path.join(RESULTS_DIR, f"load-{datetime.now():%Y%m%d-%H%M%S}-{commit or 'nogit'}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump({"commit": commit, "time": datetime.now().isoformat(timespec="seconds"), "options": vars(options), "results": results}, f, indent=2)
+
+    print_curve(results)
+    print(f"Saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
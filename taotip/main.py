@@ -1,18 +1,37 @@
 import asyncio
+import functools
+import re
+import time
+from datetime import datetime, timedelta
 import interactions
 
-from typing import List, Union
+from typing import List, Optional, Union
 
-from bittensor import Balance
+from src.balance import Balance
 
 from src import api, event_handlers
+from src.cache import entity_cache
 from src.config import main_config as config, Config
 from src.db import Database
+from src.events import ADDRESS_ACTIVE, ADDRESS_ASSIGNED, BALANCE_CHANGED, ChangeStreamListener, EventRelay
+from src.executor import CommandExecutor, configure_blocking
+from src.startup import Readiness
+from src.jobs import JobQueue, JobWorkerPool
+from src.leader import LeaderElection
+from src.memory import memory_monitor
+from src.metrics import COMMAND_SECONDS, PENDING_JOBS, MetricsServer, registry, timed
+from src.polling import DepositPoller, PollSchedule
+from src.profiling import MODES as PROFILE_MODES, ProfileSession, profiled, profiler
+from src.tracing import trace_discord_requests, tracer
+from src.watchdog import LoopWatchdog
 
 
 _db: Database = None
 _api: api.API = None
 
+# commands /profile can profile, by the name they are profiled under
+PROFILED_COMMANDS: List[str] = ["help", "Tip User", "tip_user_form", "tip", "rain", "balance", "deposit", "withdraw"]
+
 def make_modal(user_id: str, amount: float = 0.0) -> str:
     tip_modal = interactions.Modal(
         title="Tip User",
@@ -49,157 +68,480 @@ def main() -> None:
     )
 
     bot = interactions.Client(token=config.DISCORD_TOKEN)
+    # acknowledges slow commands at once and answers them with follow-ups
+    executor: CommandExecutor = CommandExecutor(config.COMMAND_CONCURRENCY, config.COMMAND_TIMEOUT)
+    configure_blocking(config.BLOCKING_THREADS)
     
-    async def init():
-        _api, _db = await event_handlers.on_ready_(bot, config)
+    # set once subtensor and mongo are connected, commands answer until then
+    readiness: Readiness = Readiness()
+
+    if config.METRICS_PORT:
+        try:
+            MetricsServer(registry, config.METRICS_HOST, config.METRICS_PORT).start()
+        except OSError as e:
+            # the bot runs without metrics rather than not at all
+            print(e, "main.metrics")
+
+    if config.TRACE_FILE:
+        tracer.configure(config.TRACE_FILE, config.TRACE_SAMPLE_RATE, config.TRACE_SLOW_THRESHOLD, config.TRACE_MAX_BYTES, config.TRACE_BACKUP_COUNT)
+
+    if config.LOOP_WATCHDOG:
+        LoopWatchdog(config.LOOP_LAG_THRESHOLD, summary_interval=config.LOOP_WATCHDOG_SUMMARY_INTERVAL).start(bot._loop)
+
+    # off until the maintainer asks for a profile with /profile
+    profiler.configure(config.PROFILE_DIR, config.PROFILE_TOP, config.PROFILE_SAMPLE_INTERVAL)
 
-        if _api is None or _db is None:
-            print("Failed to initialize\nRetrying in 5s...")
-            await asyncio.sleep(5)  # wait 5 seconds
-            await init()
+    async def send_profile(session: ProfileSession, report: str, path: Union[str, None]) -> None:
+        if len(report) > 1800:
+            report = report[:1800].rsplit("\n", 1)[0] + "\n..."
+        saved: str = f", the full report is in {path}" if path is not None else ""
+        await event_handlers.send_dm(config, bot, config.MAINTAINER[3:-1], f"Profile of {session.command}{saved}\n```\n{report}\n```")
+
+    profiler.on_report = send_profile
+
+    memory_monitor.configure(config.MEMORY_SNAPSHOT_INTERVAL, config.MEMORY_TRACE_FRAMES, config.MEMORY_TOP)
+    if config.MEMORY_DIAGNOSTICS:
+        memory_monitor.start(bot._loop)
+
+    async def init():
+        global _api, _db
+        try:
+            _api, _db = await event_handlers.on_ready_(bot, config)
+        except Exception as e:
+            print(e)
+            print("Failed to initialize, exiting...")
+            # ends bot.start() so the process exits and is restarted
+            bot._loop.stop()
             return
-        else:
-            print("Initialized!")
-
-        @bot.event
-        async def on_start():
-            # add to client loop
-            bot._loop.create_task(welcome_new_users(_db, bot, config))
-
-        @bot.command(
-            name="help",
-            description="Show help",
-        )
-        async def help(ctx: interactions.CommandContext):
-            await ctx.send(config.HELP_STR, ephemeral=True)
-
-
-        @bot.user_command(
-            name="Tip User",
-        )
-        async def tip_user_command(ctx: interactions.CommandContext) -> None:
-            """
-            Tip a user
-            """
-            modal: interactions.Modal = make_modal(ctx.target.user.id)
-
-            await ctx.popup(modal)
-
-        @bot.modal("tip_user_form")
-        async def tip_user_modal_response(ctx: interactions.CommandContext, recipient: str, amount: str):
-            """
-            Handle the tip user modal response
-            """
-            try:
-                amount = float(amount)
-            except ValueError:
-                await ctx.send(f"Invalid amount: {amount} . Should be numeric", ephemeral=True)
-                return interactions.StopCommand()
 
-            if amount <= 0.0:
-                await ctx.send(f"Invalid amount: {amount} . Must be >= 0.0 tao", ephemeral=True)
-                return interactions.StopCommand()
+        if config.JOB_WORKERS > 0:
+            # tips and withdrawals are queued and run by workers
+            _db.jobs = JobQueue(_db.db, config.JOB_LEASE_TIME)
+            PENDING_JOBS.set_function(_db.jobs.pending_count)
+
+        # every instance answers commands, only the leader welcomes users and reads deposits
+        election: LeaderElection = LeaderElection(_db.db, lease_time=config.LEADER_LEASE_TIME)
+        relay: EventRelay = EventRelay(_db.db, _db.events, election.instance_id, poll_interval=config.EVENT_RELAY_INTERVAL, skew=config.EVENT_RELAY_SKEW)
+        election.add("welcome_new_users", lambda: welcome_new_users(_db, bot, config))
+        election.add("check_for_deposits", lambda: check_for_deposits(_db, _api, config))
+        # events of the instances that were still running during a failover are replayed
+        election.add("relay", lambda: relay.replay(datetime.utcnow() - timedelta(seconds=config.LEADER_LEASE_TIME), (ADDRESS_ASSIGNED, ADDRESS_ACTIVE)))
+        bot._loop.create_task(relay.forward())
+        # every instance drops the cached balances changed by the others
+        bot._loop.create_task(relay.replay(datetime.utcnow(), (BALANCE_CHANGED,)))
+        bot._loop.create_task(_db.forget_changed_balances())
+        bot._loop.create_task(election.run())
+        if _db.jobs is not None:
+            JobWorkerPool(
+                _db.jobs,
+                {
+                    "tip": functools.partial(event_handlers.run_tip_job, config, _db, bot),
+                    "withdraw": functools.partial(event_handlers.run_withdraw_job, config, _db, bot),
+                    "rain": functools.partial(event_handlers.run_rain_job, config, _db, bot),
+                },
+                config.JOB_WORKERS,
+                config.JOB_POLL_INTERVAL,
+                on_failure=functools.partial(event_handlers.on_job_failure, config, bot),
+            ).start(bot._loop)
+
+        readiness.set()
+        print("Initialized!")
+
+    @bot.event
+    async def on_start():
+        print('We have logged in as {}'.format(bot.me.name))
+        # the HTTP client exists once logged in
+        trace_discord_requests(bot._http)
+
+    @bot.event
+    async def on_interaction_create(ctx: interactions.context._Context):
+        entity_cache.observe(ctx)
+
+    @bot.event
+    async def on_guild_create(guild: interactions.Guild):
+        for channel in guild.channels or []:
+            entity_cache.observe_channel(channel)
+
+    @bot.event
+    async def on_channel_create(channel: interactions.Channel):
+        entity_cache.observe_channel(channel)
+
+    @bot.event
+    async def on_channel_update(channel: interactions.Channel):
+        entity_cache.observe_channel(channel)
+
+    @bot.event
+    async def on_channel_delete(channel: interactions.Channel):
+        entity_cache.forget_channel(channel.id)
+
+    @bot.event
+    async def on_guild_member_add(member: interactions.GuildMember):
+        entity_cache.observe_member(member.guild_id, member)
+
+    @bot.event
+    async def on_guild_member_update(member: interactions.GuildMember):
+        entity_cache.observe_member(member.guild_id, member)
+
+    @bot.event
+    async def on_guild_member_remove(member: interactions.GuildMember):
+        entity_cache.forget_member(member.guild_id, member.user.id)
+
+    @bot.command(
+        name="help",
+        description="Show help",
+    )
+    @timed(COMMAND_SECONDS, "help", root=True)
+    @profiled("help")
+    async def help(ctx: interactions.CommandContext):
+        await ctx.send(config.HELP_STR, ephemeral=True)
+
+
+    @bot.user_command(
+        name="Tip User",
+    )
+    @timed(COMMAND_SECONDS, "Tip User", root=True)
+    @profiled("Tip User")
+    async def tip_user_command(ctx: interactions.CommandContext) -> None:
+        """
+        Tip a user
+        """
+        modal: interactions.Modal = make_modal(ctx.target.user.id)
+
+        await ctx.popup(modal)
+
+    @bot.modal("tip_user_form")
+    @timed(COMMAND_SECONDS, "tip_user_form", root=True)
+    @profiled("tip_user_form")
+    async def tip_user_modal_response(ctx: interactions.CommandContext, recipient: str, amount: str):
+        """
+        Handle the tip user modal response
+        """
+        if not await readiness.check(ctx):
+            return interactions.StopCommand()
+        try:
+            tip_amount: Balance = Balance.parse_tao(amount)
+        except ValueError:
+            await ctx.send(f"Invalid amount: {amount} . Should be numeric", ephemeral=True)
+            return interactions.StopCommand()
+
+        if tip_amount.rao <= 0:
+            await ctx.send(f"Invalid amount: {amount} . Must be >= 0.0 tao", ephemeral=True)
+            return interactions.StopCommand()
+
+        async def send_tip():
             try:
-                guild: interactions.Guild = await ctx.get_guild()
-                recipient: interactions.Member = await guild.get_member(int(recipient))
-                if recipient.user.bot:
-                    await ctx.send(f"{recipient.user.name} is a bot. You cannot tip them", ephemeral=True)
-                    return interactions.StopCommand()
+                member: interactions.Member = await entity_cache.get_member(bot, ctx.guild_id, recipient)
+                if member is None:
+                    raise ValueError("not a member")
+                if member.user.bot:
+                    await ctx.send(f"{member.user.name} is a bot. You cannot tip them", ephemeral=True)
+                    return
             except ValueError:
                 await ctx.send("Invalid recipient", ephemeral=True)
-                return interactions.StopCommand()
-            
-            await ctx.defer()
-            await event_handlers.tip_user(config, _db, bot, ctx, ctx.user, recipient.user, Balance.from_tao(amount))
-
-        @bot.command(
-            name="tip",
-            description="Tip a user with TAO",
-            dm_permission=False, # only allow in guild, not DMs
-            options = [
-                interactions.Option(
-                    name="recipient",
-                    description="The user to tip",
-                    type=interactions.OptionType.USER,
-                    required=True,
-                ),
-                interactions.Option(
-                    name="amount",
-                    description="How much TAO to tip",
-                    type=interactions.OptionType.NUMBER,
-                    required=True,
-                ),
-            ],
-        )
-        @interactions.autodefer(5)
-        async def tip(ctx: interactions.CommandContext, recipient: interactions.Member, amount: Union[float, int]):
-            sender: interactions.User = ctx.user
-            recipient: interactions.User = recipient.user
-            if (recipient == sender):
-                await ctx.send("You can't tip yourself!", ephemeral=True)
-                return interactions.StopCommand()
-
-            if (recipient.bot  and not config.TESTING):
-                await ctx.send(f"You can't tip bots!", ephemeral=True)
-                return interactions.StopCommand()
-
-            amount: Balance = Balance.from_tao(amount)
-
-            if (amount <= 0.0):
-                await ctx.send("Invalid amount", ephemeral=True)
-                return interactions.StopCommand()
+                return
+
+            await event_handlers.tip_user(config, _db, bot, ctx, ctx.user, member.user, tip_amount)
+
+        await executor.run(ctx, send_tip)
+
+    @bot.command(
+        name="tip",
+        description="Tip a user with TAO",
+        dm_permission=False, # only allow in guild, not DMs
+        options = [
+            interactions.Option(
+                name="recipient",
+                description="The user to tip",
+                type=interactions.OptionType.USER,
+                required=True,
+            ),
+            interactions.Option(
+                name="amount",
+                description="How much TAO to tip",
+                type=interactions.OptionType.NUMBER,
+                required=True,
+            ),
+        ],
+    )
+    @timed(COMMAND_SECONDS, "tip", root=True)
+    @profiled("tip")
+    async def tip(ctx: interactions.CommandContext, recipient: interactions.Member, amount: Union[float, int]):
+        if not await readiness.check(ctx):
+            return interactions.StopCommand()
+        sender: interactions.User = ctx.user
+        recipient: interactions.User = recipient.user
+        if (recipient == sender):
+            await ctx.send("You can't tip yourself!", ephemeral=True)
+            return interactions.StopCommand()
+
+        if (recipient.bot  and not config.TESTING):
+            await ctx.send(f"You can't tip bots!", ephemeral=True)
+            return interactions.StopCommand()
+
+        amount: Balance = Balance.from_tao(amount)
+
+        if (amount <= 0.0):
+            await ctx.send("Invalid amount", ephemeral=True)
+            return interactions.StopCommand()
+
+        # check if sender has enough TAO
+        if not (await event_handlers.check_enough_tao(config, _db, ctx, sender, amount)):
+            return interactions.StopCommand()
+
+        # create modal
+        modal = make_modal(recipient.id, amount.tao)
+        await ctx.popup(modal)
+        await ctx.send("Done.", ephemeral=True)
+
+    @bot.command(
+        name="rain",
+        description="Split TAO between many users",
+        dm_permission=False, # only allow in guild, not DMs
+        options = [
+            interactions.Option(
+                name="recipients",
+                description="The users to tip, as @mentions",
+                type=interactions.OptionType.STRING,
+                required=True,
+            ),
+            interactions.Option(
+                name="amount",
+                description="How much TAO to split between them",
+                type=interactions.OptionType.NUMBER,
+                required=True,
+            ),
+        ],
+    )
+    @timed(COMMAND_SECONDS, "rain", root=True)
+    @profiled("rain")
+    async def rain(ctx: interactions.CommandContext, recipients: str, amount: Union[float, int]):
+        if not await readiness.check(ctx):
+            return interactions.StopCommand()
+        sender: interactions.User = ctx.user
+        # unique mentioned user ids, in order
+        recipient_ids: List[str] = list(dict.fromkeys(re.findall(r"<@!?(\d+)>", recipients)))
+        recipient_ids = [recipient for recipient in recipient_ids if recipient != str(sender.id)]
+        if (len(recipient_ids) == 0):
+            await ctx.send("Mention at least one user to rain on", ephemeral=True)
+            return interactions.StopCommand()
+        if (len(recipient_ids) > config.RAIN_MAX_RECIPIENTS):
+            await ctx.send(f"You can rain on at most {config.RAIN_MAX_RECIPIENTS} users", ephemeral=True)
+            return interactions.StopCommand()
+
+        amount: Balance = Balance.from_tao(amount)
+        if (amount.rao < len(recipient_ids)):
+            await ctx.send("Invalid amount", ephemeral=True)
+            return interactions.StopCommand()
+
+        async def send_rain():
+            members: List[interactions.Member] = await asyncio.gather(
+                *[entity_cache.get_member(bot, ctx.guild_id, recipient) for recipient in recipient_ids], return_exceptions=True
+            )
+            tippable: List[str] = [
+                recipient for recipient, member in zip(recipient_ids, members)
+                if isinstance(member, interactions.Member) and (config.TESTING or not member.user.bot)
+            ]
+            if (len(tippable) == 0):
+                await ctx.send("None of the mentioned users can be tipped", ephemeral=True)
+                return
 
             # check if sender has enough TAO
             if not (await event_handlers.check_enough_tao(config, _db, ctx, sender, amount)):
-                return interactions.StopCommand()
-
-            # create modal
-            modal = make_modal(recipient.id, amount.tao)
-            await ctx.popup(modal)
-            await ctx.send("Done.", ephemeral=True)
-
-        @bot.command(
-            name="balance",
-            description="Check your balance",
-        )
-        async def balance(ctx: interactions.CommandContext):
-            await event_handlers.do_balance_check(config, _db, ctx, ctx.user)
-        
-        @bot.command(
-            name="deposit",
-            description="Deposit TAO to your tip wallet",
-        )
-        async def deposit(ctx: interactions.CommandContext):
-            await event_handlers.do_deposit(config, _db, ctx, ctx.user)
-
-        @bot.command(
-            name="withdraw",
-            description="Withdraw TAO from your tip wallet",
-            options=[
-                interactions.Option(
-                    name="ss58_address",
-                    description="The address to withdraw to",
-                    type=interactions.OptionType.STRING,
-                    required=True,
-                ),
-                interactions.Option(
-                    name="amount",
-                    description="How much TAO to withdraw",
-                    type=interactions.OptionType.NUMBER,
-                    required=True,
-                ),
-            ]
-        )
-        async def withdraw(ctx: interactions.CommandContext, ss58_address: str, amount: Union[float, int]):
-            await event_handlers.do_withdraw(config, _db, ctx, ctx.user, ss58_address, Balance.from_tao(amount))
+                return
+
+            await event_handlers.rain(config, _db, bot, ctx, sender, tippable, amount)
+
+        await executor.run(ctx, send_rain)
+
+    @bot.command(
+        name="balance",
+        description="Check your balance",
+        options=[
+            interactions.Option(
+                name="refresh",
+                description="Re-read your balance from the chain",
+                type=interactions.OptionType.BOOLEAN,
+                required=False,
+            ),
+        ],
+    )
+    @timed(COMMAND_SECONDS, "balance", root=True)
+    @profiled("balance")
+    async def balance(ctx: interactions.CommandContext, refresh: bool = False):
+        if not await readiness.check(ctx):
+            return interactions.StopCommand()
+        await executor.run(ctx, lambda: event_handlers.do_balance_check(config, _db, ctx, ctx.user, refresh),
+            # known without a request, so the defer isn't delayed
+            ephemeral=ctx.guild_id is not None)
+
+    @bot.command(
+        name="deposit",
+        description="Deposit TAO to your tip wallet",
+    )
+    @timed(COMMAND_SECONDS, "deposit", root=True)
+    @profiled("deposit")
+    async def deposit(ctx: interactions.CommandContext):
+        if not await readiness.check(ctx):
+            return interactions.StopCommand()
+        await executor.run(ctx, lambda: event_handlers.do_deposit(config, _db, ctx, ctx.user),
+            ephemeral=ctx.guild_id is not None)
+
+    @bot.command(
+        name="withdraw",
+        description="Withdraw TAO from your tip wallet",
+        options=[
+            interactions.Option(
+                name="ss58_address",
+                description="The address to withdraw to",
+                type=interactions.OptionType.STRING,
+                required=True,
+            ),
+            interactions.Option(
+                name="amount",
+                description="How much TAO to withdraw",
+                type=interactions.OptionType.NUMBER,
+                required=True,
+            ),
+        ]
+    )
+    @timed(COMMAND_SECONDS, "withdraw", root=True)
+    @profiled("withdraw")
+    async def withdraw(ctx: interactions.CommandContext, ss58_address: str, amount: Union[float, int]):
+        if not await readiness.check(ctx):
+            return interactions.StopCommand()
+        await executor.run(ctx, lambda: event_handlers.do_withdraw(config, _db, ctx, ctx.user, ss58_address, Balance.from_tao(amount)),
+            ephemeral=ctx.guild_id is not None)
+
+    @bot.command(
+        name="profile",
+        description="Profile the next calls of a command (maintainer only)",
+        default_member_permissions=interactions.Permissions.ADMINISTRATOR,
+        options=[
+            interactions.Option(
+                name="command",
+                description="The command to profile",
+                type=interactions.OptionType.STRING,
+                required=True,
+                choices=[interactions.Choice(name=name, value=name) for name in PROFILED_COMMANDS],
+            ),
+            interactions.Option(
+                name="invocations",
+                description="How many calls to profile",
+                type=interactions.OptionType.INTEGER,
+                required=False,
+            ),
+            interactions.Option(
+                name="seconds",
+                description="Or for how long",
+                type=interactions.OptionType.NUMBER,
+                required=False,
+            ),
+            interactions.Option(
+                name="mode",
+                description="sample (default, cheap) or deterministic (every call, slower)",
+                type=interactions.OptionType.STRING,
+                required=False,
+                choices=[interactions.Choice(name=mode, value=mode) for mode in PROFILE_MODES],
+            ),
+            interactions.Option(
+                name="stop",
+                description="End the current profile now and send its report",
+                type=interactions.OptionType.BOOLEAN,
+                required=False,
+            ),
+        ],
+    )
+    async def profile(ctx: interactions.CommandContext, command: str, invocations: int = None, seconds: float = None, mode: str = "sample", stop: bool = False):
+        if str(ctx.user.id) != config.MAINTAINER[3:-1]:
+            await ctx.send("Only the maintainer can profile commands", ephemeral=True)
+            return interactions.StopCommand()
+
+        if stop:
+            session: Union[ProfileSession, None] = profiler.cancel()
+            await ctx.send(f"Stopped profiling {session.command}" if session is not None else "Nothing is being profiled", ephemeral=True)
+            return
+
+        try:
+            profiler.arm(command, mode, invocations, seconds)
+        except ValueError as e:
+            await ctx.send(str(e).capitalize(), ephemeral=True)
+            return interactions.StopCommand()
+        await ctx.send(f"Profiling {command}, the report will be sent to you", ephemeral=True)
+
+    @bot.command(
+        name="memory",
+        description="Show what the bot's memory grows with (maintainer only)",
+        default_member_permissions=interactions.Permissions.ADMINISTRATOR,
+        options=[
+            interactions.Option(
+                name="snapshot",
+                description="Take a snapshot now instead of reporting the last one",
+                type=interactions.OptionType.BOOLEAN,
+                required=False,
+            ),
+        ],
+    )
+    async def memory(ctx: interactions.CommandContext, snapshot: bool = False):
+        if str(ctx.user.id) != config.MAINTAINER[3:-1]:
+            await ctx.send("Only the maintainer can see memory diagnostics", ephemeral=True)
+            return interactions.StopCommand()
+
+        # walking the heap can take longer than the 3s to answer
+        await ctx.defer(ephemeral=True)
+        if snapshot or memory_monitor.last is None:
+            await memory_monitor.snapshot()
+        report: str = memory_monitor.report()
+        if len(report) > 1900:
+            report = report[:1900].rsplit("\n", 1)[0] + "\n..."
+        await ctx.send(f"```\n{report}\n```", ephemeral=True)
 
     async def welcome_new_users(
         _db: Database, client: interactions.Client, config: Config
     ):
+        new_users: asyncio.Queue = _db.events.subscribe(ADDRESS_ASSIGNED)
+        listener: Optional[ChangeStreamListener] = None
+        if config.WELCOME_CHANGE_STREAM:
+            listener = ChangeStreamListener(_db.db.addresses, _db.events)
+            listener.start()
+        try:
+            await welcome_loop(_db, client, config, new_users)
+        finally:
+            # cancelled when another instance becomes the leader
+            _db.events.unsubscribe(ADDRESS_ASSIGNED, new_users)
+            if listener is not None:
+                listener.stop()
+
+    async def welcome_loop(
+        _db: Database, client: interactions.Client, config: Config, new_users: asyncio.Queue
+    ):
+        next_scan: float = 0.0
         while True:
-            await event_handlers.welcome_new_users(_db, client, config)
-            # sleep until next check
-            await asyncio.sleep(config.NEW_USER_CHECK_INTERVAL)
+            try:
+                timeout: float = next_scan - time.monotonic()
+                if timeout <= 0:
+                    # safety net, for users missed by the events (e.g. while the bot was down)
+                    next_scan = time.monotonic() + config.NEW_USER_CHECK_INTERVAL
+                    await event_handlers.welcome_new_users(_db, client, config)
+                    continue
+
+                try:
+                    users: List[str] = [await asyncio.wait_for(new_users.get(), timeout)]
+                except asyncio.TimeoutError:
+                    continue
+                while not new_users.empty():
+                    users.append(new_users.get_nowait())
+                await event_handlers.welcome_new_users(_db, client, config, list(dict.fromkeys(users)))
+            except Exception as e:
+                print(e, "main.welcome_new_users")
+
+    async def check_for_deposits(
+        _db: Database, _api: api.API, config: Config
+    ):
+        # keeps the balance read model up to date, reading active addresses more often
+        schedule: PollSchedule = PollSchedule(config.DEPOSIT_INTERVAL, config.POLL_MAX_INTERVAL, config.DEP_ACTIVE_TIME)
+        # logged once every address has been read from the chain
+        await DepositPoller(_db, _api, schedule, config.CHECK_ALL_INTERVAL, config.POLL_BATCH_SIZE,
+            on_first_pass=lambda: event_handlers.log_wallet_balance(_db)).run()
 
     bot._loop.create_task(init())
     bot.start()
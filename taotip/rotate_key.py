@@ -0,0 +1,40 @@
+import argparse
+
+import pymongo
+
+from src.config import main_config as config
+from src.db import Database
+from src.rotation import KeyRotation
+
+parser = argparse.ArgumentParser(description="Re-encrypt every mnemonic with the first key of COLDKEY_SECRET = [new key, old key], while the bot runs. Re-run to resume.")
+parser.add_argument("--workers", help="Processes re-encrypting", type=int, default=2)
+parser.add_argument("--batch-size", help="Addresses per bulk write", type=int, default=500)
+parser.add_argument("--max-rate", help="Addresses re-encrypted per second at most", type=float, default=2000.0)
+parser.add_argument("--max-write-latency", help="Seconds a bulk write may take before slowing down", type=float, default=0.1)
+parser.add_argument("--status", help="Only print how many addresses are left on the old keys", action="store_true")
+
+
+if __name__ == "__main__":
+    args = parser.parse_args()
+
+    if isinstance(config.COLDKEY_SECRET, bytes):
+        print("Set COLDKEY_SECRET to [new key, old key] and restart the bot first")
+        exit(1)
+
+    mongo_uri = config.MONGO_URI_TEST if config.TESTING else config.MONGO_URI
+    _db = Database(pymongo.MongoClient(mongo_uri), None, config.TESTING)
+    rotation = KeyRotation(_db.db, config.COLDKEY_SECRET, args.workers, args.batch_size, args.max_rate, args.max_write_latency)
+
+    if not args.status:
+        try:
+            rotation.run()
+        except (Exception, KeyboardInterrupt) as e:
+            print(repr(e))
+            print("Rotation interrupted, run the same command again to resume")
+            exit(1)
+
+    remaining = rotation.remaining()
+    if remaining > 0:
+        print(f"{remaining} addresses are still on the old keys, run again to re-encrypt them")
+        exit(1)
+    print("Every mnemonic is on the new key, the old ones can be removed from COLDKEY_SECRET")
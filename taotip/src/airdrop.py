@@ -0,0 +1,268 @@
+import hashlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pymongo
+import pymongo.errors
+from .balance import Balance
+from substrateinterface import Keypair
+
+from .db import Address, Database
+
+
+def ref_time(weight: Any) -> int:
+    """
+    Weights are plain integers on older runtimes and {ref_time, proof_size} on newer ones.
+    """
+    if isinstance(weight, dict):
+        return int(weight["ref_time"])
+    return int(weight)
+
+
+def compose_batch(substrate, transfers: List[Tuple[str, int]]):
+    calls = [
+        substrate.compose_call(
+            call_module='Balances',
+            call_function='transfer',
+            call_params={
+                'dest': dest,
+                'value': amount
+            }
+        ) for dest, amount in transfers
+    ]
+    return substrate.compose_call(
+        call_module='Utility',
+        call_function='batch',
+        call_params={
+            'calls': calls
+        }
+    )
+
+
+def max_batch_size(substrate, treasury: str, dest: str, weight_fraction: float) -> int:
+    """
+    How many transfers fit in one utility.batch, keeping its weight under
+    weight_fraction of the largest normal extrinsic the chain accepts.
+    """
+    block_weights: Dict = substrate.get_constant('System', 'BlockWeights').value
+    normal: Dict = block_weights['per_class']['normal']
+    limit: Any = normal.get('max_extrinsic') or normal.get('max_total') or block_weights['max_block']
+
+    keypair: Keypair = Keypair(ss58_address=treasury)
+    one: int = ref_time(substrate.get_payment_info(compose_batch(substrate, [(dest, 1)]), keypair)['weight'])
+    two: int = ref_time(substrate.get_payment_info(compose_batch(substrate, [(dest, 1), (dest, 1)]), keypair)['weight'])
+    per_transfer: int = max(1, two - one)
+    base: int = one - per_transfer
+
+    return max(1, int((ref_time(limit) * weight_fraction - base) // per_transfer))
+
+
+def extrinsic_hash(extrinsic) -> str:
+    return "0x" + hashlib.blake2b(extrinsic.data.data, digest_size=32).hexdigest()
+
+
+class AirdropCheckpoint:
+    """
+    Progress of one airdrop run, stored in the airdrop_recipients collection.
+
+    A recipient is pending, then submitted (with the nonce and hash of its extrinsic),
+    then done or failed. Recipients are marked submitted before the extrinsic is sent,
+    so a resumed run never builds a second extrinsic for them: it either finds the
+    nonce consumed, or re-sends with the same nonce, which the chain includes at most once.
+    """
+    def __init__(self, db: Database, run_id: str, treasury: str) -> None:
+        self.db = db
+        self.run_id = run_id
+        self.treasury = treasury
+        self.recipients = db.db.airdrop_recipients
+        self.recipients.create_index([("run", pymongo.ASCENDING), ("user", pymongo.ASCENDING)], unique=True)
+        self.recipients.create_index([("run", pymongo.ASCENDING), ("status", pymongo.ASCENDING)])
+
+        run: Optional[Dict] = db.db.airdrops.find_one({"_id": run_id})
+        if run is None:
+            db.db.airdrops.insert_one({"_id": run_id, "treasury": treasury, "created": datetime.now()})
+        elif run["treasury"] != treasury:
+            raise Exception(f"Run {run_id} was started from {run['treasury']}")
+
+    def load(self, recipients: List[Tuple[str, Balance]]) -> int:
+        """
+        Adds recipients not yet in the run. Returns how many were added.
+        """
+        docs: List[Dict] = [{
+            "run": self.run_id,
+            "user": str(user),
+            "amount": amount.rao,
+            "address": None,
+            "status": "pending",
+            "nonce": None,
+        } for user, amount in recipients]
+        if len(docs) == 0:
+            return 0
+        try:
+            return len(self.recipients.insert_many(docs, ordered=False).inserted_ids)
+        except pymongo.errors.BulkWriteError as e:
+            # already loaded by an earlier attempt of this run
+            return e.details["nInserted"]
+
+    async def resolve_addresses(self, key: bytes) -> None:
+        """
+        Looks up the custodial address of every recipient, creating missing ones in bulk.
+        """
+        users: List[str] = [doc["user"] for doc in self.recipients.find({"run": self.run_id, "address": None}, {"user": 1})]
+        if len(users) == 0:
+            return
+        addrs: Dict[str, str] = {
+            user: addr.address for user, addr in self.db.get_addresses_by_users(users).items()
+        }
+        missing: List[str] = [user for user in users if user not in addrs]
+        if len(missing) > 0:
+            addrs.update(await self.db.create_new_addresses(key, missing))
+
+        self.recipients.bulk_write([
+            pymongo.UpdateOne({"run": self.run_id, "user": user}, {"$set": {"address": address}})
+            for user, address in addrs.items()
+        ], ordered=False)
+
+    def reconcile(self, chain_nonce: int) -> int:
+        """
+        Submitted extrinsics whose nonce the chain has consumed were included by an earlier attempt.
+        Returns how many recipients were marked done.
+        """
+        result = self.recipients.update_many({
+            "run": self.run_id,
+            "status": "submitted",
+            "nonce": {"$lt": chain_nonce},
+        }, {
+            "$set": {"status": "done", "unverified": True}
+        })
+        return result.modified_count
+
+    def submitted(self) -> Dict[int, List[Dict]]:
+        """
+        Recipients sent by an earlier attempt whose extrinsic is not included yet, by nonce.
+        """
+        chunks: Dict[int, List[Dict]] = {}
+        for doc in self.recipients.find({"run": self.run_id, "status": "submitted"}):
+            chunks.setdefault(doc["nonce"], []).append(doc)
+        return chunks
+
+    def pending(self) -> List[Dict]:
+        return list(self.recipients.find({"run": self.run_id, "status": "pending", "address": {"$ne": None}}).sort("_id", pymongo.ASCENDING))
+
+    def mark_submitted(self, chunk: List[Dict], nonce: int, ext_hash: str) -> None:
+        self._mark(chunk, {"status": "submitted", "nonce": nonce, "extrinsic_hash": ext_hash})
+
+    def mark_done(self, chunk: List[Dict], block_hash: str) -> None:
+        self._mark(chunk, {"status": "done", "block_hash": block_hash})
+
+    def mark_failed(self, chunk: List[Dict], error: str) -> None:
+        self._mark(chunk, {"status": "failed", "error": error})
+
+    def mark_pending(self, chunk: List[Dict]) -> None:
+        self._mark(chunk, {"status": "pending", "nonce": None})
+
+    def counts(self) -> Dict[str, int]:
+        return {
+            doc["_id"]: doc["count"] for doc in self.recipients.aggregate([
+                {"$match": {"run": self.run_id}},
+                {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+            ])
+        }
+
+    def _mark(self, chunk: List[Dict], fields: Dict) -> None:
+        if len(chunk) == 0:
+            return
+        self.recipients.update_many({
+            "run": self.run_id,
+            "user": {"$in": [doc["user"] for doc in chunk]},
+        }, {
+            "$set": fields
+        })
+
+
+class Airdrop:
+    """
+    Pays every recipient of a checkpoint from the treasury.
+
+    Transfers are packed into utility.batch extrinsics sized to the block weight limit.
+    Nonces are assigned locally, so up to max_in_flight extrinsics are submitted at once,
+    each on its own connection, instead of waiting for every inclusion in turn.
+    """
+    def __init__(self, checkpoint: AirdropCheckpoint, treasury: Address, connect: Callable[[], Any],
+            max_in_flight: int = 4, weight_fraction: float = 0.5, max_batch: Optional[int] = None) -> None:
+        self.checkpoint = checkpoint
+        self.keypair: Keypair = Keypair.create_from_mnemonic(treasury.mnemonic)
+        self.connect = connect # returns a new substrate connection
+        self.max_in_flight = max_in_flight
+        self.weight_fraction = weight_fraction
+        self.max_batch = max_batch
+
+    def run(self) -> Dict[str, int]:
+        substrate = self.connect()
+        chain_nonce: int = substrate.get_account_nonce(self.keypair.ss58_address) or 0
+        included: int = self.checkpoint.reconcile(chain_nonce)
+        if included > 0:
+            print(f"{included} recipients were paid by an earlier attempt")
+
+        # resend what an earlier attempt submitted, with the same nonces
+        chunks: List[Tuple[int, List[Dict]]] = sorted(self.checkpoint.submitted().items())
+        next_nonce: int = max([chain_nonce] + [nonce + 1 for nonce, _ in chunks])
+
+        pending: List[Dict] = self.checkpoint.pending()
+        if len(pending) > 0:
+            size: int = max_batch_size(substrate, self.keypair.ss58_address, pending[0]["address"], self.weight_fraction)
+            if self.max_batch is not None:
+                size = min(size, self.max_batch)
+            print(f"Sending {len(pending)} transfers in batches of {size}")
+            for i in range(0, len(pending), size):
+                chunks.append((next_nonce, pending[i:i + size]))
+                next_nonce += 1
+
+        connections: List[Any] = [substrate] + [self.connect() for _ in range(min(self.max_in_flight, len(chunks)) - 1)]
+        with ThreadPoolExecutor(max_workers=len(connections) or 1) as pool:
+            in_flight: List[Future] = []
+            for i, (nonce, chunk) in enumerate(chunks):
+                if len(in_flight) >= len(connections):
+                    in_flight.pop(0).result()
+                in_flight.append(pool.submit(self._send, connections[i % len(connections)], nonce, chunk))
+            for future in in_flight:
+                future.result()
+
+        return self.checkpoint.counts()
+
+    def _send(self, substrate, nonce: int, chunk: List[Dict]) -> None:
+        call = compose_batch(substrate, [(doc["address"], doc["amount"]) for doc in chunk])
+        extrinsic = substrate.create_signed_extrinsic(call=call, keypair=self.keypair, nonce=nonce, era='00')
+        # checkpoint before sending, see AirdropCheckpoint
+        self.checkpoint.mark_submitted(chunk, nonce, extrinsic_hash(extrinsic))
+        try:
+            response = substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True, wait_for_finalization=False)
+            response.process_events()
+        except Exception as e:
+            # left as submitted; a later attempt re-sends it with the same nonce
+            print(e, f"airdrop nonce {nonce}")
+            raise
+
+        if not response.is_success:
+            self.checkpoint.mark_failed(chunk, str(response.error_message))
+            print(f"Batch with nonce {nonce} failed: {response.error_message}")
+            return
+
+        # utility.batch stops at the first failing transfer
+        interrupted: Optional[Dict] = None
+        for event in response.triggered_events:
+            if event.value['event_id'] == 'BatchInterrupted':
+                interrupted = event.value['attributes']
+        if interrupted is None:
+            self.checkpoint.mark_done(chunk, response.block_hash)
+            print(f"Batch with nonce {nonce} included: {len(chunk)} transfers")
+            return
+
+        index: int = interrupted['index'] if isinstance(interrupted, dict) else interrupted[0]
+        error: Any = interrupted['error'] if isinstance(interrupted, dict) else interrupted[1]
+        self.checkpoint.mark_done(chunk[:index], response.block_hash)
+        self.checkpoint.mark_failed(chunk[index:index + 1], str(error))
+        # never executed, send them in a later attempt
+        self.checkpoint.mark_pending(chunk[index + 1:])
+        print(f"Batch with nonce {nonce} interrupted at transfer {index}: {error}")
@@ -1,37 +1,46 @@
-from typing import Any, Dict, List, Optional, Tuple
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
 
-import bittensor
-from scalecodec.base import ScaleBytes
-from scalecodec.types import GenericCall
-from substrateinterface import Keypair
 from tqdm import tqdm
 
+from .balance import Balance
 from .config import Config
+from .context import NO_CONTEXT, RequestContext
 from .db import Address, Database, Transaction
+from .executor import run_blocking
+from .metrics import LAST_BLOCK, RPC_SECONDS, timed
+from .tracing import span
+from .subtensor import Subtensor
+
+# substrateinterface and scalecodec are imported where they are used, they are slow to import
+if TYPE_CHECKING:
+    from scalecodec.base import ScaleBytes
+    from scalecodec.types import GenericCall
 
 
 class API:
-    subtensor: bittensor.Subtensor = None
+    subtensor: Subtensor = None
     network: str
 
     def __init__(self, config: Config, testing: bool=True) -> None:
         # Uses testnet if testing is true
         if testing:
             self.network = 'Nobunaga'
-            self.subtensor = bittensor.subtensor(network="nobunaga")
+            self.subtensor = Subtensor(network="nobunaga")
         else:
             self.network = 'Nakamoto'
-            self.subtensor = bittensor.subtensor(network="local", chain_endpoint=config.SUBTENSOR_ENDPOINT)
+            self.subtensor = Subtensor(network="local", chain_endpoint=config.SUBTENSOR_ENDPOINT)
 
-    def get_wallet_balance(self, coldkeyadd: str) -> bittensor.Balance:
+    @timed(RPC_SECONDS)
+    def get_wallet_balance(self, coldkeyadd: str, rctx: RequestContext = NO_CONTEXT) -> Balance:
         """
         Returns the balance of the given address.
 
         Args:
             coldkeyadd: The ss58 address to get the balance of.
+            rctx: The context of the current command, memoizes the balance.
         
         Returns:
-            The balance of the given address: bittensor.Balance
+            The balance of the given address: Balance
         
         Raises:
             - Exception: If the address is invalid.
@@ -42,32 +51,45 @@ class API:
             if not substrate.is_valid_ss58_address(coldkeyadd):
                 raise Exception('invalid coldkey address coldkeyadd')
 
-        balance = self.subtensor.get_balance(address=coldkeyadd)
+        balance = rctx.get(("balance", coldkeyadd), lambda: self.subtensor.get_balance(address=coldkeyadd))
         return balance
 
-    def send_transaction(self, transaction) -> Optional[Dict]:
+    @timed(RPC_SECONDS)
+    def get_current_block(self, rctx: RequestContext = NO_CONTEXT) -> int:
+        """
+        Returns the current block height of the chain.
+        """
+        return rctx.get(("block",), self.subtensor.get_current_block)
+
+    def send_transaction(self, transaction, rctx: RequestContext = NO_CONTEXT) -> Optional[Dict]:
         signature = transaction['signature']
         call = transaction['call']
         coldkeyadd = transaction['coldkeyadd']
         signature_payload_hex = transaction['signature_payload_hex']
         
         try:
+            from scalecodec.base import ScaleBytes
             signature_payload = ScaleBytes(signature_payload_hex)
-            response, balance = self.send_transaction_(call, signature_payload, coldkeyadd, signature)
+            response, balance, block = self.send_transaction_(call, signature_payload, coldkeyadd, signature, rctx)
             return {
                 'message': 'Transaction sent',
                 'response': response,
-                'balance': balance
+                'balance': balance,
+                'block': block,
+                # the fee actually paid, from the extrinsic's events
+                'fee': Balance.from_rao(response.total_fee_amount) if response.total_fee_amount is not None else None,
             }
         except(Exception) as e:
             print(e, "api.send_transaction")
             return None
 
-    def send_transaction_(self, call: GenericCall, signature_payload: ScaleBytes, coldkeyadd: str, signature: str):        
+    @timed(RPC_SECONDS)
+    def send_transaction_(self, call: 'GenericCall', signature_payload: 'ScaleBytes', coldkeyadd: str, signature: str, rctx: RequestContext = NO_CONTEXT):
         with self.subtensor.substrate as substrate:
             if not substrate.is_valid_ss58_address(coldkeyadd):
                 raise Exception('invalid coldkey address coldkeyadd')
             
+            from substrateinterface import Keypair
             pubkeypair: Keypair = Keypair(ss58_address=coldkeyadd)
 
             if not pubkeypair.verify(signature_payload, signature):
@@ -76,13 +98,21 @@ class API:
             extrinsic = substrate.create_signed_extrinsic(call=call, keypair=pubkeypair, signature=signature)
             response = substrate.submit_extrinsic(extrinsic, wait_for_inclusion=True, wait_for_finalization=False)
             response.process_events()
+            # the balance and nonce seen earlier in this command are stale now
+            rctx.invalidate(("balance", coldkeyadd), ("nonce", coldkeyadd), ("block",))
             if response.is_success:
-                balance = self.get_wallet_balance(coldkeyadd)
-                return response, balance
+                balance = self.get_wallet_balance(coldkeyadd, rctx)
+                block: Optional[int] = None
+                try:
+                    block = substrate.get_block_number(response.block_hash)
+                except Exception as e:
+                    print(e, "api.send_transaction_")
+                return response, balance, block
             else:
                 raise Exception('transaction failed')
 
-    async def create_transaction(self, transaction: Dict) -> Optional[Dict]:
+    @timed(RPC_SECONDS)
+    async def create_transaction(self, transaction: Dict, rctx: RequestContext = NO_CONTEXT) -> Optional[Dict]:
         coldkeyadd = transaction["coldkeyadd"]
         amount = transaction["amount"]
         dest = transaction["dest"]
@@ -90,23 +120,19 @@ class API:
         if (not coldkeyadd):
             raise Exception('specify coldkeyadd')
 
-        if (not amount or (not isinstance(amount, float) and not isinstance(amount, int) and not amount.isnumeric())):
-            raise Exception('specify amount')
+        if (not amount or not isinstance(amount, int)):
+            raise Exception('specify amount in rao')
 
         if (not dest):
             raise Exception('specify destination address dest')
 
-        # converts to balance given tao (float)
-        if (isinstance(amount, float)):
-            amount = bittensor.Balance.from_float(amount)
-        else:
-            amount = bittensor.Balance.from_float(float(amount))
-        
-        balance = self.get_wallet_balance(coldkeyadd)
+        amount = Balance.from_rao(amount)
+
+        balance = await run_blocking(self.get_wallet_balance, coldkeyadd, rctx)
         if (balance < amount):
             raise Exception('insufficient balance')
         try:
-            call, signature_payload, paymentInfo = self.init_transaction(coldkeyadd, dest, amount)
+            call, signature_payload, paymentInfo = await run_blocking(self.init_transaction, coldkeyadd, dest, amount, rctx)
             return {
                 'message': 'Signature Payload created',
                 'signature_payload_hex': signature_payload.to_hex(),
@@ -117,7 +143,8 @@ class API:
             print(e, "api.create_transaction")
             return None
 
-    def init_transaction(self, coldkeyadd: str, dest: str, amount: bittensor.Balance) -> Tuple[GenericCall, ScaleBytes, Any]:
+    @timed(RPC_SECONDS)
+    def init_transaction(self, coldkeyadd: str, dest: str, amount: Balance, rctx: RequestContext = NO_CONTEXT) -> Tuple['GenericCall', 'ScaleBytes', Any]:
         with self.subtensor.substrate as substrate:
             if not substrate.is_valid_ss58_address(coldkeyadd):
                 raise Exception('invalid coldkey address coldkeyadd')
@@ -133,39 +160,81 @@ class API:
                 }
             )
 
+            from substrateinterface import Keypair
             pubkeypair = Keypair(ss58_address=coldkeyadd)
-            paymentInfo = substrate.get_payment_info(call, pubkeypair)
+            paymentInfo = rctx.get(("payment_info", coldkeyadd, dest, amount.rao), lambda: substrate.get_payment_info(call, pubkeypair))
             # Retrieve nonce
-            nonce = substrate.get_account_nonce(pubkeypair.ss58_address) or 0
+            nonce = rctx.get(("nonce", coldkeyadd), lambda: substrate.get_account_nonce(pubkeypair.ss58_address) or 0)
             signature_payload = substrate.generate_signature_payload(call=call, nonce=nonce, era='00')
 
         return call, signature_payload, paymentInfo
 
+    @timed(RPC_SECONDS)
+    def init_batch_transaction(self, coldkeyadd: str, transfers: List[Tuple[str, Balance]], rctx: RequestContext = NO_CONTEXT) -> Tuple['GenericCall', 'ScaleBytes', Any]:
+        """
+        Like init_transaction, but for many transfers from coldkeyadd in one utility.batch_all extrinsic.
+        Either every transfer succeeds or none do.
+        """
+        with self.subtensor.substrate as substrate:
+            if not substrate.is_valid_ss58_address(coldkeyadd):
+                raise Exception('invalid coldkey address coldkeyadd')
+
+            calls: List['GenericCall'] = []
+            for dest, amount in transfers:
+                if not substrate.is_valid_ss58_address(dest):
+                    raise Exception('invalid destination address dest')
+                calls.append(substrate.compose_call(
+                    call_module='Balances',
+                    call_function='transfer',
+                    call_params={
+                        'dest': dest,
+                        'value': amount.rao
+                    }
+                ))
+
+            call = substrate.compose_call(
+                call_module='Utility',
+                call_function='batch_all',
+                call_params={
+                    'calls': calls
+                }
+            )
+
+            from substrateinterface import Keypair
+            pubkeypair = Keypair(ss58_address=coldkeyadd)
+            payment_key: Tuple = ("payment_info", coldkeyadd, tuple((dest, amount.rao) for dest, amount in transfers))
+            paymentInfo = rctx.get(payment_key, lambda: substrate.get_payment_info(call, pubkeypair))
+            # Retrieve nonce
+            nonce = rctx.get(("nonce", coldkeyadd), lambda: substrate.get_account_nonce(pubkeypair.ss58_address) or 0)
+            signature_payload = substrate.generate_signature_payload(call=call, nonce=nonce, era='00')
+
+        return call, signature_payload, paymentInfo
+
+    @timed(RPC_SECONDS)
     def verify_coldkeyadd(self, coldkeyadd: str) -> bool:
         with self.subtensor.substrate as substrate:
             is_valid = substrate.is_valid_ss58_address(coldkeyadd)
             return is_valid
 
-    async def find_withdraw_address(self, _db: Database, transaction: Transaction, key: bytes) -> Tuple[Optional[str], bittensor.Balance]:
+    async def find_withdraw_address(self, _db: Database, transaction: Transaction, key: bytes, rctx: RequestContext = NO_CONTEXT) -> Tuple[Optional[str], Balance]:
         """
         Finds valid withdraw addresses with available balance.
         """
-        addr: Address = _db.get_address_by_user(transaction.user)
+        addr: Address = await run_blocking(_db.get_address_by_user, transaction.user, rctx)
         if not addr:
-            return None, 0.0
+            return None, Balance.from_rao(0)
 
         withdraw_addr = addr.address
-        balance: bittensor.Balance = self.get_wallet_balance(withdraw_addr)
+        # from the balance read model, no need to go to the chain
+        balance: Balance = await _db.check_balance(transaction.user, rctx=rctx)
         return withdraw_addr, balance
             
-    async def sign_transaction(self, _db: Database, transaction: Dict, addr: str, key: bytes) -> Dict:
-        doc: Address = _db.get_address(addr, key)
+    async def sign_transaction(self, _db: Database, transaction: Dict, addr: str, key: bytes, rctx: RequestContext = NO_CONTEXT) -> Dict:
+        doc: Address = await run_blocking(_db.get_address, addr, key, rctx)
         if (not doc):
             raise Exception('address not found')
-        mnemonic: str = doc.mnemonic
-        keypair: Keypair = Keypair.create_from_mnemonic(mnemonic)
         signature_payload_hex: str = transaction['signature_payload_hex']
-        signature = keypair.sign(signature_payload_hex)
+        signature: bytes = await run_blocking(self._sign, doc, signature_payload_hex)
 
         signed_transaction: Dict = {
             "signature": "0x" + signature.hex(),
@@ -175,50 +244,91 @@ class API:
         }
         return signed_transaction
 
+    @staticmethod
+    def _sign(doc: Address, signature_payload_hex: str) -> bytes:
+        from substrateinterface import Keypair
+        try:
+            with span("crypto.sign"):
+                keypair: Keypair = Keypair.create_from_mnemonic(doc.mnemonic)
+                return keypair.sign(signature_payload_hex)
+        finally:
+            doc.wipe()
+
     @staticmethod
     def create_address(key: bytes) -> Address:
-        mnemonic = Keypair.generate_mnemonic(12)
-        keypair = Keypair.create_from_mnemonic(mnemonic)
+        from substrateinterface import Keypair
+        with span("crypto.create_keypair"):
+            mnemonic = Keypair.generate_mnemonic(12)
+            keypair = Keypair.create_from_mnemonic(mnemonic)
         address = keypair.ss58_address
         return Address(address, mnemonic, key)
 
     async def test_connection(self) -> bool:
-        return self.subtensor.connect(failure=False)
+        # on a thread of the blocking pool, whose connections the chain calls use
+        return await run_blocking(self.subtensor.connect, failure=False)
 
-    async def check_for_deposits(self, _db: Database) -> List[Transaction]:
-        addrs: List[Address] = list(await _db.get_all_addresses_with_lock())
+    @timed(RPC_SECONDS)
+    async def check_for_deposits(self, _db: Database, addrs: Optional[List[Dict]] = None) -> List[Transaction]:
+        """
+        Scans the given address docs (by default every assigned address) for new deposits
+        and keeps the balance read model up to date.
+        """
+        scan_all: bool = addrs is None
+        if scan_all:
+            addrs = list(await _db.get_all_addresses())
         new_transactions: List[Transaction] = []
-        for addr in tqdm(addrs, desc="Checking Deposits..."):
-            balance = self.get_wallet_balance(addr["address"])
-            result = await _db.update_addr_balance(addr["address"], balance.rao)
+        block: int = await run_blocking(self.get_current_block)
+        # the scheduled polls read a few addresses every few seconds, too often for a progress bar
+        for addr in tqdm(addrs, desc="Checking Deposits...", disable=not scan_all):
+            if addr.get("user") is None:
+                # Unassigned addresses can't receive deposits from a user
+                continue
+            balance = await run_blocking(self.get_wallet_balance, addr["address"])
+            result = await _db.update_addr_balance(addr["address"], balance.rao, block, addr.get("user"))
             if result is None:
                 print("Error checking deposits", addr["address"])
                 continue
             change, user = result
             
             if (change > 0):
-                new_transaction = Transaction(user, bittensor.Balance.from_rao(change).tao)
+                new_transaction = Transaction(user, change)
                 # add transaction to db
                 await new_transaction.deposit(_db)
                 new_transactions.append(new_transaction)
+        LAST_BLOCK.set(block)
         return new_transactions
 
-    async def get_withdraw_fee(self, transaction: Dict) -> bittensor.Balance:
+    async def get_withdraw_fee(self, transaction: Dict, rctx: RequestContext = NO_CONTEXT) -> Balance:
         fee = await self.get_fee(
             transaction["coldkeyadd"],
             transaction["dest"],
-            bittensor.Balance.from_tao(transaction["amount"])
+            Balance.from_rao(transaction["amount"]),
+            rctx
         )
 
         return fee
 
-    async def get_fee(self, addr: str, dest: str, amount: bittensor.Balance) -> bittensor.Balance:
-        _, _, paymentInfo = self.init_transaction(
+    @timed(RPC_SECONDS)
+    async def get_fee(self, addr: str, dest: str, amount: Balance, rctx: RequestContext = NO_CONTEXT) -> Balance:
+        _, _, paymentInfo = await run_blocking(self.init_transaction,
             addr,
             dest,
-            amount
+            amount,
+            rctx
+        )
+
+        fee_rao = paymentInfo["partialFee"]
+        fee = Balance.from_rao(fee_rao)
+        return fee
+
+    @timed(RPC_SECONDS)
+    async def get_batch_fee(self, addr: str, transfers: List[Tuple[str, Balance]], rctx: RequestContext = NO_CONTEXT) -> Balance:
+        _, _, paymentInfo = await run_blocking(self.init_batch_transaction,
+            addr,
+            transfers,
+            rctx
         )
 
         fee_rao = paymentInfo["partialFee"]
-        fee = bittensor.Balance.from_rao(fee_rao)
+        fee = Balance.from_rao(fee_rao)
         return fee
@@ -0,0 +1,247 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import sys
+import time
+import zlib
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from hashlib import scrypt
+from typing import Deque, Dict, Iterator, List, Optional, Tuple
+
+from bson import ObjectId
+from cryptography.fernet import Fernet
+
+from .db import cipher, key_version
+
+FORMAT: str = "taotip-backup"
+VERSION: int = 1
+MODES = ("fernet", "polkadot")
+
+# what each worker needs, set by _init_worker
+_worker: Dict = {}
+
+
+def _init_worker(secret: bytes, mode: str, key: Optional[bytes], password_key: Optional[bytes], salt: Optional[bytes]) -> None:
+    _worker.update(secret=secret, mode=mode, key=key, password_key=password_key, salt=salt)
+
+
+def _create_private(path: str) -> int:
+    """
+    Creates or truncates path, readable by its owner only (the backup holds every key).
+    """
+    fd: int = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # in case it existed with wider permissions
+    os.fchmod(fd, 0o600)
+    return fd
+
+
+def polkadot_json(mnemonic: str, address: str, password_key: bytes, salt: bytes) -> Dict:
+    """
+    The keypair as polkadot-js exports it (like the export service), encrypted with a key
+    derived from the passphrase once per backup; each entry has its own nonce.
+    """
+    from nacl.secret import SecretBox
+    from substrateinterface import Keypair
+    from substrateinterface.utils.encrypted_json import SCRYPT_N, SCRYPT_P, SCRYPT_R, encode_pkcs8
+    import sr25519
+
+    keypair: Keypair = Keypair.create_from_mnemonic(mnemonic)
+    # polkadot-js keeps sr25519 secrets in the ed25519 expanded form
+    message: bytes = encode_pkcs8(keypair.public_key, sr25519.convert_secret_key_to_ed25519(keypair.private_key))
+    encrypted = SecretBox(password_key).encrypt(message)
+    scrypt_params: bytes = SCRYPT_N.to_bytes(4, "little") + SCRYPT_P.to_bytes(4, "little") + SCRYPT_R.to_bytes(4, "little")
+    return {
+        "encoded": base64.b64encode(salt + scrypt_params + encrypted.nonce + encrypted.ciphertext).decode(),
+        "encoding": {"content": ["pkcs8", "sr25519"], "type": ["scrypt", "xsalsa20-poly1305"], "version": "3"},
+        "address": keypair.ss58_address,
+        "meta": {"name": f"taotip_{address}", "tags": [], "whenCreated": int(time.time() * 1000)},
+    }
+
+
+def derive_password_key(passphrase: str, salt: bytes) -> bytes:
+    from substrateinterface.utils.encrypted_json import SCRYPT_N, SCRYPT_P, SCRYPT_R
+    return scrypt(passphrase.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P, dklen=32, maxmem=2 ** 26)
+
+
+def passphrase_verifier(password_key: bytes) -> str:
+    """
+    Identifies the key derived from the passphrase, without revealing it, so a resume
+    can tell it's given the same passphrase.
+    """
+    return hmac.new(password_key, FORMAT.encode(), hashlib.sha256).hexdigest()[:16]
+
+
+def encode_chunk(docs: List[Tuple[str, bytes, Optional[str]]]) -> bytes:
+    """
+    Decrypts a chunk of (address, encrypted mnemonic, user) and returns it as one line of the backup:
+    compressed JSON lines, encrypted with the operator's key in fernet mode.
+    """
+    records: List[str] = []
+    for address, encrypted, user in docs:
+        mnemonic: str = str(cipher(_worker["secret"]).decrypt(encrypted), "utf-8")
+        if _worker["mode"] == "fernet":
+            record: Dict = {"address": address, "user": user, "mnemonic": mnemonic}
+        else:
+            record = {"address": address, "user": user, "json": polkadot_json(mnemonic, address, _worker["password_key"], _worker["salt"])}
+        records.append(json.dumps(record))
+    compressed: bytes = zlib.compress("\n".join(records).encode(), 6)
+    if _worker["mode"] == "fernet":
+        return cipher(_worker["key"]).encrypt(compressed) + b"\n"
+    return base64.b64encode(compressed) + b"\n"
+
+
+class Backup:
+    """
+    Streams the addresses collection to a backup file, decrypting in a pool of processes.
+
+    The file is a JSON header line, then one line per chunk of addresses. A checkpoint
+    (`<output>.checkpoint`) records the last address written and the file size after it,
+    so an interrupted backup resumes where it stopped, with the same key or passphrase only.
+    It's removed once the backup is complete. Both files are readable by their owner only.
+    """
+    def __init__(self, collection, output: str, secret: bytes, mode: str = "fernet", key: Optional[bytes] = None,
+            passphrase: Optional[str] = None, workers: int = None, chunk_size: int = 1000, progress_interval: float = 5.0) -> None:
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        if mode == "fernet" and key is None:
+            raise ValueError("fernet mode needs the operator's key")
+        if mode == "polkadot" and not passphrase:
+            raise ValueError("polkadot mode needs a passphrase")
+        self.collection = collection
+        self.output = output
+        self.checkpoint_path = output + ".checkpoint"
+        self.secret = secret
+        self.mode = mode
+        self.key = key
+        self.passphrase = passphrase
+        self.workers = workers or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        self.progress_interval = progress_interval
+        self.count = 0
+
+    def _load_checkpoint(self) -> Optional[Dict]:
+        if not os.path.exists(self.checkpoint_path):
+            if os.path.exists(self.output):
+                raise FileExistsError(f"{self.output} is a complete backup, write to a new file")
+            return None
+        with open(self.checkpoint_path) as f:
+            checkpoint: Dict = json.load(f)
+        if checkpoint["mode"] != self.mode:
+            raise ValueError(f"{self.output} was started in {checkpoint['mode']} mode")
+        if checkpoint.get("key") != self._key_version():
+            raise ValueError(f"{self.output} was started with another key, resume it with that one")
+        return checkpoint
+
+    def _key_version(self) -> Optional[str]:
+        return key_version(self.key) if self.key is not None else None
+
+    def _save_checkpoint(self, checkpoint: Dict) -> None:
+        tmp: str = self.checkpoint_path + ".tmp"
+        with os.fdopen(_create_private(tmp), "w") as f:
+            json.dump(checkpoint, f)
+        os.replace(tmp, self.checkpoint_path)
+
+    def _docs(self, last_id: Optional[str]) -> Iterator[Tuple[ObjectId, Tuple[str, bytes, Optional[str]]]]:
+        query: Dict = {"_id": {"$gt": ObjectId(last_id)}} if last_id is not None else {}
+        cursor = self.collection.find(query, {"address": 1, "mnemonic": 1, "user": 1}, batch_size=self.chunk_size).sort("_id", 1)
+        for doc in cursor:
+            yield doc["_id"], (doc["address"], doc["mnemonic"], doc.get("user"))
+
+    def _chunks(self, last_id: Optional[str]) -> Iterator[Tuple[ObjectId, List[Tuple[str, bytes, Optional[str]]]]]:
+        chunk: List[Tuple[str, bytes, Optional[str]]] = []
+        chunk_last: Optional[ObjectId] = None
+        for _id, doc in self._docs(last_id):
+            chunk.append(doc)
+            chunk_last = _id
+            if len(chunk) >= self.chunk_size:
+                yield chunk_last, chunk
+                chunk = []
+        if chunk:
+            yield chunk_last, chunk
+
+    def run(self) -> int:
+        """
+        Returns how many addresses the backup holds.
+        """
+        checkpoint: Optional[Dict] = self._load_checkpoint()
+        if checkpoint is None:
+            salt: Optional[bytes] = os.urandom(32) if self.mode == "polkadot" else None
+        else:
+            salt = bytes.fromhex(checkpoint["salt"]) if checkpoint["salt"] else None
+        password_key: Optional[bytes] = derive_password_key(self.passphrase, salt) if self.mode == "polkadot" else None
+        verifier: Optional[str] = passphrase_verifier(password_key) if password_key is not None else None
+
+        if checkpoint is None:
+            header: Dict = {"format": FORMAT, "version": VERSION, "mode": self.mode, "salt": salt.hex() if salt else None,
+                "key": self._key_version(), "passphrase": verifier}
+            with os.fdopen(_create_private(self.output), "wb") as f:
+                f.write(json.dumps(header).encode() + b"\n")
+                offset: int = f.tell()
+            checkpoint = {"mode": self.mode, "salt": header["salt"], "key": header["key"], "passphrase": verifier, "last_id": None, "count": 0, "offset": offset}
+            self._save_checkpoint(checkpoint)
+        elif checkpoint.get("passphrase") != verifier:
+            # entries under two passphrases couldn't all be restored with either
+            raise ValueError(f"{self.output} was started with another passphrase, resume it with that one")
+
+        self.count = checkpoint["count"]
+        total: int = self.collection.estimated_document_count()
+        started: float = time.monotonic()
+        resumed_at: int = self.count
+        last_report: float = started
+
+        with open(self.output, "r+b") as f, ProcessPoolExecutor(
+                self.workers, initializer=_init_worker, initargs=(self.secret, self.mode, self.key, password_key, salt)) as pool:
+            # drops a chunk that was half written when interrupted
+            f.truncate(checkpoint["offset"])
+            f.seek(checkpoint["offset"])
+            pending: Deque[Tuple[ObjectId, int, Future]] = deque()
+
+            def write_oldest() -> None:
+                chunk_last, size, future = pending.popleft()
+                f.write(future.result())
+                f.flush()
+                os.fsync(f.fileno())
+                self.count += size
+                checkpoint.update(last_id=str(chunk_last), count=self.count, offset=f.tell())
+                self._save_checkpoint(checkpoint)
+
+            for chunk_last, chunk in self._chunks(checkpoint["last_id"]):
+                pending.append((chunk_last, len(chunk), pool.submit(encode_chunk, chunk)))
+                # chunks are written in order, a few ahead keep every worker busy
+                if len(pending) >= self.workers * 2:
+                    write_oldest()
+                if time.monotonic() - last_report >= self.progress_interval:
+                    last_report = time.monotonic()
+                    self._report(self.count - resumed_at, last_report - started, total)
+            while pending:
+                write_oldest()
+
+        self._report(self.count - resumed_at, time.monotonic() - started, total)
+        os.remove(self.checkpoint_path)
+        return self.count
+
+    def _report(self, done: int, seconds: float, total: int) -> None:
+        rate: float = done / seconds if seconds > 0 else 0.0
+        remaining: str = f", about {(total - self.count) / rate:.0f}s left" if rate > 0 and total > self.count else ""
+        print(f"{self.count}/{total} addresses, {rate:.0f}/s{remaining}", file=sys.stderr)
+
+
+def read_backup(path: str, key: Optional[bytes] = None) -> Iterator[Dict]:
+    """
+    The records of a backup, with the operator's key for one in fernet mode.
+    """
+    with open(path, "rb") as f:
+        header: Dict = json.loads(f.readline())
+        if header.get("format") != FORMAT:
+            raise ValueError(f"{path} is not a backup")
+        if header["mode"] == "fernet" and key is not None and header.get("key") not in (None, key_version(key)):
+            raise ValueError(f"{path} was encrypted with another key")
+        fernet: Optional[Fernet] = Fernet(key) if header["mode"] == "fernet" else None
+        for line in f:
+            line = line.rstrip(b"\n")
+            compressed: bytes = fernet.decrypt(line) if fernet is not None else base64.b64decode(line)
+            for record in zlib.decompress(compressed).decode().split("\n"):
+                yield json.loads(record)
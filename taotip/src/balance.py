@@ -0,0 +1,136 @@
+from decimal import ROUND_DOWN, Decimal, InvalidOperation
+from typing import Union
+
+RAO_PER_TAO: int = 10 ** 9
+
+
+class Balance:
+    """
+    An amount of tao, stored as an integer number of rao.
+
+    Drop-in for bittensor.Balance: Balance(int) is rao and Balance(float) is tao,
+    and plain numbers in arithmetic and comparisons are taken as rao.
+    """
+    __slots__ = ("rao",)
+
+    unit: str = "τ"
+    rao_unit: str = "ρ"
+
+    rao: int
+
+    def __init__(self, balance: Union[int, float]) -> None:
+        if isinstance(balance, int):
+            self.rao = balance
+        else:
+            self.rao = int(round(float(balance) * RAO_PER_TAO))
+
+    @property
+    def tao(self) -> float:
+        return self.rao / RAO_PER_TAO
+
+    @staticmethod
+    def from_rao(amount: int) -> 'Balance':
+        return Balance(int(amount))
+
+    @staticmethod
+    def from_tao(amount: float) -> 'Balance':
+        return Balance(float(amount))
+
+    from_float = from_tao
+
+    @staticmethod
+    def parse_tao(text: str) -> 'Balance':
+        """
+        Parses an amount of tao typed by a user, without going through a float.
+        Digits past the rao are dropped. Raises ValueError if text is not a number.
+        """
+        try:
+            tao: Decimal = Decimal(text.strip())
+        except InvalidOperation:
+            raise ValueError(f"{text} is not a number")
+        if not tao.is_finite():
+            raise ValueError(f"{text} is not a number")
+        return Balance(int((tao * RAO_PER_TAO).to_integral_value(ROUND_DOWN)))
+
+    @staticmethod
+    def _rao(other: Union['Balance', int, float]) -> int:
+        if isinstance(other, Balance):
+            return other.rao
+        return int(other)
+
+    def __int__(self) -> int:
+        return self.rao
+
+    def __float__(self) -> float:
+        return self.tao
+
+    def __bool__(self) -> bool:
+        return self.rao != 0
+
+    def __hash__(self) -> int:
+        return hash(self.rao)
+
+    def __str__(self) -> str:
+        return f"{self.unit}{self.tao:,.9f}"
+
+    def __repr__(self) -> str:
+        return self.__str__()
+
+    def __format__(self, format_spec: str) -> str:
+        if format_spec == "":
+            return self.__str__()
+        return format(self.tao, format_spec)
+
+    def __eq__(self, other) -> bool:
+        if other is None:
+            return False
+        try:
+            return self.rao == self._rao(other)
+        except (TypeError, ValueError):
+            return NotImplemented
+
+    def __ne__(self, other) -> bool:
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    def __lt__(self, other) -> bool:
+        return self.rao < self._rao(other)
+
+    def __le__(self, other) -> bool:
+        return self.rao <= self._rao(other)
+
+    def __gt__(self, other) -> bool:
+        return self.rao > self._rao(other)
+
+    def __ge__(self, other) -> bool:
+        return self.rao >= self._rao(other)
+
+    def __add__(self, other) -> 'Balance':
+        return Balance.from_rao(self.rao + self._rao(other))
+
+    def __radd__(self, other) -> 'Balance':
+        return self.__add__(other)
+
+    def __sub__(self, other) -> 'Balance':
+        return Balance.from_rao(self.rao - self._rao(other))
+
+    def __rsub__(self, other) -> 'Balance':
+        return Balance.from_rao(self._rao(other) - self.rao)
+
+    def __mul__(self, other) -> 'Balance':
+        return Balance.from_rao(int(self.rao * (other.rao if isinstance(other, Balance) else other)))
+
+    def __rmul__(self, other) -> 'Balance':
+        return self.__mul__(other)
+
+    def __truediv__(self, other) -> 'Balance':
+        return Balance.from_rao(int(self.rao / (other.rao if isinstance(other, Balance) else other)))
+
+    def __floordiv__(self, other) -> 'Balance':
+        return Balance.from_rao(self.rao // (other.rao if isinstance(other, Balance) else int(other)))
+
+    def __neg__(self) -> 'Balance':
+        return Balance.from_rao(-self.rao)
+
+    def __abs__(self) -> 'Balance':
+        return Balance.from_rao(abs(self.rao))
@@ -0,0 +1,141 @@
+import time
+from collections import OrderedDict
+from typing import Any, Hashable, Optional, Tuple
+
+import interactions
+
+from .metrics import CACHE_HIT_RATIO
+
+
+class TTLCache:
+    """
+    Bounded LRU mapping whose entries expire `ttl` seconds after they were set.
+    """
+    def __init__(self, maxsize: int = 10000, ttl: float = 300.0) -> None:
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data: 'OrderedDict[Hashable, Tuple[float, Any]]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        entry: Optional[Tuple[float, Any]] = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def hit_ratio(self) -> Optional[float]:
+        lookups: int = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> None:
+        self._data.pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class EntityCache:
+    """
+    Discord channels and guild members seen in interaction payloads and gateway events,
+    so the command path doesn't wait on Discord REST for them.
+
+    Lookups fall back to the API on a miss and cache the result.
+    """
+    def __init__(self, maxsize: int = 10000, ttl: float = 300.0) -> None:
+        self.channels = TTLCache(maxsize, ttl) # channel id -> Channel
+        self.channel_types = TTLCache(maxsize, ttl) # channel id -> ChannelType
+        self.members = TTLCache(maxsize, ttl) # (guild id, user id) -> Member
+        self.users = TTLCache(maxsize, ttl) # user id -> User
+
+    def observe(self, ctx: interactions.context._Context) -> None:
+        """
+        Caches the entities included in an interaction payload.
+        """
+        try:
+            if ctx.user is not None:
+                self.observe_user(ctx.user)
+            if ctx.guild_id is not None and ctx.member is not None:
+                self.observe_member(ctx.guild_id, ctx.member)
+
+            resolved = ctx.data.resolved if ctx.data is not None else None
+            if resolved is not None:
+                for user in (resolved.users or {}).values():
+                    self.observe_user(user)
+                if ctx.guild_id is not None:
+                    for user_id, member in (resolved.members or {}).items():
+                        if member.user is None:
+                            # resolved members come without their user
+                            member.user = self.users.get(str(user_id))
+                        if member.user is not None:
+                            self.observe_member(ctx.guild_id, member)
+        except Exception as e:
+            print(e, "cache.observe")
+
+    def observe_user(self, user: interactions.User) -> None:
+        self.users.set(str(user.id), user)
+
+    def observe_member(self, guild_id: Any, member: interactions.Member) -> None:
+        if member.user is None:
+            return
+        self.users.set(str(member.user.id), member.user)
+        self.members.set((str(guild_id), str(member.user.id)), member)
+
+    def forget_member(self, guild_id: Any, user_id: Any) -> None:
+        self.members.pop((str(guild_id), str(user_id)))
+
+    def observe_channel(self, channel: interactions.Channel) -> None:
+        self.channels.set(str(channel.id), channel)
+        self.channel_types.set(str(channel.id), channel.type)
+
+    def forget_channel(self, channel_id: Any) -> None:
+        self.channels.pop(str(channel_id))
+        self.channel_types.pop(str(channel_id))
+
+    async def channel_type(self, ctx: interactions.context._Context) -> interactions.ChannelType:
+        if ctx.guild_id is None:
+            # interactions outside a guild come from DMs
+            return interactions.ChannelType.DM
+
+        channel_type: Optional[interactions.ChannelType] = self.channel_types.get(str(ctx.channel_id))
+        if channel_type is None:
+            channel: interactions.Channel = await ctx.get_channel()
+            self.observe_channel(channel)
+            channel_type = channel.type
+        return channel_type
+
+    async def get_channel(self, client: interactions.Client, channel_id: Any) -> Optional[interactions.Channel]:
+        channel: Optional[interactions.Channel] = self.channels.get(str(channel_id))
+        if channel is None:
+            channel = await interactions.get(client, interactions.Channel, object_id=int(channel_id))
+            if channel is not None:
+                self.observe_channel(channel)
+        return channel
+
+    async def get_member(self, client: interactions.Client, guild_id: Any, user_id: Any) -> Optional[interactions.Member]:
+        member: Optional[interactions.Member] = self.members.get((str(guild_id), str(user_id)))
+        if member is None:
+            member = await interactions.get(client, interactions.Member, parent_id=int(guild_id), object_id=int(user_id))
+            if member is not None:
+                self.observe_member(guild_id, member)
+        return member
+
+
+entity_cache: EntityCache = EntityCache()
+
+for name in ("channels", "channel_types", "members", "users"):
+    CACHE_HIT_RATIO.set_function(getattr(entity_cache, name).hit_ratio, name)
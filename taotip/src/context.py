@@ -0,0 +1,64 @@
+from typing import Any, Awaitable, Callable, Dict, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class RequestContext:
+    """
+    Memoizes chain and database lookups for the lifetime of one command.
+
+    A new context is created per command and dropped when it finishes,
+    so nothing is shared between commands.
+    """
+    hits: int
+    misses: int
+
+    def __init__(self) -> None:
+        self._memo: Dict[Hashable, Any] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, fetch: Callable[[], T]) -> T:
+        if key in self._memo:
+            self.hits += 1
+            return self._memo[key]
+        self.misses += 1
+        value: T = fetch()
+        self._memo[key] = value
+        return value
+
+    async def aget(self, key: Hashable, fetch: Callable[[], Awaitable[T]]) -> T:
+        if key in self._memo:
+            self.hits += 1
+            return self._memo[key]
+        self.misses += 1
+        value: T = await fetch()
+        self._memo[key] = value
+        return value
+
+    def set(self, key: Hashable, value: Any) -> None:
+        self._memo[key] = value
+
+    def invalidate(self, *keys: Hashable) -> None:
+        """
+        Forgets lookups made stale by this command, e.g. after submitting an extrinsic.
+        """
+        for key in keys:
+            self._memo.pop(key, None)
+
+
+class NullContext(RequestContext):
+    """
+    Context used when the caller has none; never memoizes.
+    """
+    def get(self, key: Hashable, fetch: Callable[[], T]) -> T:
+        return fetch()
+
+    async def aget(self, key: Hashable, fetch: Callable[[], Awaitable[T]]) -> T:
+        return await fetch()
+
+    def set(self, key: Hashable, value: Any) -> None:
+        pass
+
+
+NO_CONTEXT: RequestContext = NullContext()
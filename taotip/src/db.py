@@ -1,10 +1,21 @@
+import asyncio
+import functools
+import hashlib
+import time
 from datetime import datetime
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Sequence, Tuple, Union
 
 import pymongo
 import pymongo.results
-from bittensor import Balance
-from cryptography.fernet import Fernet
+from .balance import Balance
+from cryptography.fernet import Fernet, MultiFernet
+
+from .context import NO_CONTEXT, RequestContext
+from .events import ADDRESS_ACTIVE, ADDRESS_ASSIGNED, BALANCE_CHANGED, EventBus
+from .executor import run_blocking
+from .ledger import Reservation, ReservationLedger
+from .metrics import DB_SECONDS, timed
+from .tracing import span
 
 
 class FeeException(Exception):
@@ -15,33 +26,331 @@ class FeeException(Exception):
         self.fee = fee
 
 
+# a key, or keys while rotating them: the first encrypts, any decrypts
+Keys = Union[bytes, Sequence[bytes]]
+
+
+def _key_tuple(key: Keys) -> Tuple[bytes, ...]:
+    return (key,) if isinstance(key, (bytes, str)) else tuple(key)
+
+
+def cipher(key: Keys) -> MultiFernet:
+    """
+    One cipher per key (or list of keys), shared by every encryption and decryption.
+    """
+    return _cipher(_key_tuple(key))
+
+
+@functools.lru_cache(maxsize=8)
+def _cipher(keys: Tuple[bytes, ...]) -> MultiFernet:
+    return MultiFernet([Fernet(key) for key in keys])
+
+
+def key_version(key: Keys) -> str:
+    """
+    Identifies the key mnemonics are encrypted with (the first one), without revealing it.
+    Stored with each address, so a key rotation knows which are left.
+    """
+    primary: bytes = _key_tuple(key)[0]
+    return hashlib.sha256(primary if isinstance(primary, bytes) else primary.encode()).hexdigest()[:16]
+
+
+def _set(obj: object, **values) -> None:
+    for name, value in values.items():
+        object.__setattr__(obj, name, value)
+
+
+class _Immutable:
+    """
+    Slotted models whose fields are set once, in __init__ (with _set).
+    """
+    __slots__ = ()
+
+    def __setattr__(self, name: str, value) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __delattr__(self, name: str) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+
+class BalanceRecord:
+    """
+    A balance for an address as last seen by the bot, and the block height it reflects.
+    """
+    address: str
+    user: Optional[str]
+    balance: Balance
+    block: Optional[int]
+    time: datetime
+
+    def __init__(self, address: str, user: Optional[str], balance: Balance, block: Optional[int] = None, time: datetime = None) -> None:
+        self.address = address
+        self.user = user
+        self.balance = balance
+        self.block = block
+        self.time = time if time is not None else datetime.now()
+
+    @classmethod
+    def from_doc(cls, doc: Dict) -> 'BalanceRecord':
+        return cls(doc["address"], doc.get("user"), Balance.from_rao(doc["balance"]), doc.get("block"), doc.get("time"))
+
+    def to_doc(self) -> Dict:
+        return {
+            "address": self.address,
+            "user": self.user,
+            "balance": self.balance.rao,
+            "block": self.block,
+            "time": self.time
+        }
+
+
 class Database:
     client: pymongo.MongoClient
     db = None
     api: 'api.API' = None
-
-    def __init__(self, mongo_client, api: 'api.API', testing: bool = False) -> None:
+    balance_cache: Dict[str, BalanceRecord] # address -> record, mirrors the balances collection (see forget_changed_balances)
+    balance_refresh_interval: float # seconds between forced refreshes per user
+    ledger: ReservationLedger # funds held by in-flight tips and withdrawals
+    fee_estimate: Balance # last observed transfer fee
+    jobs: Optional['JobQueue'] = None # set when tips and withdrawals run on workers
+    events: EventBus # publishes ADDRESS_ASSIGNED when a user gets an address
+
+    def __init__(self, mongo_client, api: 'api.API', testing: bool = False, balance_refresh_interval: float = 60.0, estimated_fee: Balance = Balance.from_tao(0.001), database: Optional[str] = None) -> None:
         self.api = api
         self.client = mongo_client
-        database_str: str = "test" if testing else "prod"
+        database_str: str = database or ("test" if testing else "prod")
         self.db = self.client[database_str]
+        self.balance_cache = {}
+        self.balance_refresh_interval = balance_refresh_interval
+        self.ledger = ReservationLedger()
+        self.fee_estimate = estimated_fee
+        self.events = EventBus()
+        self._user_addresses: Dict[str, str] = {}
+        self._last_refresh: Dict[str, float] = {}
+
+    @timed(DB_SECONDS)
+    async def check_balance(self, user_id: str, refresh: bool = False, rctx: RequestContext = NO_CONTEXT) -> Balance:
+        """
+        Returns the balance of the user from the balance read model.
+        Only goes to the chain if the user has no balance on record yet, or if a refresh is requested and allowed.
+        """
+        record: Optional[BalanceRecord] = await self.get_balance_record(user_id, refresh, rctx)
+        if record is None:
+            return Balance.from_rao(0)
+        return record.balance
 
-    async def check_balance(self, user_id: str) -> Balance:
+    @timed(DB_SECONDS)
+    async def get_balance_record(self, user_id: str, refresh: bool = False, rctx: RequestContext = NO_CONTEXT) -> Optional[BalanceRecord]:
         assert self.db is not None
         assert self.api is not None
+        user: str = str(user_id)
         # Get the address for the user
-        addr: Address = self.get_address_by_user(user_id)
-        if addr is None:
+        address: Optional[str] = await run_blocking(self._get_user_address, user, rctx)
+        if address is None:
             # No address found
-            return Balance.from_rao(0)
+            return None
+
+        record: Optional[BalanceRecord] = await run_blocking(self.get_cached_balance, user)
+        if record is not None and not (refresh and self.can_refresh_balance(user)):
+            return record
+
         try:
             # Get the balance for the address
-            balance: Balance = self.api.get_wallet_balance(addr.address)
-            return balance
+            record = await self.refresh_balance(address, user, rctx)
         except Exception as e:
-            print(e)
-            return Balance.from_rao(0)
+            print(e, "db.get_balance_record")
+        return record
+
+    async def available_balance(self, user_id: str, rctx: RequestContext = NO_CONTEXT) -> Balance:
+        """
+        Returns the balance of the user not held by in-flight tips or withdrawals.
+        """
+        balance: Balance = await self.check_balance(user_id, rctx=rctx)
+        return self.ledger.available(str(user_id), balance)
+
+    async def reserve(self, user_id: str, amount: Balance, rctx: RequestContext = NO_CONTEXT) -> Optional[Reservation]:
+        """
+        Reserves amount + the estimated fee for the user.
+
+        Returns:
+            The reservation, or None if the unreserved balance does not cover it.
+        """
+        # make sure the read model has the user's balance, then compare without awaiting
+        await self.check_balance(user_id, rctx=rctx)
+        record: Optional[BalanceRecord] = await run_blocking(self.get_cached_balance, user_id, rctx)
+        balance: Balance = record.balance if record is not None else Balance.from_rao(0)
+        return self.ledger.reserve(str(user_id), amount, self.fee_estimate, balance)
+
+    def get_cached_balance(self, user_id: str, rctx: RequestContext = NO_CONTEXT) -> Optional[BalanceRecord]:
+        """
+        Returns the balance record for the user without touching the chain.
+        """
+        address: Optional[str] = self._get_user_address(str(user_id), rctx)
+        if address is None:
+            return None
+        return self._get_balance_record_by_address(address)
+
+    def can_refresh_balance(self, user_id: str) -> bool:
+        last_refresh: Optional[float] = self._last_refresh.get(str(user_id))
+        return last_refresh is None or time.monotonic() - last_refresh >= self.balance_refresh_interval
+
+    def seconds_until_refresh(self, user_id: str) -> float:
+        last_refresh: Optional[float] = self._last_refresh.get(str(user_id))
+        if last_refresh is None:
+            return 0.0
+        return max(0.0, self.balance_refresh_interval - (time.monotonic() - last_refresh))
+
+    @timed(DB_SECONDS)
+    async def refresh_balance(self, address: str, user: Optional[str] = None, rctx: RequestContext = NO_CONTEXT) -> BalanceRecord:
+        """
+        Reads the balance of the address from the chain and stores it in the read model.
+        """
+        block: int = await run_blocking(self.api.get_current_block, rctx)
+        balance: Balance = await run_blocking(self.api.get_wallet_balance, address, rctx)
+        if user is not None:
+            self._last_refresh[str(user)] = time.monotonic()
+        return await run_blocking(self.set_balance, address, balance, block, user)
+
+    @timed(DB_SECONDS)
+    async def update_addr_balance(self, address: str, balance_rao: int, block: Optional[int] = None, user: Optional[str] = None) -> Optional[Tuple[int, Optional[str]]]:
+        """
+        Stores a balance observed on chain by the deposit scanner.
+        The first balance observed for an address without a record is its starting point, not a change.
+
+        Returns:
+            (change in rao since the last scan, less our own transfers, user of the address), or None on error.
+        """
+        assert self.db is not None
+        try:
+            previous: Optional[BalanceRecord] = await run_blocking(self._get_balance_record_by_address, address)
+            if user is None:
+                user = previous.user if previous is not None else await run_blocking(self._get_address_user, address)
+            change: int = await run_blocking(self._scan_balance, address, Balance.from_rao(balance_rao), block, user)
+            return change, user
+        except Exception as e:
+            print(e, "db.update_addr_balance")
+            return None
 
+    def apply_transfer(self, sender_addr: str, sender_balance: Balance, recipient_addr: Optional[str], amount: Balance, block: Optional[int] = None, fee: Optional[Balance] = None) -> None:
+        """
+        Updates the read model after one of our own transfers is included on chain.
+        The sender balance is the post-submit balance; the recipient is credited locally.
+        """
+        credits: List[Tuple[str, Balance]] = [(recipient_addr, amount)] if recipient_addr is not None else []
+        self.apply_transfers(sender_addr, sender_balance, credits, block, fee)
+
+    @timed(DB_SECONDS)
+    def apply_transfers(self, sender_addr: str, sender_balance: Balance, credits: List[Tuple[str, Balance]], block: Optional[int] = None, fee: Optional[Balance] = None) -> None:
+        """
+        apply_transfer for a batch of transfers from one sender, which paid fee (by default the estimate).
+
+        The post-submit balance may include a deposit the scanner hasn't seen yet, so the scanned
+        balances are only moved by the amounts transferred, and the deposit is still counted.
+        """
+        try:
+            fee = fee if fee is not None else self.fee_estimate
+            sender: Optional[BalanceRecord] = self._get_balance_record_by_address(sender_addr)
+            self.set_balance(sender_addr, sender_balance, block, sender.user if sender is not None else None)
+            if sender is not None:
+                self._move_scanned(sender_addr, -(sum(amount.rao for _, amount in credits) + fee.rao), block)
+            self.events.publish(ADDRESS_ACTIVE, (sender_addr, sender.user if sender is not None else None))
+            for recipient_addr, amount in credits:
+                recipient: Optional[BalanceRecord] = self._get_balance_record_by_address(recipient_addr)
+                self.events.publish(ADDRESS_ACTIVE, (recipient_addr, recipient.user if recipient is not None else self._get_address_user(recipient_addr)))
+                if recipient is not None:
+                    # Only credit balances we have seen; unseen addresses are read from chain on first use
+                    self.set_balance(recipient_addr, recipient.balance + amount, block or recipient.block, recipient.user)
+                    self._move_scanned(recipient_addr, amount.rao, block)
+        except Exception as e:
+            print(e, "db.apply_transfers")
+
+    def _move_scanned(self, address: str, rao: int, block: Optional[int]) -> None:
+        """
+        Moves the scanned balance of the address by one of our own transfers, unless a scan
+        already saw the block that included it.
+        """
+        query: Dict = {"address": address}
+        if block is not None:
+            query["$or"] = [{"scanned_block": None}, {"scanned_block": {"$lt": block}}]
+        self.db.balances.update_one(query, {"$inc": {"scanned": rao}})
+
+    @timed(DB_SECONDS)
+    def set_balance(self, address: str, balance: Balance, block: Optional[int] = None, user: Optional[str] = None) -> BalanceRecord:
+        """
+        Stores a balance read outside the deposit scan (or known to be right), leaving the
+        scanned balance deposits are counted from as it is. A new record starts from balance.
+        """
+        record: BalanceRecord = BalanceRecord(address, str(user) if user is not None else None, balance, block)
+        self._store_balance(record, {"$set": record.to_doc(), "$setOnInsert": {"scanned": balance.rao}})
+        return record
+
+    def _scan_balance(self, address: str, balance: Balance, block: Optional[int], user: Optional[str]) -> int:
+        """
+        Stores a balance read by the deposit scanner, and returns by how much it exceeds the
+        scanned balance: the previous scan's, moved by our own transfers since (see apply_transfers).
+        """
+        record: BalanceRecord = BalanceRecord(address, str(user) if user is not None else None, balance, block)
+        before: Optional[Dict] = self._store_balance(record, {"$set": dict(record.to_doc(), scanned=balance.rao, scanned_block=block)})
+        if before is None:
+            return 0
+        return balance.rao - before.get("scanned", before["balance"])
+
+    def _store_balance(self, record: BalanceRecord, update: Dict) -> Optional[Dict]:
+        previous: Optional[BalanceRecord] = self.balance_cache.get(record.address)
+        self.balance_cache[record.address] = record
+        # atomic, so a scan and a transfer from another instance don't miss each other's change
+        before: Optional[Dict] = self.db.balances.find_one_and_update({
+            "address": record.address
+        }, update, upsert=True, return_document=pymongo.ReturnDocument.BEFORE)
+        if previous is None or previous.balance != record.balance:
+            # other instances drop their cached record, see forget_changed_balances
+            self.events.publish(BALANCE_CHANGED, record.address)
+        return before
+
+    async def forget_changed_balances(self) -> None:
+        """
+        Drops the cached balance records other instances changed (relayed by events.EventRelay),
+        so they are read again from the balances collection.
+        """
+        changed: asyncio.Queue = self.events.subscribe(BALANCE_CHANGED, local=False)
+        try:
+            while True:
+                self.balance_cache.pop(await changed.get(), None)
+        finally:
+            self.events.unsubscribe(BALANCE_CHANGED, changed)
+
+    def _get_balance_record_by_address(self, address: str) -> Optional[BalanceRecord]:
+        record: Optional[BalanceRecord] = self.balance_cache.get(address)
+        if record is not None:
+            return record
+        doc: Optional[Dict] = self.db.balances.find_one({
+            "address": address
+        })
+        if doc is None:
+            return None
+        record = BalanceRecord.from_doc(doc)
+        self.balance_cache[address] = record
+        return record
+
+    def _get_user_address(self, user: str, rctx: RequestContext = NO_CONTEXT) -> Optional[str]:
+        # A user's address never changes once assigned, so it is safe to remember
+        address: Optional[str] = self._user_addresses.get(user)
+        if address is None:
+            addr: Optional[Address] = self.get_address_by_user(user, rctx)
+            if addr is None:
+                return None
+            address = self._user_addresses[user] = addr.address
+        return address
+
+    def _get_address_user(self, address: str) -> Optional[str]:
+        doc: Optional[Dict] = self.db.addresses.find_one({
+            "address": address
+        })
+        if doc is None:
+            return None
+        return doc["user"]
+
+    @timed(DB_SECONDS)
     async def record_tip(self, tip) -> None:
         assert self.db is not None
         new_doc: Dict = {
@@ -53,33 +362,53 @@ class Database:
         
         # fail silently
         try:
-            result: pymongo.results.InsertOneResult = self.db.tips.insert_one(
+            result: pymongo.results.InsertOneResult = await run_blocking(self.db.tips.insert_one,
                 new_doc
             )
         except Exception as e:
             print(e)
 
+    @timed(DB_SECONDS)
+    async def record_tips(self, tips: List['Tip']) -> None:
+        assert self.db is not None
+        new_docs: List[Dict] = [{
+            "amount": tip.amount.rao,
+            "sender": tip.sender,
+            "recipient": tip.recipient,
+            "time": tip.time
+        } for tip in tips]
+
+        # fail silently
+        try:
+            result: pymongo.results.InsertManyResult = await run_blocking(self.db.tips.insert_many,
+                new_docs
+            )
+        except Exception as e:
+            print(e, "db.record_tips")
+
+    @timed(DB_SECONDS)
     async def record_transaction(self, transaction: 'Transaction') -> None:
         assert self.db is not None
         new_doc: Dict = {
-            "amount": Balance.from_tao(transaction.amount).rao,
+            "amount": transaction.amount,
             "user": str(transaction.user),
             "time": transaction.time
         }
         
         # fail silently
         try:
-            result: pymongo.results.InsertOneResult = self.db.transactions.insert_one(
+            result: pymongo.results.InsertOneResult = await run_blocking(self.db.transactions.insert_one,
                 new_doc
             )
         except Exception as e:
             print(e, "db.record_transaction")
 
+    @timed(DB_SECONDS)
     async def get_deposit_addr(self, transaction: 'Transaction', key: bytes = None) -> Optional[str]:
         assert self.db is not None
 
         # check if already has an address
-        _doc: Dict = self.db.addresses.find_one({
+        _doc: Dict = await run_blocking(self.db.addresses.find_one, {
             "user": str(transaction.user)
         })
 
@@ -92,27 +421,93 @@ class Database:
                 return new_addr
         return None
 
-    async def create_new_address(self, key: bytes, user_id: str = None) -> str:
+    @timed(DB_SECONDS)
+    async def create_new_address(self, key: Keys, user_id: str = None) -> str:
         assert self.db is not None
 
-        new_address: Address = self.api.create_address(key=key)
+        new_address: Address = await run_blocking(self.api.create_address, key=key)
         doc: Dict = {
             "address": new_address.address,
             "mnemonic": new_address.get_encrypted_mnemonic(),
+            "key_version": key_version(key),
             "user": None,
             "welcomed": False,
         }
 
         try:
-            result = self.db.addresses.insert_one(doc)
+            result = await run_blocking(self.db.addresses.insert_one, doc)
+            # new keys hold nothing, so their first deposit is counted as one
+            await run_blocking(self.set_balance, new_address.address, Balance.from_rao(0), None, user_id)
             if user_id is not None:
                 await self.add_deposit_address(user_id, new_address.address)
             return new_address.address
         except Exception as e:
             print(e)
             return None
+
+    @timed(DB_SECONDS)
+    async def create_new_addresses(self, key: Keys, user_ids: List[str]) -> Dict[str, str]:
+        """
+        create_new_address for many users with a single insert.
+
+        Returns:
+            user -> new address
+        """
+        assert self.db is not None
+
+        new_addresses: Dict[str, Address] = await run_blocking(lambda: {
+            str(user_id): self.api.create_address(key=key) for user_id in user_ids
+        })
+        docs: List[Dict] = [{
+            "address": new_address.address,
+            "mnemonic": new_address.get_encrypted_mnemonic(),
+            "key_version": key_version(key),
+            "user": user,
+            "welcomed": False,
+        } for user, new_address in new_addresses.items()]
+        if len(docs) == 0:
+            return {}
+
+        try:
+            result: pymongo.results.InsertManyResult = await run_blocking(self.db.addresses.insert_many, docs)
+            # new keys hold nothing, so their first deposit is counted as one
+            records: List[BalanceRecord] = [
+                BalanceRecord(new_address.address, user, Balance.from_rao(0)) for user, new_address in new_addresses.items()
+            ]
+            await run_blocking(self.db.balances.insert_many, [dict(record.to_doc(), scanned=0) for record in records])
+            self.balance_cache.update({record.address: record for record in records})
+            for user in new_addresses:
+                self.events.publish(ADDRESS_ASSIGNED, user)
+            return {user: new_address.address for user, new_address in new_addresses.items()}
+        except Exception as e:
+            print(e, "db.create_new_addresses")
+            return {}
+
+    @timed(DB_SECONDS)
+    def get_addresses_by_users(self, users: List[str]) -> Dict[str, 'Address']:
+        """
+        get_address_by_user for many users with a single query.
+
+        Returns:
+            user -> address, for the users that have one
+        """
+        assert self.db is not None
+
+        query: Dict = {
+            "user": {"$in": [str(user) for user in users]}
+        }
+
+        try:
+            return {
+                doc["user"]: Address.encrypted(doc["address"], doc["mnemonic"], None)
+                for doc in self.db.addresses.find(query)
+            }
+        except Exception as e:
+            print(e, "db.get_addresses_by_users")
+            return {}
     
-    def get_address(self, addr: str, key: bytes) -> 'Address':
+    @timed(DB_SECONDS)
+    def get_address(self, addr: str, key: bytes, rctx: RequestContext = NO_CONTEXT) -> 'Address':
         assert self.db is not None
 
         query: Dict = {
@@ -120,26 +515,44 @@ class Database:
         }
 
         try:
-            doc: Dict = self.db.addresses.find_one(query)
-            addr = Address(doc["address"], doc["mnemonic"], key, decrypt=True)
-            return addr
+            doc: Dict = rctx.get(("address_doc", addr), lambda: self.db.addresses.find_one(query))
+            # decrypted when the mnemonic is used
+            return Address.encrypted(doc["address"], doc["mnemonic"], key)
         except Exception as e:
             print(e)
             return None
 
+    @timed(DB_SECONDS)
+    async def get_total_balance(self) -> Balance:
+        """
+        Sum of every balance in the read model.
+        """
+        assert self.db is not None
+
+        try:
+            result: List[Dict] = await run_blocking(lambda: list(self.db.balances.aggregate([
+                {"$group": {"_id": None, "total": {"$sum": "$balance"}}}
+            ])))
+            return Balance.from_rao(result[0]["total"] if len(result) > 0 else 0)
+        except Exception as e:
+            print(e, "db.get_total_balance")
+            return Balance.from_rao(0)
+
+    @timed(DB_SECONDS)
     async def get_all_addresses(self) -> List[Dict]:
         assert self.db is not None
 
         query: Dict = {}
 
         try:
-            doc: Dict = self.db.addresses.find(query)
-            return doc
+            docs: List[Dict] = await run_blocking(lambda: list(self.db.addresses.find(query)))
+            return docs
         except Exception as e:
             print(e)
             return []
 
-    def get_address_by_user(self, user: str) -> Optional['Address']:
+    @timed(DB_SECONDS)
+    def get_address_by_user(self, user: str, rctx: RequestContext = NO_CONTEXT) -> Optional['Address']:
         assert self.db is not None
 
         query: Dict = {
@@ -147,39 +560,44 @@ class Database:
         }
 
         try:
-            doc: Dict = self.db.addresses.find_one(query)
-            addr = Address(doc["address"], doc["mnemonic"], None, decrypt=False)
+            doc: Optional[Dict] = rctx.get(("address_by_user", str(user)), lambda: self.db.addresses.find_one(query))
+            if doc is None:
+                return None
+            addr = Address.encrypted(doc["address"], doc["mnemonic"], None)
             return addr
         except Exception as e:
             print(e)
             return None
 
-    async def transfer(self, sender: str, recipient: str, amount: Balance, key: bytes) -> None:
+    @timed(DB_SECONDS)
+    async def transfer(self, sender: str, recipient: str, amount: Balance, key: bytes, reservation: Optional[Reservation] = None, rctx: RequestContext = NO_CONTEXT) -> None:
         assert self.db is not None
 
         # check if already has an address
-        sender_addr: Optional[Address] = self.get_address_by_user(sender)
-        recipient_addr: Optional[Address] = self.get_address_by_user(recipient)
+        sender_addr: Optional[Address] = await run_blocking(self.get_address_by_user, sender, rctx)
+        recipient_addr: Optional[Address] = await run_blocking(self.get_address_by_user, recipient, rctx)
         
         if sender_addr is None:
             raise Exception("Sender address not found")
         if recipient_addr is None:
             # create new address
             recipient_addr_str = await self.create_new_address(key, recipient)
-            recipient_addr = self.get_address_by_user(recipient)
+            rctx.invalidate(("address_by_user", str(recipient)))
+            recipient_addr = await run_blocking(self.get_address_by_user, recipient, rctx)
             if recipient_addr is None:
                 raise Exception("Recipient address not found. Cannot create new address")
 
-        # check if sender has enough balance
-        sender_balance: Balance = await self.check_balance(sender)
         ## Get transfer fee
-        transfer_fee: Balance = await self.api.get_fee(sender_addr.address, recipient_addr.address, amount)
-        if sender_balance < amount + transfer_fee:
+        transfer_fee: Balance = await self.api.get_fee(sender_addr.address, recipient_addr.address, amount, rctx)
+        self.fee_estimate = transfer_fee
+        # check if sender has enough balance, less what other in-flight transfers hold
+        sender_balance: Balance = await self.check_balance(sender, rctx=rctx)
+        if sender_balance - self.ledger.reserved(sender, exclude=reservation) < amount + transfer_fee:
             raise FeeException("Sender does not have enough balance", transfer_fee)
         
         # transfer
         try:
-            call, signature_payload, paymentInfo = self.api.init_transaction( sender_addr.address, recipient_addr.address, amount )
+            call, signature_payload, paymentInfo = await run_blocking(self.api.init_transaction, sender_addr.address, recipient_addr.address, amount, rctx)
             api_transaction = {
                 'message': 'Signature Payload created',
                 'signature_payload_hex': signature_payload.to_hex(),
@@ -187,19 +605,82 @@ class Database:
                 'call': call,
             }
             
-            transaction_: Transaction = Transaction( sender, amount.tao )
+            transaction_: Transaction = Transaction( sender, amount.rao )
             await self.record_transaction(transaction_)
-            _signed_transaction = await self.api.sign_transaction(self, api_transaction, sender_addr.address, key)
-            result = self.api.send_transaction(_signed_transaction)
+            _signed_transaction = await self.api.sign_transaction(self, api_transaction, sender_addr.address, key, rctx)
+            result = await run_blocking(self.api.send_transaction, _signed_transaction, rctx)
+            if not result:
+                raise Exception("Transaction failed")
+            await run_blocking(self.apply_transfer, sender_addr.address, result['balance'], recipient_addr.address, amount, result.get('block'), result.get('fee'))
         except Exception as e:
             print(e)
             raise Exception("Failed to transfer")      
 
+    @timed(DB_SECONDS)
+    async def transfer_many(self, sender: str, transfers: List[Tuple[str, Balance]], key: bytes, reservation: Optional[Reservation] = None, rctx: RequestContext = NO_CONTEXT) -> None:
+        """
+        Transfers to many recipients in one utility.batch_all extrinsic.
+        Recipients without an address get one, created in bulk.
+
+        Args:
+            transfers: (recipient user, amount) pairs.
+        """
+        assert self.db is not None
+
+        sender_addr: Optional[Address] = await run_blocking(self.get_address_by_user, sender, rctx)
+        if sender_addr is None:
+            raise Exception("Sender address not found")
+
+        recipients: List[str] = [str(recipient) for recipient, _ in transfers]
+        recipient_addrs: Dict[str, str] = {
+            user: addr.address for user, addr in (await run_blocking(self.get_addresses_by_users, recipients)).items()
+        }
+        missing: List[str] = [recipient for recipient in dict.fromkeys(recipients) if recipient not in recipient_addrs]
+        if len(missing) > 0:
+            # create new addresses
+            recipient_addrs.update(await self.create_new_addresses(key, missing))
+            if any(recipient not in recipient_addrs for recipient in missing):
+                raise Exception("Recipient address not found. Cannot create new address")
+
+        chain_transfers: List[Tuple[str, Balance]] = [
+            (recipient_addrs[str(recipient)], amount) for recipient, amount in transfers
+        ]
+        total: Balance = Balance.from_rao(sum(amount.rao for _, amount in transfers))
+
+        ## Get transfer fee
+        transfer_fee: Balance = await self.api.get_batch_fee(sender_addr.address, chain_transfers, rctx)
+        # check if sender has enough balance, less what other in-flight transfers hold
+        sender_balance: Balance = await self.check_balance(sender, rctx=rctx)
+        if sender_balance - self.ledger.reserved(sender, exclude=reservation) < total + transfer_fee:
+            raise FeeException("Sender does not have enough balance", transfer_fee)
+
+        # transfer
+        try:
+            call, signature_payload, paymentInfo = await run_blocking(self.api.init_batch_transaction, sender_addr.address, chain_transfers, rctx)
+            api_transaction = {
+                'message': 'Signature Payload created',
+                'signature_payload_hex': signature_payload.to_hex(),
+                'paymentInfo': paymentInfo,
+                'call': call,
+            }
+
+            transaction_: Transaction = Transaction( sender, total.rao )
+            await self.record_transaction(transaction_)
+            _signed_transaction = await self.api.sign_transaction(self, api_transaction, sender_addr.address, key, rctx)
+            result = await run_blocking(self.api.send_transaction, _signed_transaction, rctx)
+            if not result:
+                raise Exception("Transaction failed")
+            await run_blocking(self.apply_transfers, sender_addr.address, result['balance'], chain_transfers, result.get('block'), result.get('fee'))
+        except Exception as e:
+            print(e)
+            raise Exception("Failed to transfer")
+
+    @timed(DB_SECONDS)
     async def add_deposit_address(self, user: str, addr: str) -> None:
         assert self.db is not None
 
         # check if address already has a user
-        _doc: Dict = self.db.addresses.find_one({
+        _doc: Dict = await run_blocking(self.db.addresses.find_one, {
             "address": addr
         })
         if _doc is not None:
@@ -207,21 +688,24 @@ class Database:
                 raise Exception("Address already has a user")
             else:
                 # update user
-                self.db.addresses.update_one({
+                await run_blocking(self.db.addresses.update_one, {
                     "address": addr,
                 }, {
                     "$set": {
                         "user": str(user)
                     }
                 })
+                self.events.publish(ADDRESS_ASSIGNED, str(user))
+                self.events.publish(ADDRESS_ACTIVE, (addr, str(user)))
         else:
             raise Exception("Address not found")
 
+    @timed(DB_SECONDS)
     async def set_welcomed_user(self, user: str, welcomed: bool) -> None:
         assert self.db is not None
 
         try:
-            self.db.addresses.update_one({
+            await run_blocking(self.db.addresses.update_one, {
                 "user": str(user)
             }, {
                 "$set": {
@@ -231,145 +715,265 @@ class Database:
         except Exception as e:
             print(e)
 
-    async def get_unwelcomed_users(self) -> List[str]:
+    @timed(DB_SECONDS)
+    async def set_welcomed_users(self, users: List[str], welcomed: bool) -> None:
+        assert self.db is not None
+        if len(users) == 0:
+            return
+
+        try:
+            await run_blocking(self.db.addresses.update_many, {
+                "user": {"$in": [str(user) for user in users]}
+            }, {
+                "$set": {
+                    "welcomed": welcomed
+                }
+            })
+        except Exception as e:
+            print(e, "db.set_welcomed_users")
+
+    @timed(DB_SECONDS)
+    async def get_unwelcomed_users(self, users: Optional[List[str]] = None) -> List[str]:
+        """
+        Returns the users not welcomed yet, out of users if given.
+        """
         assert self.db is not None
 
         query: Dict = {
-            "welcomed": False
+            "welcomed": False,
+            "user": {"$ne": None} if users is None else {"$in": [str(user) for user in users]}
         }
 
         try:
-            doc: Dict = self.db.addresses.find(query)
-            users: List[str] = [_doc["user"] for _doc in doc]
+            docs: List[Dict] = await run_blocking(lambda: list(self.db.addresses.find(query, {"user": 1})))
+            users: List[str] = [_doc["user"] for _doc in docs]
             return users
         except Exception as e:
             print(e)
             return []            
 
-class Tip:
-    time: datetime = None
-    amount: Balance = None
-    sender: str = None
-    recipient: str = None
+class Tip(_Immutable):
+    __slots__ = ("sender", "recipient", "amount", "time")
 
-    def __init__(self, sender:str, recipient: str, amount: Balance, time: datetime = datetime.now()) -> None:
-        self.amount = amount
-        self.sender = sender
-        self.recipient = recipient
-        self.time = time
+    time: datetime
+    amount: Balance
+    sender: str
+    recipient: str
+
+    def __init__(self, sender:str, recipient: str, amount: Balance, time: datetime = None) -> None:
+        _set(self, sender=sender, recipient=recipient, amount=amount, time=time if time is not None else datetime.now())
 
     def __str__(self) -> str:
         return f"{self.sender} -> {self.recipient} ({self.amount.tao}) tao"
 
-    async def send(self, db: Database, key: bytes) -> bool:
+    async def send(self, db: Database, key: bytes, rctx: RequestContext = NO_CONTEXT) -> bool:
         if (self.amount.rao < 0 or self.sender == self.recipient):
             return False
-        balance: Balance = await db.check_balance(self.sender)
-        if (balance < self.amount):
+        reservation: Optional[Reservation] = await db.reserve(self.sender, self.amount, rctx)
+        if (reservation is None):
+            # not enough unreserved balance, never reaches the chain
             return False
-        await db.transfer(self.sender, self.recipient, self.amount, key)
+        try:
+            await db.transfer(self.sender, self.recipient, self.amount, key, reservation, rctx)
+        except Exception:
+            db.ledger.release(reservation)
+            raise
+        db.ledger.commit(reservation)
         await db.record_tip(self)
         return True
 
+class Rain:
+    """
+    A tip split evenly between many recipients, sent as one extrinsic.
+    Dust left over from the split stays with the sender.
+    """
+    sender: str
+    amount: Balance # total
+    tips: List[Tip]
+
+    def __init__(self, sender: str, recipients: List[str], amount: Balance, time: datetime = None) -> None:
+        self.sender = sender
+        self.amount = amount
+        time = time if time is not None else datetime.now()
+        share: Balance = Balance.from_rao(amount.rao // len(recipients)) if len(recipients) > 0 else Balance.from_rao(0)
+        self.tips = [Tip(sender, recipient, share, time) for recipient in recipients]
+
+    def __str__(self) -> str:
+        return f"{self.sender} -> {len(self.tips)} users ({self.amount.tao}) tao"
+
+    async def send(self, db: Database, key: bytes, rctx: RequestContext = NO_CONTEXT) -> bool:
+        if (len(self.tips) == 0 or self.tips[0].amount.rao <= 0):
+            return False
+        if any(tip.recipient == self.sender for tip in self.tips):
+            return False
+        total: Balance = Balance.from_rao(sum(tip.amount.rao for tip in self.tips))
+        reservation: Optional[Reservation] = await db.reserve(self.sender, total, rctx)
+        if (reservation is None):
+            # not enough unreserved balance, never reaches the chain
+            return False
+        try:
+            await db.transfer_many(self.sender, [(tip.recipient, tip.amount) for tip in self.tips], key, reservation, rctx)
+        except Exception:
+            db.ledger.release(reservation)
+            raise
+        db.ledger.commit(reservation)
+        await db.record_tips(self.tips)
+        return True
+
 class WithdrawException(Exception):
     def __init__(self, address: str, amount: int, reason: str) -> None:
-        super().__init__(f"{address} {amount} {reason}")
+        super().__init__(f"{address} {Balance.from_rao(amount).tao} {reason}")
         self.address = address
         self.amount = amount
         self.reason = reason
 
 class DepositException(Exception):
     def __init__(self, address: str, amount: int, reason: str) -> None:
-        super().__init__(f"{address} {amount} {reason}")
+        super().__init__(f"{address} {Balance.from_rao(amount).tao} {reason}")
         self.address = address
         self.amount = amount
         self.reason = reason
-class Transaction:
+class Transaction(_Immutable):
+    __slots__ = ("user", "amount", "time", "fee")
+
     time: datetime
-    amount: float
+    amount: int # rao
     user: str
-    fee: float
+    fee: Optional[int] # rao, once quoted
 
-    def __init__(self, user:str, amount: float = 0.0, time: datetime = datetime.now()) -> None:
-        self.amount = amount
-        self.user = user
-        self.time = time
+    def __init__(self, user:str, amount: int = 0, time: datetime = None, fee: Optional[int] = None) -> None:
+        _set(self, user=user, amount=amount, time=time if time is not None else datetime.now(), fee=fee)
+
+    def with_fee(self, fee: int) -> 'Transaction':
+        return Transaction(self.user, self.amount, self.time, fee)
 
     def __str__(self) -> str:
-        return f"{self.amount} tao"
+        return f"{Balance.from_rao(self.amount).tao} tao"
 
-    async def withdraw(self, db: Database, coldkeyadd: str, key) -> float:
+    async def withdraw(self, db: Database, coldkeyadd: str, key, rctx: RequestContext = NO_CONTEXT) -> Balance:
+        """
+        Returns the new balance of the user.
+        """
         if (self.amount < 0):
             raise ValueError("Amount must be positive")
 
-        if not db.api.verify_coldkeyadd(coldkeyadd):
+        if not await run_blocking(db.api.verify_coldkeyadd, coldkeyadd):
             raise WithdrawException(coldkeyadd, self.amount, "withdraw coldkeyadd invalid")
 
         balance: Balance
-        withdraw_addr, balance = await db.api.find_withdraw_address(db, self, key)
+        withdraw_addr, balance = await db.api.find_withdraw_address(db, self, key, rctx)
 
         if withdraw_addr is None:
             raise WithdrawException(coldkeyadd, self.amount, "user address not found")
 
-        if (balance.tao < self.amount):
-            raise WithdrawException(coldkeyadd, self.amount, f"Balance {balance.tao} too low to withdraw {self.amount}")        
+        amount: Balance = Balance.from_rao(self.amount)
+        if (balance.rao < self.amount):
+            raise WithdrawException(coldkeyadd, self.amount, f"Balance {balance.tao} too low to withdraw {amount.tao}")        
+
+        reservation: Optional[Reservation] = db.ledger.reserve(self.user, amount, db.fee_estimate, balance)
+        if (reservation is None):
+            available: Balance = db.ledger.available(self.user, balance)
+            raise WithdrawException(coldkeyadd, self.amount, f"Balance {available.tao} not held by pending transfers too low to withdraw {amount.tao}")
+
+        try:
+            balance = await self._withdraw(db, coldkeyadd, key, withdraw_addr, balance, reservation, rctx)
+        except Exception:
+            db.ledger.release(reservation)
+            raise
+        db.ledger.commit(reservation)
+
+        return balance
 
+    async def _withdraw(self, db: Database, coldkeyadd: str, key: bytes, withdraw_addr: str, balance: Balance, reservation: Reservation, rctx: RequestContext = NO_CONTEXT) -> Balance:
         api_transaction = {
             "coldkeyadd": withdraw_addr,
             "dest": coldkeyadd,
-            "amount": self.amount # in tao for this addr
+            "amount": self.amount # in rao
         }
 
-        withdraw_fee: Balance = await db.api.get_withdraw_fee(api_transaction)
+        withdraw_fee: Balance = await db.api.get_withdraw_fee(api_transaction, rctx)
+        db.fee_estimate = withdraw_fee
 
-        if (balance.tao < self.amount + withdraw_fee.tao):
-            raise WithdrawException(coldkeyadd, self.amount, f"Balance {balance.tao} too low to withdraw {self.amount} for fee: {withdraw_fee.tao} tao")
-        self.fee = withdraw_fee.tao
+        available: Balance = balance - db.ledger.reserved(self.user, exclude=reservation)
+        if (available.rao < self.amount + withdraw_fee.rao):
+            raise WithdrawException(coldkeyadd, self.amount, f"Balance {available.tao} too low to withdraw {Balance.from_rao(self.amount).tao} for fee: {withdraw_fee.tao} tao")
+        await db.record_transaction(self.with_fee(withdraw_fee.rao))
 
-        await db.record_transaction(self)
-
-        _transaction = await db.api.create_transaction(api_transaction)
-        _signed_transaction = await db.api.sign_transaction(db, _transaction, withdraw_addr, key)
-        result = db.api.send_transaction(_signed_transaction)
+        _transaction = await db.api.create_transaction(api_transaction, rctx)
+        _signed_transaction = await db.api.sign_transaction(db, _transaction, withdraw_addr, key, rctx)
+        result = await run_blocking(db.api.send_transaction, _signed_transaction, rctx)
         if (not result):
             raise Exception("Transaction failed", 4)
         balance: 'Balance' = result['balance']
+        await run_blocking(db.apply_transfer, withdraw_addr, balance, None, Balance.from_rao(self.amount), result.get('block'), result.get('fee'))
 
-        return balance.tao
+        return balance
     
-    async def deposit(self, db: Database, key: bytes) -> float:
-        # Get wallet balance
-        addr: Address = await db.get_deposit_addr(self)
+    async def deposit(self, db: Database, key: bytes = None) -> int:
+        """
+        Records a deposit of self.amount rao, as observed by the deposit scanner.
+        """
+        addr: Optional[str] = await db.get_deposit_addr(self)
         if (addr is None):
             raise DepositException(self.user, self.amount, "No address found")
-        balance: Balance = await db.api.get_wallet_balance(addr.address)
-        self.amount = balance.tao # Set amount to new balance
         await db.record_transaction(self)
-        return balance.tao
+        return self.amount
+
+class Address(_Immutable):
+    """
+    A custodial address. The mnemonic is kept encrypted, and decrypted on first access
+    to `mnemonic` with the key given; `wipe` drops the plaintext again.
+    """
+    __slots__ = ("address", "_encrypted", "_plaintext", "_key")
 
-class Address:
     address: str # the public coldkeyaddr
-    mnemonic: str # mnemonic
 
-    def __init__(self, address: str, mnemonic: bytes, key: bytes, decrypt: bool = False) -> None:
-        self.address = address
-        self.mnemonic = mnemonic        
-        self.key = key
+    def __init__(self, address: str, mnemonic: bytes, key: Keys, decrypt: bool = False) -> None:
+        """
+        mnemonic is encrypted with decrypt=True (decrypted at once, raising if the key is wrong),
+        otherwise it's the plaintext of a new address; use Address.encrypted to decrypt lazily.
+        """
+        _set(self, address=address, _key=key, _encrypted=mnemonic if decrypt else None, _plaintext=None if decrypt else mnemonic)
         if (decrypt):
-            self.mnemonic = self.__unencrypt(mnemonic, key)
+            self.mnemonic
+
+    @classmethod
+    def encrypted(cls, address: str, mnemonic_encrypted: bytes, key: Optional[Keys]) -> 'Address':
+        """
+        An address as stored, the mnemonic isn't decrypted until used. key can be None if it won't be.
+        """
+        addr: Address = cls.__new__(cls)
+        _set(addr, address=address, _key=key, _encrypted=mnemonic_encrypted, _plaintext=None)
+        return addr
+
+    @property
+    def mnemonic(self) -> str:
+        if self._plaintext is None:
+            if self._key is None:
+                raise ValueError(f"no key to decrypt the mnemonic of {self.address}")
+            _set(self, _plaintext=self.__unencrypt(self._encrypted, self._key))
+        return self._plaintext
+
+    def wipe(self) -> None:
+        """
+        Drops the decrypted mnemonic. Python can't zero the string itself, this removes our reference to it.
+        """
+        if self._encrypted is not None:
+            _set(self, _plaintext=None)
 
     def get_encrypted_mnemonic(self) -> bytes:
-        return self.__encrypt(self.mnemonic, self.key)
+        if self._encrypted is not None:
+            return self._encrypted
+        return self.__encrypt(self._plaintext, self._key)
 
     @staticmethod
-    def __unencrypt(mnemonic_encrypted: bytes, key: bytes) -> str:
-        cipher_suite = Fernet(key)
-        unciphered_text = cipher_suite.decrypt(mnemonic_encrypted)
+    def __unencrypt(mnemonic_encrypted: bytes, key: Keys) -> str:
+        with span("crypto.decrypt"):
+            unciphered_text = cipher(key).decrypt(mnemonic_encrypted)
         return str(unciphered_text, "utf-8")
 
     @staticmethod
-    def __encrypt(mnemonic: str, key: bytes) -> str:
-        cipher_suite = Fernet(key)
-        ciphered_text = cipher_suite.encrypt(bytes(mnemonic, "utf-8"))   #required to be bytes
+    def __encrypt(mnemonic: str, key: Keys) -> bytes:
+        with span("crypto.encrypt"):
+            ciphered_text = cipher(key).encrypt(bytes(mnemonic, "utf-8"))   #required to be bytes
         return ciphered_text
-        
\ No newline at end of file
@@ -0,0 +1,147 @@
+import asyncio
+import time
+from typing import Dict, List, Optional, Tuple
+
+import interactions
+
+# Routes paced ahead of Discord when DMing a guild member, with (requests, per seconds):
+# Discord's per channel message limit, and its DM opening limit, which is not announced
+# in headers but answered with 40003 when exceeded. Other routes, e.g. fetching the member,
+# only go through the global bucket: the interactions HTTP client already waits out
+# X-RateLimit-Reset-After once a route's X-RateLimit-Remaining reaches 0.
+ROUTE_LIMITS: Dict[str, Tuple[int, float]] = {
+    "POST /users/@me/channels": (5, 1.0),
+    "POST /channels/{channel_id}/messages": (5, 5.0), # per channel
+}
+
+# 429s the HTTP client doesn't retry itself, e.g. "You are opening direct messages too fast"
+RATE_LIMITED_CODES: Tuple[int, ...] = (429, 40003)
+DEFAULT_RETRY_AFTER: float = 5.0 # if Discord's answer has no retry_after
+
+
+class TokenBucket:
+    """
+    Allows `capacity` acquisitions per `per` seconds, waiting when the bucket is empty.
+    """
+    def __init__(self, capacity: int, per: float) -> None:
+        self.capacity = capacity
+        self.rate = capacity / per
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    async def acquire(self) -> None:
+        if self._lock is None:
+            # created on first use, on the loop that uses it
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now: float = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now < self.blocked_until:
+                    await asyncio.sleep(self.blocked_until - now)
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def block(self, seconds: float) -> None:
+        """
+        Discord answered 429; wait out retry_after before the next request.
+        """
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+class RouteRateLimiter:
+    """
+    A global token bucket plus one per Discord rate-limit route (and major parameter).
+    """
+    def __init__(self, global_rate: int = 40, routes: Dict[str, Tuple[int, float]] = ROUTE_LIMITS) -> None:
+        self.global_bucket = TokenBucket(global_rate, 1.0)
+        self.routes = routes
+        self.buckets: Dict[str, TokenBucket] = {}
+
+    def bucket(self, route: str, major: str = "") -> Optional[TokenBucket]:
+        key: str = f"{route}:{major}"
+        bucket: Optional[TokenBucket] = self.buckets.get(key)
+        if bucket is None and route in self.routes:
+            bucket = self.buckets[key] = TokenBucket(*self.routes[route])
+        return bucket
+
+    async def acquire(self, route: str, major: str = "") -> None:
+        bucket: Optional[TokenBucket] = self.bucket(route, major)
+        if bucket is not None:
+            await bucket.acquire()
+        await self.global_bucket.acquire()
+
+
+discord_limiter: RouteRateLimiter = RouteRateLimiter()
+
+
+class DispatchResult:
+    sent: List[str]
+    failed: List[Tuple[str, str]] # (user, reason)
+    not_found: List[str]
+    rate_limited: List[str] # not sent yet, worth retrying
+
+    def __init__(self) -> None:
+        self.sent = []
+        self.failed = []
+        self.not_found = []
+        self.rate_limited = []
+
+    def __str__(self) -> str:
+        return f"{len(self.sent)} sent, {len(self.failed)} failed, {len(self.not_found)} not found, {len(self.rate_limited)} rate limited"
+
+
+class DMDispatcher:
+    """
+    Sends the same DM to many guild members, `concurrency` at a time, paced by a RouteRateLimiter.
+    """
+    def __init__(self, client: interactions.Client, guild_id: int, concurrency: int = 8, limiter: RouteRateLimiter = discord_limiter) -> None:
+        self.client = client
+        self.guild_id = guild_id
+        self.concurrency = concurrency
+        self.limiter = limiter
+
+    async def dispatch(self, users: List[str], message: str) -> DispatchResult:
+        result: DispatchResult = DispatchResult()
+        semaphore: asyncio.Semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def send(user: str) -> None:
+            async with semaphore:
+                await self._send(user, message, result)
+
+        await asyncio.gather(*[send(user) for user in users])
+        return result
+
+    async def _send(self, user: str, message: str, result: DispatchResult) -> None:
+        try:
+            await self.limiter.acquire("GET /guilds/{guild_id}/members/{user_id}", str(self.guild_id))
+            member: Optional[interactions.Member] = await interactions.get(self.client, interactions.Member, object_id=int(user), parent_id=self.guild_id)
+        except Exception as e:
+            print(e, "dispatch.get_member")
+            member = None
+        if member is None:
+            result.not_found.append(user)
+            return
+
+        try:
+            # member.send opens the DM channel, then posts to it
+            await self.limiter.acquire("POST /users/@me/channels")
+            await self.limiter.acquire("POST /channels/{channel_id}/messages", user)
+            await member.send(message)
+            result.sent.append(user)
+        except interactions.LibraryException as e:
+            if e.code in RATE_LIMITED_CODES:
+                retry_after: float = float((e.data or {}).get("retry_after", DEFAULT_RETRY_AFTER))
+                self.limiter.bucket("POST /users/@me/channels").block(retry_after)
+                result.rate_limited.append(user)
+                return
+            result.failed.append((user, f"{member.name} ({member.id}): {e.message}"))
+        except Exception as e:
+            result.failed.append((user, f"{member.name} ({member.id}): {e}"))
@@ -1,14 +1,22 @@
+import asyncio
+import functools
+from datetime import datetime, timedelta
 from string import Template
 from typing import Dict, List, Tuple, Optional, Union
 
-import pymongo
-from bittensor import Balance
-from tqdm import tqdm
-from websocket import WebSocketException
+from .balance import Balance
 import interactions
 
 from . import api, config
-from .db import Database, DepositException, FeeException, Tip, Transaction, WithdrawException
+from .cache import entity_cache
+from .context import RequestContext
+from .db import Address, BalanceRecord, Database, DepositException, FeeException, Rain, Tip, Transaction, WithdrawException
+from .dispatch import DispatchResult, DMDispatcher
+from .events import ADDRESS_ACTIVE
+from .executor import run_blocking
+from .jobs import Job
+from .startup import connect_mongo, connect_subtensor, connect_with_retry
+from .tracing import traced
 
 
 class DeltaTemplate(Template):
@@ -23,66 +31,86 @@ def strfdelta(tdelta, fmt):
     return t.substitute(**d)
 
 async def is_in_DM(ctx: interactions.CommandContext) -> bool:
-    return (await ctx.get_channel()).type == interactions.ChannelType.DM
+    return (await entity_cache.channel_type(ctx)) == interactions.ChannelType.DM
 
-async def on_ready_(client: interactions.Client, config: config.Config) -> Tuple[api.API, Database]:
+@traced("handler.send_dm")
+async def send_dm(config: config.Config, bot: interactions.Client, user_id: str, message: str) -> None:
     try:
-        _api = api.API(config, testing=config.TESTING)
-    except WebSocketException as e:
-        print(e)
-        print("Failed to connect to Substrate node...")
-        _api = None
-
-    print('We have logged in as {}'.format(client.me.name))
-    if (_api is None or not (await _api.test_connection())):
-        print("Error: Can't connect to subtensor node...")
-        _api = None
-    print(f"Connected to Bittensor ({_api.network})!")
+        member: interactions.Member = await entity_cache.get_member(bot, config.BITTENSOR_DISCORD_SERVER, user_id)
+        await member.send(message)
+    except Exception as e:
+        print(e, "send_dm")
 
+@traced("handler.send_to_channel")
+async def send_to_channel(bot: interactions.Client, channel_id: str, message: str) -> None:
     try:
-        mongo_uri = config.MONGO_URI_TEST if config.TESTING else config.MONGO_URI
-        _db = Database(pymongo.MongoClient(mongo_uri), _api, config.TESTING)
+        channel: interactions.Channel = await entity_cache.get_channel(bot, channel_id)
+        await channel.send(message)
     except Exception as e:
-        print(e)
-        print("Can't connect to db...")  
-        _db = None
+        print(e, "send_to_channel")
+
+async def job_source(_db: Database, user_id: str) -> str:
+    """
+    Jobs moving funds out of the same address must not run concurrently.
+    """
+    addr: Optional[Address] = await run_blocking(_db.get_address_by_user, user_id)
+    if addr is None:
+        return f"user:{user_id}"
+    return addr.address
+
+async def on_ready_(client: interactions.Client, config: config.Config) -> Tuple[api.API, Database]:
+    """
+    Connects to subtensor and mongo in parallel, retrying with backoff.
+    Raises if either can't be reached after config.STARTUP_RETRIES attempts.
+    """
+    _api, mongo_client = await asyncio.gather(
+        connect_with_retry("subtensor", functools.partial(connect_subtensor, config), config.STARTUP_RETRIES),
+        connect_with_retry("mongo", functools.partial(connect_mongo, config), config.STARTUP_RETRIES),
+    )
+    print(f"Connected to Bittensor ({_api.network})!")
+
+    _db = Database(mongo_client, _api, config.TESTING, config.BALANCE_REFRESH_INTERVAL, Balance.from_tao(config.ESTIMATED_FEE))
+    return _api, _db
 
-    if _db is not None:
-        if _api is not None:
-            balance = Balance(0.0)
-            addrs: List[Dict] = list(await _db.get_all_addresses())
-            for addr in tqdm(addrs, "Checking Balances..."):
-                _balance = _api.get_wallet_balance(addr["address"])
-                balance += _balance
 
-            print(f"Wallet Balance: {balance}")
-        
-    return _api, _db  
+async def log_wallet_balance( _db: Database ) -> None:
+    # total of the balance read model, kept up to date by the deposit scan
+    balance: Balance = await _db.get_total_balance()
+    print(f"Wallet Balance: {balance}")
 
 
+@traced("handler.check_enough_tao")
 async def check_enough_tao( config: config.Config, _db: Database, ctx: interactions.context._Context, sender: interactions.User, amount: Balance) -> bool:
-    balance: Balance = await _db.check_balance(sender.id)
+    # in-memory compare against the balance not held by in-flight tips and withdrawals
+    balance: Balance = await _db.available_balance(sender.id, RequestContext())
     is_not_DM: bool = not await is_in_DM(ctx)
 
-    if (balance < amount):
+    if (balance < amount + _db.fee_estimate):
         await ctx.send(f"You don't have enough tao to tip {amount.tao} tao", ephemeral=is_not_DM)
         return False
     return True
 
 
+@traced("handler.tip_user")
 async def tip_user( config: config.Config, _db: Database, bot: interactions.Client, ctx: interactions.context._Context, sender: interactions.User, recipient: interactions.User, amount: Balance) -> None:
     is_not_DM: bool = not await is_in_DM(ctx)
 
+    if (_db.jobs is not None):
+        # a worker sends the tip and posts the result in this channel
+        await run_blocking(_db.jobs.enqueue, "tip", await job_source(_db, str(sender.id)), {
+            "sender": str(sender.id),
+            "recipient": str(recipient.id),
+            "amount": amount.rao,
+            "channel_id": str(ctx.channel_id),
+        })
+        await ctx.send(f"Sending your tip to {recipient.mention}...", ephemeral=is_not_DM)
+        return
+
     t = Tip(sender.id, recipient.id, amount)
     try:
-        result = await t.send(_db, config.COLDKEY_SECRET)
+        result = await t.send(_db, config.COLDKEY_SECRET, RequestContext())
     except FeeException as e:
-        try:
-            member: interactions.Member = await interactions.get(bot, interactions.Member, parent_id=config.BITTENSOR_DISCORD_SERVER, objected_id=sender.id)
-            await member.send(f"You do not have enough balance to tip {amount.tao} tao with fee {e.fee.tao}")
-        except Exception as e:
-            print(e)
-            
+        await send_dm(config, bot, sender.id, f"You do not have enough balance to tip {amount.tao} tao with fee {e.fee.tao}")
         await ctx.send("Tip Canceled")
         await ctx.message.delete()
         return
@@ -92,26 +120,113 @@ async def tip_user( config: config.Config, _db: Database, bot: interactions.Clie
         await ctx.send(f"{sender.mention} tipped {recipient.mention} {amount.tao} tao")
     else:
         print(f"{sender} tried to tip {recipient} {amount.tao} tao but failed")
-        try:
-            member: interactions.Member = await interactions.get(bot, interactions.Member, parent_id=config.BITTENSOR_DISCORD_SERVER, objected_id=sender.id)
-            await member.send(f"You tried to tip {recipient.mention} {amount.tao} tao but it failed")
-        except Exception as e:
-            print(e)
+        await send_dm(config, bot, sender.id, f"You tried to tip {recipient.mention} {amount.tao} tao but it failed")
 
         await ctx.send("Tip Canceled")
         await ctx.message.delete()
 
 
+@traced("handler.run_tip_job")
+async def run_tip_job( config: config.Config, _db: Database, bot: interactions.Client, job: Job ) -> None:
+    sender: str = job.payload["sender"]
+    recipient: str = job.payload["recipient"]
+    amount: Balance = Balance.from_rao(job.payload["amount"])
+
+    t = Tip(sender, recipient, amount)
+    try:
+        result = await t.send(_db, config.COLDKEY_SECRET, RequestContext())
+    except FeeException as e:
+        await send_dm(config, bot, sender, f"You do not have enough balance to tip {amount.tao} tao with fee {e.fee.tao}")
+        return
+
+    if (result):
+        print(f"{sender} tipped {recipient} {amount.tao} tao")
+        await send_to_channel(bot, job.payload["channel_id"], f"<@{sender}> tipped <@{recipient}> {amount.tao} tao")
+    else:
+        print(f"{sender} tried to tip {recipient} {amount.tao} tao but failed")
+        await send_dm(config, bot, sender, f"You tried to tip <@{recipient}> {amount.tao} tao but it failed")
+
+
+@traced("handler.rain")
+async def rain( config: config.Config, _db: Database, bot: interactions.Client, ctx: interactions.context._Context, sender: interactions.User, recipients: List[str], amount: Balance) -> None:
+    is_not_DM: bool = not await is_in_DM(ctx)
+
+    if (_db.jobs is not None):
+        # a worker sends the batch and posts the result in this channel
+        await run_blocking(_db.jobs.enqueue, "rain", await job_source(_db, str(sender.id)), {
+            "sender": str(sender.id),
+            "recipients": recipients,
+            "amount": amount.rao,
+            "channel_id": str(ctx.channel_id),
+        })
+        await ctx.send(f"Making it rain on {len(recipients)} users...", ephemeral=is_not_DM)
+        return
+
+    r = Rain(str(sender.id), recipients, amount)
+    try:
+        result = await r.send(_db, config.COLDKEY_SECRET, RequestContext())
+    except FeeException as e:
+        await ctx.send(f"You do not have enough balance to rain {amount.tao} tao with fee {e.fee.tao}", ephemeral=is_not_DM)
+        return
+
+    if (result):
+        print(f"{r}")
+        await ctx.send(rain_message(r))
+    else:
+        print(f"{sender} tried to rain {amount.tao} tao on {len(recipients)} users but failed")
+        await ctx.send("Rain Canceled", ephemeral=is_not_DM)
+
+
+def rain_message(r: Rain) -> str:
+    mentions: str = " ".join(f"<@{tip.recipient}>" for tip in r.tips)
+    return f"<@{r.sender}> made it rain! {mentions} each got {r.tips[0].amount.tao} tao"
+
+
+@traced("handler.run_rain_job")
+async def run_rain_job( config: config.Config, _db: Database, bot: interactions.Client, job: Job ) -> None:
+    sender: str = job.payload["sender"]
+    amount: Balance = Balance.from_rao(job.payload["amount"])
+
+    r = Rain(sender, job.payload["recipients"], amount)
+    try:
+        result = await r.send(_db, config.COLDKEY_SECRET, RequestContext())
+    except FeeException as e:
+        await send_dm(config, bot, sender, f"You do not have enough balance to rain {amount.tao} tao with fee {e.fee.tao}")
+        return
+
+    if (result):
+        print(f"{r}")
+        await send_to_channel(bot, job.payload["channel_id"], rain_message(r))
+    else:
+        print(f"{sender} tried to rain {amount.tao} tao on {len(r.tips)} users but failed")
+        await send_dm(config, bot, sender, f"You tried to rain {amount.tao} tao but it failed")
+
+
+@traced("handler.do_withdraw")
 async def do_withdraw( config: config.Config, _db: Database, ctx: interactions.CommandContext, user: interactions.User, ss58_address: str, amount: Balance):
     is_not_DM: bool = not await is_in_DM(ctx)
 
-    t = Transaction(user.id, amount.tao)
-    new_balance: int = None
+    if (_db.jobs is not None):
+        # rejected now rather than in a DM once a worker gets to it
+        if not await run_blocking(_db.api.verify_coldkeyadd, ss58_address):
+            await ctx.send(f"{WithdrawException(ss58_address, amount.rao, 'withdraw coldkeyadd invalid')}", ephemeral=is_not_DM)
+            return
+        # a worker makes the withdrawal and DMs the result
+        await run_blocking(_db.jobs.enqueue, "withdraw", await job_source(_db, str(user.id)), {
+            "user": str(user.id),
+            "ss58_address": ss58_address,
+            "amount": amount.rao,
+        })
+        await ctx.send("Your withdrawal is being processed. You will get a DM when it is done.", ephemeral=is_not_DM)
+        return
+
+    t = Transaction(user.id, amount.rao)
+    new_balance: Optional[Balance] = None
 
     # must be withdraw
     try:
-        new_balance = await t.withdraw(_db, ss58_address, config.COLDKEY_SECRET)
-        await ctx.send(f"Withdrawal successful.\nYour new balance is: {new_balance} tao", ephemeral=is_not_DM)
+        new_balance = await t.withdraw(_db, ss58_address, config.COLDKEY_SECRET, RequestContext())
+        await ctx.send(f"Withdrawal successful.\nYour new balance is: {new_balance.tao} tao", ephemeral=is_not_DM)
     except WithdrawException as e:
         await ctx.send(f"{e}", ephemeral=is_not_DM)
         return
@@ -120,13 +235,35 @@ async def do_withdraw( config: config.Config, _db: Database, ctx: interactions.C
         await ctx.send("Error making withdraw. Please contact " + config.MAINTAINER, ephemeral=is_not_DM)
 
     if (t):
-        print(f"{user} withdrew {amount} tao: {new_balance}")
+        print(f"{user} withdrew {amount.tao} tao: {new_balance}")
     else:
-        print(f"{user} tried to withdraw {amount} tao but failed")
+        print(f"{user} tried to withdraw {amount.tao} tao but failed")
     
     return None
 
 
+@traced("handler.run_withdraw_job")
+async def run_withdraw_job( config: config.Config, _db: Database, bot: interactions.Client, job: Job ) -> None:
+    user: str = job.payload["user"]
+    amount: Balance = Balance.from_rao(job.payload["amount"])
+
+    t = Transaction(user, amount.rao)
+    try:
+        new_balance = await t.withdraw(_db, job.payload["ss58_address"], config.COLDKEY_SECRET, RequestContext())
+    except WithdrawException as e:
+        await send_dm(config, bot, user, f"{e}")
+        return
+
+    print(f"{user} withdrew {amount.tao} tao: {new_balance}")
+    await send_dm(config, bot, user, f"Withdrawal successful.\nYour new balance is: {new_balance.tao} tao")
+
+
+async def on_job_failure( config: config.Config, bot: interactions.Client, job: Job, error: str ) -> None:
+    user: str = job.payload.get("sender", job.payload.get("user"))
+    await send_dm(config, bot, user, f"Your {job.kind} could not be completed. Please check your balance and contact {config.MAINTAINER}")
+
+
+@traced("handler.do_deposit")
 async def do_deposit( config: config.Config, _db: Database, ctx: interactions.CommandContext, user: interactions.User ):
     is_not_DM: bool = not await is_in_DM(ctx)
 
@@ -139,6 +276,8 @@ async def do_deposit( config: config.Config, _db: Database, ctx: interactions.Co
         if (deposit_addr is None):
             await ctx.send(f"You don't have a deposit address yet. One will be created for you.", ephemeral=is_not_DM)
             deposit_addr = await _db.get_deposit_addr(t, config.COLDKEY_SECRET)
+        # read its balance often while the user may be depositing
+        _db.events.publish(ADDRESS_ACTIVE, (deposit_addr, str(user.id)))
         await ctx.send(f"Please deposit to {deposit_addr}.\nThis address is linked to your discord account.\nOnly you will be able to withdraw from it.", ephemeral=is_not_DM)
     except DepositException as e:
         await ctx.send(f"Error: {e}", ephemeral=is_not_DM)
@@ -153,36 +292,61 @@ async def do_deposit( config: config.Config, _db: Database, ctx: interactions.Co
     else:
         print(f"{user} tried to deposit tao but failed")
 
-async def do_balance_check(config: config.Config, _db: Database, ctx: interactions.CommandContext, user: interactions.User ):
-    balance: Balance = await _db.check_balance(user.id)
+@traced("handler.do_balance_check")
+async def do_balance_check(config: config.Config, _db: Database, ctx: interactions.CommandContext, user: interactions.User, refresh: bool = False ):
     is_not_DM: bool = not await is_in_DM(ctx)
+    message: str = ""
+
+    if (refresh and not _db.can_refresh_balance(user.id)):
+        # forced refreshes are rate limited per user, answer from the read model instead
+        message += f"You can refresh your balance again in {_db.seconds_until_refresh(user.id):.0f}s\n"
+        refresh = False
+
+    rctx: RequestContext = RequestContext()
+    balance: Balance = await _db.check_balance(user.id, refresh=refresh, rctx=rctx)
+    message += f"Your balance is {balance.tao} tao"
+
+    if (config.SHOW_BALANCE_STALENESS):
+        record: Optional[BalanceRecord] = await run_blocking(_db.get_cached_balance, user.id, rctx)
+        if (record is not None):
+            elapsed: timedelta = datetime.now() - record.time
+            age: str = strfdelta(elapsed, "%{D}d %{H}h %{M}m %{S}s" if elapsed.days > 0 else "%{H}h %{M}m %{S}s")
+            message += f"\n(as of block {record.block}, updated {age} ago)"
 
     # if ctx is a guild channel, balance is ephemeral
-    await ctx.send(f"Your balance is {balance.tao} tao", ephemeral=is_not_DM)
+    await ctx.send(message, ephemeral=is_not_DM)
 
-async def welcome_new_users( _db: Database, client: interactions.Client, config: config.Config):
+async def welcome_new_users( _db: Database, client: interactions.Client, config: config.Config, users: Optional[List[str]] = None):
+    """
+    Welcomes the given users, or every user not welcomed yet. Users already welcomed are skipped.
+    """
     if (_db is None):
         return
 
     await client.wait_until_ready()
 
-    users: List[str] = await _db.get_unwelcomed_users()
-    for user in tqdm(users, f"Welcoming new users... {[user for user in users]}"):
-        discord_user: interactions.Member = await interactions.get(client, interactions.Member, object_id=user, parent_id=config.BITTENSOR_DISCORD_SERVER)
+    users = await _db.get_unwelcomed_users(users)
+    if (len(users) == 0):
+        return
 
-        if (discord_user is None):
-            print(f"{user} is not a valid discord user in the guild")
-            continue
-        try:
-            await discord_user.send(f"""Welcome! You can deposit or withdraw tao using the following commands:\n{config.HELP_STR}
+    print(f"Welcoming {len(users)} new users...")
+    dispatcher: DMDispatcher = DMDispatcher(client, config.BITTENSOR_DISCORD_SERVER, config.WELCOME_CONCURRENCY)
+    result: DispatchResult = await dispatcher.dispatch(users, f"""Welcome! You can deposit or withdraw tao using the following commands:\n{config.HELP_STR}
             \nPlease backup your mnemonic on the following website: {config.EXPORT_URL}""")
-            await _db.set_welcomed_user(user, True)
-        except Exception as e:
-            print(e)
-            print(f"Can't send welcome message to user... {discord_user.name} ({discord_user.id})")
-            print("Trying to send to maintainer...")
-            maintainer: interactions.Member = await interactions.get(client, interactions.Member, object_id=int(config.MAINTAINER[3:-1]), parent_id=config.BITTENSOR_DISCORD_SERVER)
-            await maintainer.send(f"Can't send welcome message to user... {discord_user.name} ({discord_user.id})")
-            await _db.set_welcomed_user(user, True)
-
-        
\ No newline at end of file
+    print(f"Welcomed new users: {result}")
+    for user in result.not_found:
+        print(f"{user} is not a valid discord user in the guild")
+
+    # users we couldn't DM are reported once and not retried, rate limited ones are retried on the next pass
+    await _db.set_welcomed_users(result.sent + [user for user, _ in result.failed], True)
+
+    if (len(result.failed) > 0):
+        summary: str = f"Can't send welcome message to {len(result.failed)} users..."
+        for _, reason in result.failed:
+            line: str = f"\n{reason}"
+            if (len(summary) + len(line) > 1900):
+                summary += "\n..."
+                break
+            summary += line
+        print(summary)
+        await send_dm(config, client, config.MAINTAINER[3:-1], summary)
@@ -0,0 +1,175 @@
+import asyncio
+import threading
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import pymongo
+from bson import ObjectId
+
+from .executor import run_blocking
+
+# topics
+ADDRESS_ASSIGNED: str = "address_assigned" # payload: user id
+ADDRESS_ACTIVE: str = "address_active" # payload: (address, user id), its balance may change soon
+BALANCE_CHANGED: str = "balance_changed" # payload: address whose balance record was changed
+
+
+class EventBus:
+    """
+    In-process publish/subscribe.
+
+    Each subscriber gets its own asyncio.Queue on the loop it subscribed from.
+    publish never blocks, and may be called from any thread.
+    Events published by other instances (see EventRelay) are marked `relayed`.
+    """
+    def __init__(self) -> None:
+        self._subscribers: Dict[str, List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue, bool, bool]]] = {}
+
+    def subscribe(self, topic: str, relayed: bool = True, local: bool = True) -> asyncio.Queue:
+        """
+        relayed: receive the events of other instances.
+        local: receive the events of this instance.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        self._subscribers.setdefault(topic, []).append((asyncio.get_running_loop(), queue, relayed, local))
+        return queue
+
+    def unsubscribe(self, topic: str, queue: asyncio.Queue) -> None:
+        self._subscribers[topic] = [s for s in self._subscribers.get(topic, []) if s[1] is not queue]
+
+    def publish(self, topic: str, payload: Any, relayed: bool = False) -> None:
+        try:
+            running: Optional[asyncio.AbstractEventLoop] = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+
+        for loop, queue, wants_relayed, wants_local in self._subscribers.get(topic, []):
+            if (relayed and not wants_relayed) or (not relayed and not wants_local):
+                continue
+            if loop is running:
+                queue.put_nowait(payload)
+            elif not loop.is_closed():
+                loop.call_soon_threadsafe(queue.put_nowait, payload)
+
+
+class ChangeStreamListener:
+    """
+    Publishes ADDRESS_ASSIGNED for addresses assigned by any instance, using a Mongo change stream.
+
+    Change streams need a replica set. The stream is read on a background thread.
+    """
+    def __init__(self, collection, bus: EventBus) -> None:
+        self.collection = collection
+        self.bus = bus
+        self._stream = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._listen, name="address-change-stream", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._stream is not None:
+            self._stream.close()
+
+    def _listen(self) -> None:
+        pipeline: List[Dict] = [{
+            "$match": {
+                "operationType": {"$in": ["insert", "update", "replace"]},
+                "fullDocument.user": {"$ne": None},
+                "fullDocument.welcomed": False,
+            }
+        }]
+        resume_token = None
+        while not self._stopped.is_set():
+            try:
+                with self.collection.watch(pipeline, full_document="updateLookup", resume_after=resume_token) as stream:
+                    self._stream = stream
+                    for change in stream:
+                        resume_token = stream.resume_token
+                        # every instance sees the change, it needs no relaying
+                        self.bus.publish(ADDRESS_ASSIGNED, change["fullDocument"]["user"], relayed=True)
+            except Exception as e:
+                if self._stopped.is_set():
+                    return
+                print(e, "events.change_stream")
+                self._stopped.wait(5.0)
+
+
+class EventRelay:
+    """
+    Relays events between instances through the relayed_events collection, so that the
+    leader (see leader.LeaderElection) hears of the addresses assigned and used on any instance,
+    and every instance of the balances changed on the others.
+
+    Every instance forwards the events published on its bus, and replays the ones of the
+    topics it needs, forwarded by the other instances, polling every `poll_interval` seconds.
+    Relayed events are removed by a TTL index after `ttl` seconds.
+    Mongo is only called through executor.run_blocking, off the event loop.
+    """
+    def __init__(self, db, bus: EventBus, instance_id: str, topics: Sequence[str] = (ADDRESS_ASSIGNED, ADDRESS_ACTIVE, BALANCE_CHANGED),
+            poll_interval: float = 2.0, ttl: float = 3600.0, skew: float = 10.0) -> None:
+        self.events = db.relayed_events
+        self.bus = bus
+        self.instance_id = instance_id
+        self.topics = topics
+        self.poll_interval = poll_interval
+        self.skew = skew
+        self.ttl = ttl
+
+    async def forward(self) -> None:
+        try:
+            await run_blocking(self.events.create_index, "time", expireAfterSeconds=int(self.ttl))
+        except Exception as e:
+            print(e, "events.forward")
+        await asyncio.gather(*(self._forward(topic) for topic in self.topics))
+
+    async def _forward(self, topic: str) -> None:
+        queue: asyncio.Queue = self.bus.subscribe(topic, relayed=False)
+        while True:
+            payloads: List[Any] = [await queue.get()]
+            while not queue.empty():
+                payloads.append(queue.get_nowait())
+            try:
+                now: datetime = datetime.utcnow()
+                await run_blocking(self.events.insert_many, [
+                    {"topic": topic, "payload": payload, "origin": self.instance_id, "time": now}
+                    for payload in payloads
+                ], ordered=False)
+            except Exception as e:
+                print(e, "events.forward")
+
+    async def replay(self, since: datetime, topics: Optional[Sequence[str]] = None) -> None:
+        """
+        Publishes the events of topics (by default every relayed one) other instances forwarded
+        after `since`, then as they are forwarded.
+
+        Events are stamped by the clock of the instance forwarding them, before they are inserted,
+        so one may show up stamped earlier than events already read (clock skew, a slow insert).
+        Each read goes back `skew` seconds before the newest event read, skipping the ones replayed.
+        """
+        topics = list(topics or self.topics)
+        newest: datetime = since
+        seen: Dict[ObjectId, datetime] = {} # ids of the events replayed in the window, and their time
+        while True:
+            try:
+                start: datetime = max(since, newest - timedelta(seconds=self.skew))
+                docs: List[Dict] = await run_blocking(lambda: list(self.events.find({
+                    "time": {"$gte": start},
+                    "origin": {"$ne": self.instance_id},
+                    "topic": {"$in": topics},
+                }).sort("time", pymongo.ASCENDING)))
+                for doc in docs:
+                    if doc["_id"] in seen:
+                        continue
+                    seen[doc["_id"]] = doc["time"]
+                    newest = max(newest, doc["time"])
+                    self.bus.publish(doc["topic"], doc["payload"], relayed=True)
+                # the window moved on, older events aren't read again
+                start = max(since, newest - timedelta(seconds=self.skew))
+                seen = {_id: time for _id, time in seen.items() if time >= start}
+            except Exception as e:
+                print(e, "events.replay")
+            await asyncio.sleep(self.poll_interval)
@@ -0,0 +1,85 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Optional, TypeVar
+
+import interactions
+
+from .tracing import span
+
+T = TypeVar("T")
+
+# runs blocking chain and Mongo calls, see run_blocking
+_blocking_pool: Optional[ThreadPoolExecutor] = None
+
+
+def configure_blocking(threads: int) -> None:
+    global _blocking_pool
+    if _blocking_pool is not None:
+        _blocking_pool.shutdown(wait=False)
+    _blocking_pool = ThreadPoolExecutor(threads, thread_name_prefix="blocking") if threads > 0 else None
+
+
+async def run_blocking(function: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    Runs a blocking pymongo or substrate call on the blocking pool, so the event loop keeps
+    acknowledging and answering other commands meanwhile.
+
+    Runs the call inline until configure_blocking is called (e.g. in tests).
+    """
+    if _blocking_pool is None:
+        return function(*args, **kwargs)
+    # the thread sees the current trace span
+    context: contextvars.Context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        _blocking_pool, functools.partial(context.run, function, *args, **kwargs)
+    )
+
+
+class CommandExecutor:
+    """
+    Runs slow command handlers after acknowledging the interaction.
+
+    The interaction is deferred right away, so Discord's 3 second window never depends
+    on the chain. Handlers then run at most max_concurrent at a time and answer with
+    follow-ups, which Discord accepts for 15 minutes. Their chain and Mongo calls run on
+    the blocking pool (see run_blocking), so a slow one doesn't hold up other commands' defers.
+
+    A handler that outlives its timeout is not cancelled (it may be mid-transfer):
+    the user is told it is still running and gets its result when it finishes.
+    """
+    def __init__(self, max_concurrent: int = 16, timeout: float = 10.0) -> None:
+        self.max_concurrent = max_concurrent
+        self.timeout = timeout
+        self._semaphore: asyncio.Semaphore = None
+
+    async def run(self, ctx: interactions.context._Context, handler: Callable[[], Awaitable[None]], ephemeral: bool = False) -> None:
+        if self._semaphore is None:
+            # created on first use, on the loop that uses it
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        await ctx.defer(ephemeral=ephemeral)
+
+        task: asyncio.Task = asyncio.ensure_future(self._run(ctx, handler))
+        try:
+            await asyncio.wait_for(asyncio.shield(task), self.timeout)
+        except asyncio.TimeoutError:
+            print(f"{ctx.user} command still running after {self.timeout}s")
+            try:
+                await ctx.send("Still working on it, you will get an answer here when it's done.", ephemeral=ephemeral)
+            except Exception as e:
+                print(e, "executor.timeout")
+
+    async def _run(self, ctx: interactions.context._Context, handler: Callable[[], Awaitable[None]]) -> None:
+        # keeps the command's trace open until the handler is done, even past the timeout
+        with span("executor.handler"):
+            async with self._semaphore:
+                try:
+                    await handler()
+                except Exception as e:
+                    print(e, "executor.run")
+                    try:
+                        await ctx.send("Something went wrong, please try again later.", ephemeral=True)
+                    except Exception as e:
+                        print(e, "executor.error")
@@ -0,0 +1,268 @@
+import asyncio
+import socket
+import uuid
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
+import pymongo
+import pymongo.errors
+from bson.objectid import ObjectId
+
+from .executor import run_blocking
+from .tracing import span
+
+
+class Job:
+    """
+    A tip or withdrawal waiting to be, or being, executed by a worker.
+    """
+    id: ObjectId
+    kind: str
+    source: str # jobs with the same source run one at a time, in order
+    payload: Dict
+    status: str # pending, running, done or failed
+    started: bool # the handler began executing; it may have reached the chain
+    attempts: int
+    created: datetime
+
+    def __init__(self, doc: Dict) -> None:
+        self.id = doc["_id"]
+        self.kind = doc["kind"]
+        self.source = doc["source"]
+        self.payload = doc["payload"]
+        self.status = doc["status"]
+        self.started = doc.get("started", False)
+        self.attempts = doc.get("attempts", 0)
+        self.created = doc["created"]
+
+    def __str__(self) -> str:
+        return f"{self.kind} job {self.id} ({self.source})"
+
+
+class JobQueue:
+    """
+    Durable job queue (outbox) backed by the jobs collection.
+
+    Workers claim jobs with a lease. A job whose lease runs out (e.g. the bot restarted)
+    is claimed again, unless its handler had already started: it may have reached the
+    chain, so it is failed instead of risking a double spend.
+    """
+    lease_time: float # seconds
+
+    def __init__(self, db, lease_time: float = 120.0, worker_id: Optional[str] = None) -> None:
+        self.jobs = db.jobs
+        self.locks = db.job_locks
+        self.lease_time = lease_time
+        self.worker_id = worker_id or f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self.on_enqueue: Optional[Callable[[], None]] = None
+        self.jobs.create_index([("status", pymongo.ASCENDING), ("created", pymongo.ASCENDING)])
+
+    def enqueue(self, kind: str, source: str, payload: Dict) -> ObjectId:
+        doc: Dict = {
+            "kind": kind,
+            "source": source,
+            "payload": payload,
+            "status": "pending",
+            "started": False,
+            "attempts": 0,
+            "created": datetime.utcnow(),
+            "lease_until": None,
+            "worker": None,
+        }
+        result = self.jobs.insert_one(doc)
+        if self.on_enqueue is not None:
+            self.on_enqueue()
+        return result.inserted_id
+
+    def pending_count(self) -> int:
+        return self.jobs.count_documents({"status": {"$in": ["pending", "running"]}})
+
+    def claim(self, batch_size: int = 50) -> Optional[Job]:
+        """
+        Claims the oldest claimable job whose source is not busy with another job.
+        """
+        now: datetime = datetime.utcnow()
+        docs: List[Dict] = list(self.jobs.find({
+            "$or": [
+                {"status": "pending"},
+                {"status": "running", "lease_until": {"$lt": now}},
+            ]
+        }).sort("created", pymongo.ASCENDING).limit(batch_size))
+
+        busy: Set[str] = set()
+        for doc in docs:
+            source: str = doc["source"]
+            if source in busy:
+                # only the oldest job of a source may run
+                continue
+            busy.add(source)
+            if not self._lock_source(source, doc["_id"], now):
+                continue
+
+            claimed: Optional[Dict] = self.jobs.find_one_and_update({
+                "_id": doc["_id"],
+                "status": doc["status"],
+                "lease_until": doc["lease_until"],
+            }, {
+                "$set": {
+                    "status": "running",
+                    "lease_until": self._lease_until(),
+                    "worker": self.worker_id,
+                },
+                "$inc": {
+                    "attempts": 1,
+                },
+            }, return_document=pymongo.ReturnDocument.AFTER)
+            if claimed is not None:
+                return Job(claimed)
+            self._unlock_source(source, doc["_id"])
+        return None
+
+    def start(self, job: Job) -> None:
+        """
+        Marks that the handler is about to execute, see the class docstring.
+        """
+        self.jobs.update_one({"_id": job.id}, {"$set": {"started": True}})
+        job.started = True
+
+    def renew(self, job: Job) -> None:
+        lease_until: datetime = self._lease_until()
+        self.jobs.update_one({"_id": job.id, "worker": self.worker_id}, {"$set": {"lease_until": lease_until}})
+        self.locks.update_one({"_id": job.source, "job": job.id}, {"$set": {"lease_until": lease_until}})
+
+    def complete(self, job: Job, result: Optional[Dict] = None) -> None:
+        self._finish(job, "done", {"result": result})
+
+    def fail(self, job: Job, error: str) -> None:
+        self._finish(job, "failed", {"error": error})
+
+    def _finish(self, job: Job, status: str, fields: Dict) -> None:
+        self.jobs.update_one({"_id": job.id}, {"$set": {
+            "status": status,
+            "finished": datetime.utcnow(),
+            "lease_until": None,
+            **fields,
+        }})
+        job.status = status
+        self._unlock_source(job.source, job.id)
+
+    def _lease_until(self) -> datetime:
+        return datetime.utcnow() + timedelta(seconds=self.lease_time)
+
+    def _lock_source(self, source: str, job_id: ObjectId, now: datetime) -> bool:
+        lease_until: datetime = self._lease_until()
+        doc: Optional[Dict] = self.locks.find_one_and_update({
+            "_id": source,
+            "$or": [
+                {"lease_until": {"$lt": now}},
+                {"job": job_id},
+            ],
+        }, {
+            "$set": {"job": job_id, "lease_until": lease_until},
+        })
+        if doc is not None:
+            return True
+        try:
+            self.locks.insert_one({"_id": source, "job": job_id, "lease_until": lease_until})
+            return True
+        except pymongo.errors.DuplicateKeyError:
+            # another job of this source holds the lock
+            return False
+
+    def _unlock_source(self, source: str, job_id: ObjectId) -> None:
+        self.locks.delete_one({"_id": source, "job": job_id})
+
+
+class JobWorkerPool:
+    """
+    Pool of async workers executing jobs from a JobQueue.
+
+    Jobs of different sources run in parallel, up to num_workers at a time.
+    """
+    def __init__(self, queue: JobQueue, handlers: Dict[str, Callable[[Job], Awaitable[None]]], num_workers: int = 4, poll_interval: float = 2.0,
+            on_failure: Optional[Callable[[Job, str], Awaitable[None]]] = None) -> None:
+        self.queue = queue
+        self.handlers = handlers
+        self.on_failure = on_failure
+        self.num_workers = num_workers
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tasks: List[asyncio.Task] = []
+        queue.on_enqueue = self._wake
+
+    def _wake(self) -> None:
+        # enqueue may run on the blocking pool, see executor.run_blocking
+        if self._loop is None:
+            self._wakeup.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._loop = loop
+        for i in range(self.num_workers):
+            self._tasks.append(loop.create_task(self._work(i)))
+
+    def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def _work(self, i: int) -> None:
+        while True:
+            try:
+                job: Optional[Job] = await run_blocking(self.queue.claim)
+            except Exception as e:
+                print(e, "jobs.claim")
+                job = None
+
+            if job is None:
+                # sleep until a job is enqueued in this process, or poll again
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run(job)
+
+    async def _run(self, job: Job) -> None:
+        if job.started:
+            # interrupted mid-execution, the extrinsic may have been sent already
+            print(f"{job} was interrupted after it started, not retrying")
+            await self._fail(job, "interrupted after the job started")
+            return
+
+        handler: Optional[Callable[[Job], Awaitable[None]]] = self.handlers.get(job.kind)
+        if handler is None:
+            await self._fail(job, f"no handler for {job.kind}")
+            return
+
+        heartbeat: asyncio.Task = asyncio.ensure_future(self._heartbeat(job))
+        try:
+            with span(f"job.{job.kind}", root=True, job=str(job.id)):
+                await run_blocking(self.queue.start, job)
+                await handler(job)
+                await run_blocking(self.queue.complete, job)
+        except Exception as e:
+            print(e, f"jobs {job}")
+            await self._fail(job, str(e))
+        finally:
+            heartbeat.cancel()
+
+    async def _fail(self, job: Job, error: str) -> None:
+        await run_blocking(self.queue.fail, job, error)
+        if self.on_failure is not None:
+            try:
+                await self.on_failure(job, error)
+            except Exception as e:
+                print(e, "jobs.on_failure")
+
+    async def _heartbeat(self, job: Job) -> None:
+        while True:
+            await asyncio.sleep(self.queue.lease_time / 3)
+            try:
+                await run_blocking(self.queue.renew, job)
+            except Exception as e:
+                print(e, "jobs.renew")
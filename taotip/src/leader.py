@@ -0,0 +1,123 @@
+import asyncio
+import socket
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Callable, Coroutine, Dict, Optional
+
+import pymongo.errors
+
+from .executor import run_blocking
+from .metrics import IS_LEADER
+
+
+class LeaderElection:
+    """
+    Elects the one instance that runs the singleton background tasks, with a lease
+    document in the leases collection. Every instance serves commands.
+
+    The leader renews its lease every lease_time / 3. The other instances try to take it
+    as soon as it runs out, so the tasks move to another instance within a lease period
+    of the leader dying. A leader that fails to renew stops its tasks a `margin` before its
+    lease runs out, so two instances don't run them at once, as long as their clocks are
+    closer than that. Leases of instances gone for good are removed by a TTL index.
+    """
+    lease_time: float # seconds
+
+    def __init__(self, db, name: str = "background", lease_time: float = 30.0, instance_id: Optional[str] = None, margin: float = 3.0) -> None:
+        self.leases = db.leases
+        self.name = name
+        self.lease_time = lease_time
+        self.margin = margin
+        self.instance_id = instance_id or f"{socket.gethostname()}-{uuid.uuid4().hex[:8]}"
+        self._deadline = 0.0 # monotonic time our lease runs out, less the margin
+        self._factories: Dict[str, Callable[[], Coroutine]] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    @property
+    def is_leader(self) -> bool:
+        return time.monotonic() < self._deadline
+
+    def add(self, name: str, factory: Callable[[], Coroutine]) -> None:
+        """
+        Runs factory() while this instance is the leader, cancelled when it no longer is.
+        """
+        self._factories[name] = factory
+
+    def try_acquire(self) -> bool:
+        """
+        Takes or renews the lease. Returns whether this instance holds it.
+        """
+        # counted from before the write, in case it is slow
+        started: float = time.monotonic()
+        now: datetime = datetime.utcnow()
+        lease: Dict = {"holder": self.instance_id, "expires": now + timedelta(seconds=self.lease_time), "renewed": now}
+        doc: Optional[Dict] = self.leases.find_one_and_update({
+            "_id": self.name,
+            "$or": [
+                {"holder": self.instance_id},
+                {"expires": {"$lt": now}},
+            ],
+        }, {
+            "$set": lease,
+        })
+        if doc is None:
+            try:
+                self.leases.insert_one({"_id": self.name, **lease})
+            except pymongo.errors.DuplicateKeyError:
+                # another instance holds the lease
+                self._deadline = 0.0
+                return False
+        self._deadline = started + self.lease_time - self.margin
+        return True
+
+    def release(self) -> None:
+        self._stop()
+        self._deadline = 0.0
+        self.leases.delete_one({"_id": self.name, "holder": self.instance_id})
+
+    def _seconds_to_expiry(self) -> float:
+        doc: Optional[Dict] = self.leases.find_one({"_id": self.name})
+        if doc is None:
+            return 0.0
+        return (doc["expires"] - datetime.utcnow()).total_seconds()
+
+    def _start(self) -> None:
+        for name, factory in self._factories.items():
+            task: Optional[asyncio.Task] = self._tasks.get(name)
+            if task is None or task.done():
+                # started, or restarted if it ended
+                self._tasks[name] = asyncio.ensure_future(factory())
+
+    def _stop(self) -> None:
+        for task in self._tasks.values():
+            task.cancel()
+        self._tasks = {}
+
+    async def run(self) -> None:
+        renew_interval: float = self.lease_time / 3
+        # Mongo calls run on the blocking pool, so a slow Mongo doesn't hold up commands
+        try:
+            await run_blocking(self.leases.create_index, "expires", expireAfterSeconds=0)
+        except Exception as e:
+            print(e, "leader.run")
+        while True:
+            try:
+                leader: bool = await run_blocking(self.try_acquire)
+                wait: float = renew_interval if leader else min(max(await run_blocking(self._seconds_to_expiry), 0.1), renew_interval)
+            except Exception as e:
+                print(e, "leader.run")
+                leader = self.is_leader
+                wait = renew_interval
+
+            if leader:
+                if len(self._tasks) == 0:
+                    print(f"{self.instance_id} is the leader, running {', '.join(self._factories)}")
+                self._start()
+                # wake up in time to stop the tasks if the lease can't be renewed
+                wait = min(wait, max(self._deadline - time.monotonic(), 0.0))
+            elif len(self._tasks) > 0:
+                print(f"{self.instance_id} is no longer the leader")
+                self._stop()
+            IS_LEADER.set(1 if leader else 0)
+            await asyncio.sleep(wait)
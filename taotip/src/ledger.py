@@ -0,0 +1,90 @@
+import itertools
+from typing import Dict, Optional
+
+from .balance import Balance
+
+
+class Reservation:
+    """
+    Funds held for an in-flight tip or withdrawal until its extrinsic resolves.
+    """
+    id: int
+    user: str
+    amount: Balance
+    fee: Balance
+    state: str # reserved, committed or released
+
+    def __init__(self, id: int, user: str, amount: Balance, fee: Balance) -> None:
+        self.id = id
+        self.user = user
+        self.amount = amount
+        self.fee = fee
+        self.state = "reserved"
+
+    @property
+    def total(self) -> Balance:
+        return self.amount + self.fee
+
+    def __str__(self) -> str:
+        return f"{self.user} reserved {self.total.tao} tao ({self.state})"
+
+
+class ReservationLedger:
+    """
+    Local, per-user ledger of funds reserved by in-flight extrinsics.
+
+    None of the methods await, so each call is atomic on the event loop.
+    """
+    _reservations: Dict[str, Dict[int, Reservation]]
+
+    def __init__(self) -> None:
+        self._reservations = {}
+        self._ids = itertools.count()
+
+    def reserved(self, user: str, exclude: Optional[Reservation] = None) -> Balance:
+        """
+        Returns the total reserved for the user, optionally excluding one reservation.
+        """
+        total: Balance = Balance.from_rao(0)
+        for reservation in self._reservations.get(str(user), {}).values():
+            if reservation is not exclude:
+                total += reservation.total
+        return total
+
+    def available(self, user: str, balance: Balance) -> Balance:
+        return balance - self.reserved(user)
+
+    def reserve(self, user: str, amount: Balance, fee: Balance, balance: Balance) -> Optional[Reservation]:
+        """
+        Reserves amount + fee for the user if the balance not yet reserved covers it.
+
+        Returns:
+            The reservation, or None if the user does not have enough unreserved balance.
+        """
+        user = str(user)
+        if self.available(user, balance) < amount + fee:
+            return None
+        reservation: Reservation = Reservation(next(self._ids), user, amount, fee)
+        self._reservations.setdefault(user, {})[reservation.id] = reservation
+        return reservation
+
+    def commit(self, reservation: Reservation) -> None:
+        """
+        The extrinsic was included; the funds have left the balance on chain.
+        """
+        self._remove(reservation, "committed")
+
+    def release(self, reservation: Reservation) -> None:
+        """
+        The extrinsic failed or was never sent; the funds are available again.
+        """
+        self._remove(reservation, "released")
+
+    def _remove(self, reservation: Reservation, state: str) -> None:
+        if reservation.state != "reserved":
+            return
+        reservation.state = state
+        user_reservations: Dict[int, Reservation] = self._reservations.get(reservation.user, {})
+        user_reservations.pop(reservation.id, None)
+        if not user_reservations:
+            self._reservations.pop(reservation.user, None)
@@ -0,0 +1,180 @@
+import asyncio
+import gc
+import os
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from .metrics import LIVE_OBJECTS, MEMORY_GROWTH_BYTES, PROCESS_RSS_BYTES, TRACED_MEMORY_BYTES
+
+# types counted in the metrics whether or not they are among the most common
+WATCHED_TYPES: Tuple[str, ...] = ("Tip", "Transaction", "Rain", "Job", "tqdm", "Cursor", "CommandContext")
+
+_FILTERS = [
+    tracemalloc.Filter(False, tracemalloc.__file__),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+    tracemalloc.Filter(False, "<unknown>"),
+]
+
+
+def rss_bytes() -> Optional[int]:
+    """
+    Resident set size of this process, on Linux.
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def count_objects() -> Counter:
+    """
+    Live objects tracked by the garbage collector, by type name.
+    """
+    return Counter(type(obj).__name__ for obj in gc.get_objects())
+
+
+def _mb(size: float) -> str:
+    return f"{size / (1024 * 1024):+.2f} MB"
+
+
+class MemorySnapshot:
+    __slots__ = ("time", "rss", "traces", "objects")
+
+    def __init__(self, rss: Optional[int], traces: Optional[tracemalloc.Snapshot], objects: Counter) -> None:
+        self.time: float = time.monotonic()
+        self.rss = rss
+        self.traces = traces # None while tracemalloc is off
+        self.objects = objects
+
+
+class MemoryMonitor:
+    """
+    Finds what the process' memory grows with.
+
+    Every `interval` seconds, takes a tracemalloc snapshot and counts live objects by type,
+    and diffs them with the first snapshot (the baseline) and the previous one. Only
+    the baseline and the last two snapshots are kept.
+    """
+    def __init__(self, interval: float = 900.0, frames: int = 1, top: int = 10) -> None:
+        self.interval = interval
+        self.frames = frames
+        self.top = top
+        self.baseline: Optional[MemorySnapshot] = None
+        self.previous: Optional[MemorySnapshot] = None
+        self.last: Optional[MemorySnapshot] = None
+        self.snapshots = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def configure(self, interval: float, frames: int, top: int) -> None:
+        self.interval = interval
+        self.frames = frames
+        self.top = top
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+        self._task = loop.create_task(self._run())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        tracemalloc.stop()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.snapshot()
+            except Exception as e:
+                print(e, "memory.snapshot")
+            await asyncio.sleep(self.interval)
+
+    def take(self) -> MemorySnapshot:
+        traces: Optional[tracemalloc.Snapshot] = tracemalloc.take_snapshot().filter_traces(_FILTERS) if tracemalloc.is_tracing() else None
+        return MemorySnapshot(rss_bytes(), traces, count_objects())
+
+    async def snapshot(self) -> MemorySnapshot:
+        """
+        Takes a snapshot, in a thread since walking the heap takes a while.
+        """
+        snapshot: MemorySnapshot = await asyncio.get_running_loop().run_in_executor(None, self.take)
+        if self.baseline is None:
+            self.baseline = snapshot
+        self.previous, self.last = self.last, snapshot
+        self.snapshots += 1
+        return snapshot
+
+    def _since(self, since: str) -> Optional[MemorySnapshot]:
+        return self.baseline if since == "baseline" else self.previous
+
+    def growing_sites(self, since: str = "baseline", top: Optional[int] = None) -> List[tracemalloc.StatisticDiff]:
+        """
+        Allocation sites whose memory grew the most between the baseline (or previous) snapshot and the last.
+        """
+        before: Optional[MemorySnapshot] = self._since(since)
+        if before is None or before is self.last or before.traces is None or self.last.traces is None:
+            return []
+        diffs: List[tracemalloc.StatisticDiff] = self.last.traces.compare_to(before.traces, "lineno")
+        return [diff for diff in diffs if diff.size_diff > 0][:top or self.top]
+
+    def growing_types(self, since: str = "baseline", top: Optional[int] = None) -> List[Tuple[str, int, int]]:
+        """
+        (type, count, change) of the types whose live objects grew the most.
+        """
+        before: Optional[MemorySnapshot] = self._since(since)
+        if before is None or before is self.last:
+            return []
+        changes: List[Tuple[str, int, int]] = [
+            (name, count, count - before.objects.get(name, 0)) for name, count in self.last.objects.items()
+        ]
+        return sorted((change for change in changes if change[2] > 0), key=lambda change: -change[2])[:top or self.top]
+
+    @staticmethod
+    def site(diff: tracemalloc.StatisticDiff) -> str:
+        frame: tracemalloc.Frame = diff.traceback[0]
+        return f"{frame.filename}:{frame.lineno}"
+
+    def report(self) -> str:
+        if self.last is None:
+            return "No snapshot taken yet"
+        rss: Optional[int] = rss_bytes()
+        lines: List[str] = [f"RSS {rss / (1024 * 1024):.1f} MB" if rss is not None else "RSS unknown"]
+        if tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            lines[0] += f", traced {current / (1024 * 1024):.1f} MB (peak {peak / (1024 * 1024):.1f} MB)"
+        lines[0] += f", {self.snapshots} snapshots over {(self.last.time - self.baseline.time) / 3600:.1f}h"
+
+        for since, title in (("baseline", "since the first snapshot"), ("previous", "since the previous snapshot")):
+            sites: List[tracemalloc.StatisticDiff] = self.growing_sites(since)
+            if sites:
+                lines.append(f"Top growing allocation sites {title}:")
+                lines.extend(f"  {_mb(diff.size_diff)} ({diff.count_diff:+d} blocks) {self.site(diff)}" for diff in sites)
+
+        types: List[Tuple[str, int, int]] = self.growing_types()
+        if types:
+            lines.append("Top growing types since the first snapshot:")
+            lines.extend(f"  {name} {count} ({change:+d})" for name, count, change in types)
+        lines.append("Watched types: " + ", ".join(f"{name} {self.last.objects.get(name, 0)}" for name in WATCHED_TYPES))
+        return "\n".join(lines)
+
+    def site_samples(self) -> Dict[Tuple[str, ...], float]:
+        return {(self.site(diff),): diff.size_diff for diff in self.growing_sites()}
+
+    def type_samples(self) -> Dict[Tuple[str, ...], float]:
+        if self.last is None:
+            return {}
+        names = set(WATCHED_TYPES) | {name for name, _ in self.last.objects.most_common(self.top)}
+        return {(name,): self.last.objects.get(name, 0) for name in names}
+
+
+memory_monitor: MemoryMonitor = MemoryMonitor()
+
+PROCESS_RSS_BYTES.set_function(rss_bytes)
+TRACED_MEMORY_BYTES.set_function(lambda: tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None)
+# sites and types are only known once snapshots are taken
+MEMORY_GROWTH_BYTES.set_collector(memory_monitor.site_samples)
+LIVE_OBJECTS.set_collector(memory_monitor.type_samples)
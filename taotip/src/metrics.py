@@ -0,0 +1,397 @@
+import asyncio
+import bisect
+import functools
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from pymongo import monitoring
+
+from .tracing import tracer
+
+# seconds; from a memoized lookup to a transfer waiting for inclusion
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs: List[str] = [
+        '{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+class Metric:
+    """
+    A named family of series, one per combination of label values.
+    """
+    type: str = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames: Labels = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} {self.type}"
+        yield from self._render_samples()
+
+    def _render_samples(self) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0.0)
+
+    def _render_samples(self) -> Iterator[str]:
+        with self._lock:
+            values: List[Tuple[Labels, float]] = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down. Series can be set directly, or read from functions
+    when scraped, for values that are cheaper to compute on demand (e.g. pending jobs).
+    """
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Labels, float] = {}
+        self._functions: Dict[Labels, Callable[[], Optional[float]]] = {}
+        self._collectors: List[Callable[[], Dict[Labels, float]]] = []
+
+    def set(self, value: float, *labels: str) -> None:
+        with self._lock:
+            self._values[labels] = value
+
+    def set_function(self, function: Callable[[], Optional[float]], *labels: str) -> None:
+        with self._lock:
+            self._functions[labels] = function
+
+    def set_collector(self, collector: Callable[[], Dict[Labels, float]]) -> None:
+        """
+        For series not known in advance, collector returns label values -> value when scraped.
+        """
+        with self._lock:
+            self._collectors.append(collector)
+
+    def get(self, *labels: str) -> Optional[float]:
+        function: Optional[Callable[[], Optional[float]]] = self._functions.get(labels)
+        if function is not None:
+            return function()
+        return self._values.get(labels)
+
+    def _render_samples(self) -> Iterator[str]:
+        with self._lock:
+            values: Dict[Labels, float] = dict(self._values)
+            functions: List[Tuple[Labels, Callable[[], Optional[float]]]] = list(self._functions.items())
+            collectors: List[Callable[[], Dict[Labels, float]]] = list(self._collectors)
+        for collector in collectors:
+            try:
+                values.update(collector())
+            except Exception as e:
+                print(e, f"metrics.{self.name}")
+        for labels, function in functions:
+            try:
+                value: Optional[float] = function()
+            except Exception as e:
+                print(e, f"metrics.{self.name}")
+                continue
+            if value is not None:
+                values[labels] = value
+        for labels, value in values.items():
+            yield f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets: Tuple[float, ...] = tuple(sorted(buckets))
+        # labels -> [count per bucket (the last one is +Inf), sum]
+        self._series: Dict[Labels, List] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        i: int = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series: Optional[List] = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    def count(self, *labels: str) -> int:
+        series: Optional[List] = self._series.get(labels)
+        return sum(series[0]) if series is not None else 0
+
+    def sum(self, *labels: str) -> float:
+        series: Optional[List] = self._series.get(labels)
+        return series[1] if series is not None else 0.0
+
+    def _render_samples(self) -> Iterator[str]:
+        with self._lock:
+            series: List[Tuple[Labels, List[int], float]] = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in series:
+            cumulative: int = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le: str = 'le="{}"'.format(_format_value(bound))
+                yield f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}"
+            yield f"{self.name}_count{_format_labels(self.labelnames, labels)} {cumulative}"
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, help, labelnames))
+
+    def gauge(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labelnames, buckets))
+
+    def render(self) -> str:
+        """
+        The Prometheus text exposition format of every metric.
+        """
+        with self._lock:
+            metrics: List[Metric] = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+def timed(histogram: Histogram, name: Optional[str] = None, root: bool = False) -> Callable:
+    """
+    Observes how long the decorated function, sync or async, takes, labelled with
+    name or the function name. Errors are timed too.
+
+    The call is also a tracing span, e.g. "db.transfer" for DB_SECONDS; with root
+    it starts a trace (for commands).
+    """
+    def decorator(func: Callable) -> Callable:
+        label: str = name or func.__name__
+        span_name: str = "{}.{}".format(histogram.name.replace("taotip_", "").replace("_seconds", ""), label)
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start: float = time.perf_counter()
+                try:
+                    with tracer.span(span_name, root):
+                        return await func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start, label)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start: float = time.perf_counter()
+            try:
+                with tracer.span(span_name, root):
+                    return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, label)
+        return wrapper
+    return decorator
+
+
+class PoolListener(monitoring.ConnectionPoolListener):
+    """
+    Counts the open and checked out connections of each Mongo server pool.
+    Pass it to MongoClient(event_listeners=[...]).
+    """
+    def __init__(self) -> None:
+        self.open: Dict[str, int] = {}
+        self.checked_out: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _add(self, counts: Dict[str, int], address: Tuple[str, int], amount: int) -> None:
+        key: str = "{}:{}".format(*address)
+        with self._lock:
+            counts[key] = max(counts.get(key, 0) + amount, 0)
+
+    def pool_created(self, event) -> None:
+        pass
+
+    def pool_ready(self, event) -> None:
+        pass
+
+    def pool_cleared(self, event) -> None:
+        pass
+
+    def pool_closed(self, event) -> None:
+        with self._lock:
+            key: str = "{}:{}".format(*event.address)
+            self.open.pop(key, None)
+            self.checked_out.pop(key, None)
+
+    def connection_created(self, event) -> None:
+        self._add(self.open, event.address, 1)
+
+    def connection_ready(self, event) -> None:
+        pass
+
+    def connection_closed(self, event) -> None:
+        self._add(self.open, event.address, -1)
+
+    def connection_check_out_started(self, event) -> None:
+        pass
+
+    def connection_check_out_failed(self, event) -> None:
+        pass
+
+    def connection_checked_out(self, event) -> None:
+        self._add(self.checked_out, event.address, 1)
+
+    def connection_checked_in(self, event) -> None:
+        self._add(self.checked_out, event.address, -1)
+
+    def samples(self) -> Dict[Labels, float]:
+        with self._lock:
+            samples: Dict[Labels, float] = {(key, "open"): count for key, count in self.open.items()}
+            samples.update({(key, "checked_out"): count for key, count in self.checked_out.items()})
+        return samples
+
+
+class MetricsServer:
+    """
+    Serves the registry at /metrics from a daemon thread, off the event loop.
+    """
+    def __init__(self, registry: Registry, host: str = "127.0.0.1", port: int = 9100) -> None:
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server: Optional[ThreadingHTTPServer] = None
+
+    def start(self) -> None:
+        registry: Registry = self.registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body: bytes = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                # scrapes would flood the bot's output
+                pass
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        # the port actually bound, if 0 was asked for
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name="metrics", daemon=True).start()
+        print(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+    def stop(self) -> None:
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+
+registry: Registry = Registry()
+
+COMMAND_SECONDS: Histogram = registry.histogram(
+    "taotip_command_seconds", "Time to answer a slash command, modal or user command", ["command"]
+)
+RPC_SECONDS: Histogram = registry.histogram(
+    "taotip_rpc_seconds", "Time spent in subtensor API calls", ["method"]
+)
+DB_SECONDS: Histogram = registry.histogram(
+    "taotip_db_seconds", "Time spent in Database operations", ["operation"]
+)
+PENDING_JOBS: Gauge = registry.gauge(
+    "taotip_pending_jobs", "Queued or running tips and withdrawals"
+)
+CACHE_HIT_RATIO: Gauge = registry.gauge(
+    "taotip_cache_hit_ratio", "Share of Discord entity cache lookups answered from the cache", ["cache"]
+)
+MONGO_POOL_CONNECTIONS: Gauge = registry.gauge(
+    "taotip_mongo_pool_connections", "Open connections in the Mongo pool, and how many are checked out", ["address", "state"]
+)
+LAST_BLOCK: Gauge = registry.gauge(
+    "taotip_last_processed_block", "Last block the deposit scan read balances at"
+)
+LOOP_LAG_SECONDS: Histogram = registry.histogram(
+    "taotip_loop_lag_seconds", "How late the event loop runs a task that is due"
+)
+LOOP_STALLS: Counter = registry.counter(
+    "taotip_loop_stalls_total", "Times a call blocked the event loop past the watchdog threshold", ["site"]
+)
+LOOP_BLOCKED_SECONDS: Counter = registry.counter(
+    "taotip_loop_blocked_seconds_total", "Time the event loop was blocked, by call site", ["site"]
+)
+PROCESS_RSS_BYTES: Gauge = registry.gauge(
+    "taotip_process_rss_bytes", "Resident memory of the bot process"
+)
+TRACED_MEMORY_BYTES: Gauge = registry.gauge(
+    "taotip_traced_memory_bytes", "Memory allocated by Python and traced by tracemalloc, with memory diagnostics on"
+)
+MEMORY_GROWTH_BYTES: Gauge = registry.gauge(
+    "taotip_memory_growth_bytes", "Growth of the top growing allocation sites since the first memory snapshot", ["site"]
+)
+LIVE_OBJECTS: Gauge = registry.gauge(
+    "taotip_live_objects", "Live objects of the most common and watched types, at the last memory snapshot", ["type"]
+)
+POLLED_ADDRESSES: Gauge = registry.gauge(
+    "taotip_polled_addresses", "Addresses whose balance the deposit poller reads"
+)
+POLL_RATE: Gauge = registry.gauge(
+    "taotip_poll_rate", "Balance reads per second the deposit poller is scheduled to make"
+)
+IS_LEADER: Gauge = registry.gauge(
+    "taotip_leader", "1 if this instance runs the background tasks, see LeaderElection"
+)
+
+mongo_pool: PoolListener = PoolListener()
+# pool addresses are only known once connected
+MONGO_POOL_CONNECTIONS.set_collector(mongo_pool.samples)
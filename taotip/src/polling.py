@@ -0,0 +1,206 @@
+import asyncio
+import heapq
+import random
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from . import api
+from .db import Database, Transaction
+from .events import ADDRESS_ACTIVE
+from .metrics import POLLED_ADDRESSES, POLL_RATE
+
+
+class PollState:
+    __slots__ = ("user", "interval", "due", "active_until")
+
+    def __init__(self, user: str, interval: float, due: float, active_until: float) -> None:
+        self.user = user
+        self.interval = interval
+        self.due = due
+        self.active_until = active_until
+
+
+class PollSchedule:
+    """
+    When to next read the balance of each address.
+
+    Active addresses (a /deposit, a tip, a transfer or a deposit in the last `active_time`
+    seconds) are read every `min_interval`. Afterwards, every read that finds the balance
+    unchanged multiplies the interval by `backoff`, up to `max_interval`.
+    """
+    def __init__(self, min_interval: float = 12.0, max_interval: float = 3600.0, active_time: float = 600.0, backoff: float = 2.0) -> None:
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.active_time = active_time
+        self.backoff = backoff
+        self.addresses: Dict[str, PollState] = {}
+        self.rate = 0.0 # reads per second, the sum of 1 / interval
+        self._heap: List[Tuple[float, str]] = [] # (due, address), stale entries are skipped
+
+    def __len__(self) -> int:
+        return len(self.addresses)
+
+    def _schedule(self, address: str, state: PollState, interval: float, due: float) -> None:
+        self.rate += 1.0 / interval - 1.0 / state.interval
+        state.interval = interval
+        if due != state.due:
+            # otherwise its entry is still in the heap, or being read
+            state.due = due
+            heapq.heappush(self._heap, (due, address))
+
+    def add(self, address: str, user: str) -> None:
+        """
+        An address seen for the first time. It's read once within max_interval, spread out
+        so that restarting with many addresses doesn't read them all at once.
+        """
+        if address in self.addresses:
+            self.addresses[address].user = user
+            return
+        now: float = time.monotonic()
+        state: PollState = PollState(user, self.max_interval, now + random.random() * self.max_interval, 0.0)
+        self.addresses[address] = state
+        self.rate += 1.0 / self.max_interval
+        heapq.heappush(self._heap, (state.due, address))
+
+    def activate(self, address: str, user: Optional[str] = None) -> None:
+        """
+        Reads the address now, then every min_interval for the next active_time seconds.
+        """
+        now: float = time.monotonic()
+        if address not in self.addresses:
+            if user is None:
+                # unassigned addresses can't receive deposits from a user
+                return
+            self.add(address, user)
+        state: PollState = self.addresses[address]
+        state.active_until = now + self.active_time
+        self._schedule(address, state, self.min_interval, min(state.due, now))
+
+    def pop_due(self, limit: Optional[int] = None, now: Optional[float] = None) -> List[Tuple[str, str]]:
+        """
+        (address, user) of the addresses due to be read, the most overdue first.
+        """
+        now = now if now is not None else time.monotonic()
+        due: List[Tuple[str, str]] = []
+        while self._heap and self._heap[0][0] <= now and (limit is None or len(due) < limit):
+            at, address = heapq.heappop(self._heap)
+            state: Optional[PollState] = self.addresses.get(address)
+            if state is None or state.due != at:
+                continue
+            due.append((address, state.user))
+        return due
+
+    def polled(self, address: str, changed: bool) -> None:
+        state: Optional[PollState] = self.addresses.get(address)
+        if state is None:
+            return
+        now: float = time.monotonic()
+        if changed:
+            state.active_until = now + self.active_time
+        if now < state.active_until:
+            interval: float = self.min_interval
+        else:
+            interval = min(max(state.interval, self.min_interval) * self.backoff, self.max_interval)
+        self._schedule(address, state, interval, now + interval)
+
+    def next_due(self) -> Optional[float]:
+        while self._heap:
+            at, address = self._heap[0]
+            state: Optional[PollState] = self.addresses.get(address)
+            if state is not None and state.due == at:
+                return at
+            heapq.heappop(self._heap)
+        return None
+
+
+class DepositPoller:
+    """
+    Keeps the balance read model up to date, reading each address as often as its schedule says.
+
+    Addresses are loaded from the database every `reload_interval` seconds (for the ones
+    assigned by other instances), and activated by ADDRESS_ACTIVE events.
+    Once every address of the first load has been read, on_first_pass is awaited.
+    """
+    def __init__(self, _db: Database, _api: 'api.API', schedule: PollSchedule, reload_interval: float = 300.0, max_batch: int = 500,
+            on_first_pass: Optional[Callable[[], Awaitable[None]]] = None) -> None:
+        self._db = _db
+        self._api = _api
+        self.schedule = schedule
+        self.reload_interval = reload_interval
+        self.max_batch = max_batch
+        self.on_first_pass = on_first_pass
+        self._next_reload = 0.0
+        self._unread: Optional[Set[str]] = None # of the first load, until they have all been read
+
+    async def load(self) -> None:
+        addresses: List[str] = []
+        for doc in await self._db.get_all_addresses():
+            if doc.get("user") is not None:
+                self.schedule.add(doc["address"], doc["user"])
+                addresses.append(doc["address"])
+        if self._unread is None and self.on_first_pass is not None:
+            self._unread = set(addresses)
+            await self._read(())
+
+    async def _read(self, addresses: Iterable[str]) -> None:
+        if self._unread is None or self.on_first_pass is None:
+            return
+        self._unread.difference_update(addresses)
+        if len(self._unread) == 0:
+            on_first_pass, self.on_first_pass = self.on_first_pass, None
+            await on_first_pass()
+
+    async def poll(self) -> List[Transaction]:
+        """
+        Reads the balances of the addresses due, up to max_batch of them.
+        """
+        # the rest stay due, for the next poll
+        due: List[Tuple[str, str]] = self.schedule.pop_due(self.max_batch)
+        if len(due) == 0:
+            return []
+
+        try:
+            transactions: List[Transaction] = await self._api.check_for_deposits(
+                self._db, [{"address": address, "user": user} for address, user in due]
+            )
+        except Exception:
+            # read them again later rather than dropping them from the schedule
+            for address, _ in due:
+                self.schedule.polled(address, False)
+            raise
+        changed: Set[str] = {str(t.user) for t in transactions}
+        for address, user in due:
+            self.schedule.polled(address, str(user) in changed)
+        await self._read(address for address, _ in due)
+        return transactions
+
+    async def run(self) -> None:
+        active: asyncio.Queue = self._db.events.subscribe(ADDRESS_ACTIVE)
+        POLLED_ADDRESSES.set_function(lambda: len(self.schedule))
+        POLL_RATE.set_function(lambda: self.schedule.rate)
+        try:
+            await self._run(active)
+        finally:
+            # cancelled, e.g. when another instance becomes the leader
+            self._db.events.unsubscribe(ADDRESS_ACTIVE, active)
+            POLLED_ADDRESSES.set_function(lambda: 0)
+            POLL_RATE.set_function(lambda: 0)
+
+    async def _run(self, active: asyncio.Queue) -> None:
+        while True:
+            try:
+                if time.monotonic() >= self._next_reload:
+                    self._next_reload = time.monotonic() + self.reload_interval
+                    await self.load()
+                while not active.empty():
+                    self.schedule.activate(*active.get_nowait())
+                await self.poll()
+            except Exception as e:
+                print(e, "polling.run")
+
+            next_due: Optional[float] = self.schedule.next_due()
+            timeout: float = min(next_due - time.monotonic() if next_due is not None else self.reload_interval, self._next_reload - time.monotonic())
+            try:
+                self.schedule.activate(*await asyncio.wait_for(active.get(), max(timeout, 0.0)))
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,243 @@
+import asyncio
+import cProfile
+import functools
+import io
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, Optional
+
+MODES = ("sample", "deterministic")
+
+
+class Sampler:
+    """
+    Samples the stack of one thread every `interval` seconds while resumed,
+    counting for each function the samples it was running in and on the stack in.
+    """
+    def __init__(self, thread_id: int, interval: float) -> None:
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = 0
+        self.own: Dict[str, int] = {} # function -> samples it was the innermost frame in
+        self.total: Dict[str, int] = {} # function -> samples it was on the stack in
+        self._resumed = threading.Event()
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        threading.Thread(target=self._sample, name="profiler", daemon=True).start()
+
+    def resume(self) -> None:
+        self._resumed.set()
+
+    def pause(self) -> None:
+        self._resumed.clear()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self._resumed.set()
+
+    @staticmethod
+    def describe(frame) -> str:
+        code = frame.f_code
+        return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def _sample(self) -> None:
+        while self._resumed.wait() and not self._stopped.is_set():
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self._record(frame)
+            time.sleep(self.interval)
+
+    def _record(self, frame) -> None:
+        self.samples += 1
+        name: str = self.describe(frame)
+        self.own[name] = self.own.get(name, 0) + 1
+        seen = set()
+        while frame is not None:
+            name = self.describe(frame)
+            if name not in seen:
+                # recursion counts once
+                seen.add(name)
+                self.total[name] = self.total.get(name, 0) + 1
+            frame = frame.f_back
+
+    def report(self, top: int) -> str:
+        if self.samples == 0:
+            return "no samples"
+        lines = [
+            f"{self.samples} samples every {self.interval * 1000:.0f}ms, time waiting on I/O shows as select",
+            f"{'own %':>7} {'total %':>8}  function",
+        ]
+        for name, own in sorted(self.own.items(), key=lambda item: -item[1])[:top]:
+            lines.append(f"{100 * own / self.samples:>7.1f} {100 * self.total[name] / self.samples:>8.1f}  {name}")
+        return "\n".join(lines)
+
+
+class ProfileSession:
+    """
+    Profiles a command for its next `invocations` calls and/or `seconds`, whichever ends first.
+    The profiler runs while at least one of those calls is in flight.
+    """
+    def __init__(self, command: str, mode: str, invocations: Optional[int], seconds: Optional[float], loop_thread: int, interval: float) -> None:
+        self.command = command
+        self.mode = mode
+        self.remaining = invocations
+        self.deadline: Optional[float] = time.monotonic() + seconds if seconds else None
+        self.started: datetime = datetime.now()
+        self.invocations = 0
+        self.in_flight = 0
+        self.seconds = 0.0 # time at least one call was in flight
+        self._resumed_at = 0.0
+        self._profile: Optional[cProfile.Profile] = cProfile.Profile() if mode == "deterministic" else None
+        self._sampler: Optional[Sampler] = Sampler(loop_thread, interval) if mode == "sample" else None
+        if self._sampler is not None:
+            self._sampler.start()
+
+    def wants(self) -> bool:
+        if self.remaining is not None and self.remaining <= 0:
+            return False
+        return self.deadline is None or time.monotonic() < self.deadline
+
+    def done(self) -> bool:
+        return self.in_flight == 0 and not self.wants()
+
+    def enter(self) -> None:
+        self.invocations += 1
+        if self.remaining is not None:
+            self.remaining -= 1
+        self.in_flight += 1
+        if self.in_flight == 1:
+            self._resumed_at = time.perf_counter()
+            if self._profile is not None:
+                self._profile.enable()
+            else:
+                self._sampler.resume()
+
+    def exit(self) -> None:
+        self.in_flight -= 1
+        if self.in_flight == 0:
+            if self._profile is not None:
+                self._profile.disable()
+            else:
+                self._sampler.pause()
+            self.seconds += time.perf_counter() - self._resumed_at
+
+    def close(self, top: int) -> str:
+        """
+        Stops profiling and returns the report, hottest functions first.
+        """
+        if self.in_flight > 0:
+            self.in_flight = 1
+            self.exit()
+        header: str = f"{self.command}: {self.mode} profile of {self.invocations} invocations from {self.started:%Y-%m-%d %H:%M:%S}, {self.seconds:.2f}s in flight\n"
+        if self._sampler is not None:
+            self._sampler.stop()
+            return header + self._sampler.report(top)
+        if self.invocations == 0:
+            return header + "no calls"
+        stream = io.StringIO()
+        pstats.Stats(self._profile, stream=stream).strip_dirs().sort_stats("tottime").print_stats(top)
+        return header + stream.getvalue()
+
+
+class CommandProfiler:
+    """
+    Profiles live commands on demand, one command at a time.
+
+    Commands are wrapped with `profiled(name)`; until a session is armed that costs an
+    attribute check per call. The profile covers the whole event loop while the command
+    is in flight, so other tasks running at the same time show up in it too.
+    """
+    def __init__(self, directory: str = "profiles", top: int = 25, interval: float = 0.005) -> None:
+        self.directory = directory
+        self.top = top
+        self.interval = interval
+        self.session: Optional[ProfileSession] = None
+        self.on_report: Optional[Callable[[ProfileSession, str, Optional[str]], Awaitable[None]]] = None
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    def configure(self, directory: str, top: int, interval: float) -> None:
+        self.directory = directory
+        self.top = top
+        self.interval = interval
+
+    def arm(self, command: str, mode: str = "sample", invocations: Optional[int] = None, seconds: Optional[float] = None) -> ProfileSession:
+        """
+        Profiles the next `invocations` calls of command, or its calls for `seconds`.
+        Called from the event loop, whose thread is the one sampled.
+        """
+        if mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}")
+        if not invocations and not seconds:
+            raise ValueError("give a number of invocations or a time window")
+        if self.session is not None:
+            raise ValueError(f"already profiling {self.session.command}")
+
+        self.session = ProfileSession(command, mode, invocations, seconds, threading.get_ident(), self.interval)
+        if seconds:
+            self._timer = asyncio.get_running_loop().call_later(seconds, self._expire, self.session)
+        return self.session
+
+    def cancel(self) -> Optional[ProfileSession]:
+        """
+        Ends the current session early, still reporting what was profiled.
+        """
+        session: Optional[ProfileSession] = self.session
+        if session is not None:
+            self._finish()
+        return session
+
+    def _expire(self, session: ProfileSession) -> None:
+        # calls still in flight finish the session when they return
+        if session is self.session and session.in_flight == 0:
+            self._finish()
+
+    def _finish(self) -> None:
+        session: ProfileSession = self.session
+        self.session = None
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        report: str = session.close(self.top)
+        path: Optional[str] = None
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, "{}-{:%Y%m%d-%H%M%S}.txt".format(re.sub(r"\W+", "_", session.command), session.started))
+            with open(path, "w") as f:
+                f.write(report)
+        except OSError as e:
+            print(e, "profiling.finish")
+            path = None
+        print(report)
+        if self.on_report is not None:
+            asyncio.ensure_future(self.on_report(session, report, path))
+
+    def profiled(self, name: str) -> Callable:
+        """
+        Lets the decorated async command be profiled under `name`.
+        """
+        def decorator(func: Callable) -> Callable:
+            @functools.wraps(func)
+            async def wrapper(*args, **kwargs):
+                session: Optional[ProfileSession] = self.session
+                if session is None or session.command != name or not session.wants():
+                    return await func(*args, **kwargs)
+                session.enter()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    session.exit()
+                    if session is self.session and session.done():
+                        self._finish()
+            return wrapper
+        return decorator
+
+
+profiler: CommandProfiler = CommandProfiler()
+profiled = profiler.profiled
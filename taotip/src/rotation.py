@@ -0,0 +1,142 @@
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime
+from typing import Deque, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import pymongo
+from bson import ObjectId
+
+from .db import cipher, key_version
+
+# what each worker needs, set by _init_worker
+_worker: Dict = {}
+
+
+def _init_worker(keys: Sequence[bytes]) -> None:
+    _worker["keys"] = keys
+
+
+def rotate_chunk(docs: List[Tuple[ObjectId, bytes]]) -> List[Tuple[ObjectId, bytes, bytes]]:
+    """
+    Re-encrypts (id, mnemonic) with the primary key. Returns (id, old mnemonic, new mnemonic).
+    """
+    rotated: List[Tuple[ObjectId, bytes, bytes]] = []
+    for _id, token in docs:
+        rotated.append((_id, token, cipher(_worker["keys"]).rotate(token)))
+    return rotated
+
+
+class KeyRotation:
+    """
+    Re-encrypts every mnemonic in addresses with the first of `keys`, online.
+
+    Addresses are read in _id order, in batches, re-encrypted in a pool of processes, and
+    written back with bulk_write along with the new key_version. An address is only updated if
+    its mnemonic is still the one read. Progress is checkpointed in the key_rotations
+    collection, and addresses already on the new key are skipped, so a rotation resumes
+    where it stopped.
+
+    Writes are throttled to `max_rate` addresses per second, and slowed down further
+    whenever a bulk write takes longer than `max_write_latency`, to leave Mongo to the bot.
+    """
+    def __init__(self, db, keys: Sequence[bytes], workers: int = 2, batch_size: int = 500,
+            max_rate: float = 2000.0, max_write_latency: float = 0.1, progress_interval: float = 5.0) -> None:
+        if len(keys) < 2:
+            raise ValueError("give the new key first, then the keys mnemonics may be encrypted with")
+        self.addresses = db.addresses
+        self.rotations = db.key_rotations
+        self.keys = list(keys)
+        self.version: str = key_version(self.keys)
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_rate = max_rate
+        self.rate = max_rate
+        self.max_write_latency = max_write_latency
+        self.progress_interval = progress_interval
+        self.rotated = 0
+        self.skipped = 0 # changed by someone else since read
+
+    def remaining(self) -> int:
+        return self.addresses.count_documents({"key_version": {"$ne": self.version}})
+
+    def _batches(self, last_id: Optional[ObjectId]) -> Iterator[List[Tuple[ObjectId, bytes]]]:
+        query: Dict = {"key_version": {"$ne": self.version}}
+        if last_id is not None:
+            query["_id"] = {"$gt": last_id}
+        cursor = self.addresses.find(query, {"mnemonic": 1}, batch_size=self.batch_size).sort("_id", 1)
+        batch: List[Tuple[ObjectId, bytes]] = []
+        for doc in cursor:
+            batch.append((doc["_id"], doc["mnemonic"]))
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    def _write(self, rotated: List[Tuple[ObjectId, bytes, bytes]]) -> float:
+        """
+        Returns how long the write took.
+        """
+        start: float = time.monotonic()
+        result = self.addresses.bulk_write([
+            pymongo.UpdateOne({"_id": _id, "mnemonic": old}, {"$set": {"mnemonic": new, "key_version": self.version}})
+            for _id, old, new in rotated
+        ], ordered=False)
+        seconds: float = time.monotonic() - start
+        self.rotated += result.modified_count
+        self.skipped += len(rotated) - result.modified_count
+        self.rotations.update_one(
+            {"_id": self.version},
+            {"$set": {"last_id": rotated[-1][0], "rotated": self.rotated, "updated": datetime.now()}},
+            upsert=True,
+        )
+        return seconds
+
+    def _throttle(self, size: int, write_seconds: float, batch_started: float) -> None:
+        # halve the rate when Mongo is slow, then win it back little by little
+        if write_seconds > self.max_write_latency:
+            self.rate = max(self.rate / 2, self.batch_size / 10)
+        else:
+            self.rate = min(self.rate * 1.1, self.max_rate)
+        delay: float = size / self.rate - (time.monotonic() - batch_started)
+        if delay > 0:
+            time.sleep(delay)
+
+    def run(self) -> int:
+        """
+        Returns how many mnemonics were re-encrypted.
+        """
+        checkpoint: Optional[Dict] = self.rotations.find_one({"_id": self.version})
+        last_id: Optional[ObjectId] = checkpoint.get("last_id") if checkpoint is not None else None
+        self.rotated = checkpoint["rotated"] if checkpoint is not None else 0
+        total: int = self.remaining()
+        started: float = time.monotonic()
+        last_report: float = started
+        rotated_before: int = self.rotated
+
+        with ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self.keys,)) as pool:
+            pending: Deque[Tuple[float, Future]] = deque()
+            for batch in self._batches(last_id):
+                pending.append((time.monotonic(), pool.submit(rotate_chunk, batch)))
+                if len(pending) >= self.workers:
+                    batch_started, future = pending.popleft()
+                    rotated: List[Tuple[ObjectId, bytes, bytes]] = future.result()
+                    self._throttle(len(rotated), self._write(rotated), batch_started)
+                if time.monotonic() - last_report >= self.progress_interval:
+                    last_report = time.monotonic()
+                    self._report(self.rotated - rotated_before, last_report - started, total)
+            while pending:
+                batch_started, future = pending.popleft()
+                rotated = future.result()
+                self._throttle(len(rotated), self._write(rotated), batch_started)
+
+        self._report(self.rotated - rotated_before, time.monotonic() - started, total)
+        # the next run starts over, for addresses that changed while rotating
+        self.rotations.update_one({"_id": self.version}, {"$set": {"last_id": None}})
+        return self.rotated
+
+    def _report(self, done: int, seconds: float, total: int) -> None:
+        rate: float = done / seconds if seconds > 0 else 0.0
+        print(f"{done}/{total} re-encrypted, {rate:.0f}/s (limit {self.rate:.0f}/s), {self.skipped} changed while rotating", file=sys.stderr)
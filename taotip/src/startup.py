@@ -0,0 +1,66 @@
+import asyncio
+from typing import Callable, TypeVar
+
+import interactions
+import pymongo
+
+from . import api, metrics, tracing
+from .config import Config
+
+T = TypeVar("T")
+
+
+async def connect_with_retry(name: str, connect: Callable[[], T], attempts: int = 8, base_delay: float = 1.0, max_delay: float = 30.0) -> T:
+    """
+    Runs the blocking connect on a thread, retrying with exponential backoff.
+    Raises the last error after `attempts` failures.
+    """
+    loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+    delay: float = base_delay
+    for attempt in range(1, attempts + 1):
+        try:
+            return await loop.run_in_executor(None, connect)
+        except Exception as e:
+            print(e, f"startup.{name}")
+            if attempt == attempts:
+                raise
+            print(f"Can't connect to {name} (attempt {attempt}/{attempts}), retrying in {delay:.0f}s...")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+
+def connect_subtensor(config: Config) -> api.API:
+    _api: api.API = api.API(config, testing=config.TESTING)
+    try:
+        if not _api.subtensor.connect(failure=False):
+            raise Exception("Can't connect to subtensor node")
+    finally:
+        # only checked here, the blocking pool's threads open their own connections
+        _api.subtensor.close()
+    return _api
+
+
+def connect_mongo(config: Config) -> pymongo.MongoClient:
+    mongo_uri: str = config.MONGO_URI_TEST if config.TESTING else config.MONGO_URI
+    client: pymongo.MongoClient = pymongo.MongoClient(mongo_uri, serverSelectionTimeoutMS=5000, event_listeners=[metrics.mongo_pool, tracing.mongo_commands])
+    # MongoClient connects lazily, make sure the server is reachable
+    client.admin.command("ping")
+    return client
+
+
+class Readiness:
+    """
+    Commands are registered at once; they are answered only once the bot is connected.
+    """
+    ready: bool
+
+    def __init__(self) -> None:
+        self.ready = False
+
+    def set(self) -> None:
+        self.ready = True
+
+    async def check(self, ctx: interactions.context._Context) -> bool:
+        if not self.ready:
+            await ctx.send("Tao Tip is starting up, please try again in a few seconds.", ephemeral=True)
+        return self.ready
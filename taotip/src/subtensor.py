@@ -0,0 +1,96 @@
+import threading
+from typing import Any, Optional
+
+from .balance import Balance
+
+# ws endpoints of the known networks
+NETWORKS = {
+    "nobunaga": "staging.nobunaga.opentensor.ai:9944",
+    "nakamoto": "AtreusLB-2c6154f73e6429a9.elb.us-east-2.amazonaws.com:9944",
+    "local": "127.0.0.1:9944",
+}
+
+# custom types of the subtensor runtime we rely on
+TYPE_REGISTRY = {
+    "runtime_id": 2,
+    "types": {
+        "Balance": "u64",
+    },
+}
+
+
+class Subtensor:
+    """
+    The part of bittensor.subtensor the bot uses: balances, the block height,
+    and the substrate connection, without importing bittensor.
+
+    A substrate connection can't be used by two threads at once, so each thread of the
+    blocking pool (see executor.run_blocking) opens its own the first time it needs one.
+    """
+    network: str
+    chain_endpoint: str
+
+    def __init__(self, network: str = "nakamoto", chain_endpoint: Optional[str] = None) -> None:
+        self.network = network
+        self.chain_endpoint = chain_endpoint or NETWORKS[network]
+        # connections are opened by the threads using them, see substrate
+        self._local = threading.local()
+
+    def _connect(self) -> Any:
+        # imported here, substrateinterface is slow to import and only needed once connected
+        from substrateinterface import SubstrateInterface
+
+        return SubstrateInterface(
+            url=f"ws://{self.chain_endpoint}",
+            ss58_format=42,
+            type_registry_preset='substrate-node-template',
+            type_registry=TYPE_REGISTRY,
+            use_remote_preset=True,
+        )
+
+    @property
+    def substrate(self) -> Any:
+        substrate: Any = getattr(self._local, "substrate", None)
+        if substrate is None:
+            substrate = self._local.substrate = self._connect()
+        return substrate
+
+    @substrate.setter
+    def substrate(self, substrate: Any) -> None:
+        self._local.substrate = substrate
+
+    def close(self) -> None:
+        """
+        Closes the calling thread's connection, if it opened one.
+        """
+        substrate: Any = getattr(self._local, "substrate", None)
+        if substrate is not None:
+            self._local.substrate = None
+            substrate.close()
+
+    def connect(self, failure: bool = True) -> bool:
+        """
+        Checks the node answers on the calling thread's connection, opening it if needed.
+        Raises if it doesn't and failure is set.
+        """
+        try:
+            self.substrate.get_block_number(None)
+            return True
+        except Exception as e:
+            if failure:
+                raise
+            print(e, "subtensor.connect")
+            return False
+
+    def get_balance(self, address: str) -> Balance:
+        with self.substrate as substrate:
+            result = substrate.query(
+                module='System',
+                storage_function='Account',
+                params=[address],
+            )
+        return Balance.from_rao(result.value['data']['free'])
+
+    def get_current_block(self) -> int:
+        with self.substrate as substrate:
+            return substrate.get_block_number(None)
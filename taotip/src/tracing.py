@@ -0,0 +1,246 @@
+import asyncio
+import functools
+import json
+import logging
+import logging.handlers
+import os
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from pymongo import monitoring
+
+# the span the running code is in; copied into tasks and follows awaits
+_current: ContextVar[Optional['Span']] = ContextVar("taotip_span", default=None)
+
+
+class Trace:
+    """
+    The spans of one interaction or job. Written out once every span has ended,
+    which can be after the root, e.g. a command handler that outlived its timeout.
+    """
+    __slots__ = ("trace_id", "name", "sampled", "started", "wall_start", "spans", "open", "dropped", "error", "finished")
+
+    def __init__(self, name: str, sampled: bool) -> None:
+        self.trace_id: str = os.urandom(8).hex()
+        self.name = name
+        self.sampled = sampled # head sampled, written whatever its duration
+        self.started: float = time.perf_counter()
+        self.wall_start: datetime = datetime.now(timezone.utc)
+        self.spans: List[Dict] = []
+        self.open: int = 0
+        self.dropped: int = 0
+        self.error: bool = False
+        self.finished: bool = False
+
+
+class Span:
+    __slots__ = ("trace", "name", "span_id", "parent_id", "start", "attributes")
+
+    def __init__(self, trace: Trace, name: str, parent_id: Optional[str], attributes: Dict[str, Any]) -> None:
+        self.trace = trace
+        self.name = name
+        self.span_id: str = os.urandom(4).hex()
+        self.parent_id = parent_id
+        self.start: float = time.perf_counter()
+        self.attributes = attributes
+
+
+class Tracer:
+    """
+    Collects the spans of sampled commands and jobs and writes each trace as one JSON line
+    to a rotating file.
+
+    A trace is kept if it was head sampled (sample_rate of them, decided when it starts),
+    if it took slow_threshold seconds or more, or if a span raised.
+    Until configured with a path, nothing is recorded.
+    """
+    max_spans: int = 1000 # per trace, further spans are only counted
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.sample_rate = 0.0
+        self.slow_threshold = 1.0
+        self._logger: Optional[logging.Logger] = None
+
+    def configure(self, path: str, sample_rate: float = 0.01, slow_threshold: float = 1.0, max_bytes: int = 10_000_000, backup_count: int = 5) -> None:
+        logger: logging.Logger = logging.getLogger("taotip.traces")
+        logger.propagate = False
+        logger.setLevel(logging.INFO)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+            handler.close()
+        handler: logging.Handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+
+        self._logger = logger
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold
+        self.enabled = True
+
+    @contextmanager
+    def span(self, name: str, root: bool = False, **attributes: Any) -> Iterator[Optional[Span]]:
+        """
+        A child of the current span. With root, starts a new trace if there is no current span.
+        Outside a trace (e.g. the deposit scan) nothing is recorded.
+        """
+        parent: Optional[Span] = _current.get()
+        if parent is None or parent.trace.finished:
+            if not (root and self.enabled):
+                yield None
+                return
+            trace: Trace = Trace(name, random.random() < self.sample_rate)
+            span: Span = Span(trace, name, None, attributes)
+        else:
+            span = Span(parent.trace, name, parent.span_id, attributes)
+
+        span.trace.open += 1
+        token = _current.set(span)
+        error: Optional[str] = None
+        try:
+            yield span
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            _current.reset(token)
+            self._end(span, time.perf_counter(), error)
+
+    def record(self, name: str, start: float, end: float, error: Optional[str] = None, **attributes: Any) -> None:
+        """
+        Adds an already finished span under the current one, for work timed elsewhere (e.g. by a Mongo listener).
+        """
+        parent: Optional[Span] = _current.get()
+        if parent is None or parent.trace.finished:
+            return
+        span: Span = Span(parent.trace, name, parent.span_id, attributes)
+        span.start = start
+        span.trace.open += 1
+        self._end(span, end, error)
+
+    def _end(self, span: Span, end: float, error: Optional[str]) -> None:
+        trace: Trace = span.trace
+        trace.open -= 1
+        if len(trace.spans) < self.max_spans:
+            doc: Dict = {
+                "id": span.span_id,
+                "parent": span.parent_id,
+                "name": span.name,
+                "start_ms": round((span.start - trace.started) * 1000, 3),
+                "duration_ms": round((end - span.start) * 1000, 3),
+            }
+            if error is not None:
+                doc["error"] = error
+            if span.attributes:
+                doc["attributes"] = span.attributes
+            trace.spans.append(doc)
+        else:
+            trace.dropped += 1
+        if error is not None:
+            trace.error = True
+
+        if trace.open == 0:
+            trace.finished = True
+            self._export(trace, end)
+
+    def _export(self, trace: Trace, end: float) -> None:
+        duration: float = end - trace.started
+        if trace.error:
+            reason: str = "error"
+        elif duration >= self.slow_threshold:
+            reason = "slow"
+        elif trace.sampled:
+            reason = "head"
+        else:
+            return
+
+        try:
+            self._logger.info(json.dumps({
+                "trace_id": trace.trace_id,
+                "name": trace.name,
+                "time": trace.wall_start.isoformat(),
+                "duration_ms": round(duration * 1000, 3),
+                "sampled": reason,
+                "dropped_spans": trace.dropped,
+                "spans": sorted(trace.spans, key=lambda span: span["start_ms"]),
+            }, default=str))
+        except Exception as e:
+            print(e, "tracing.export")
+
+
+tracer: Tracer = Tracer()
+
+
+def span(name: str, root: bool = False, **attributes: Any):
+    return tracer.span(name, root, **attributes)
+
+
+def traced(name: Optional[str] = None, root: bool = False) -> Callable:
+    """
+    Runs the decorated function, sync or async, in a span named name or after the function.
+    """
+    def decorator(func: Callable) -> Callable:
+        span_name: str = name or func.__name__
+
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with tracer.span(span_name, root):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with tracer.span(span_name, root):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """
+    Records every Mongo round trip as a span of the command or job that made it.
+    pymongo calls the listener on the calling thread, in the caller's context.
+    """
+    def __init__(self) -> None:
+        self._started: Dict[int, float] = {}
+
+    def started(self, event) -> None:
+        if _current.get() is not None:
+            self._started[event.request_id] = time.perf_counter()
+
+    def succeeded(self, event) -> None:
+        self._end(event, None)
+
+    def failed(self, event) -> None:
+        self._end(event, "failed")
+
+    def _end(self, event, error: Optional[str]) -> None:
+        start: Optional[float] = self._started.pop(event.request_id, None)
+        if start is not None:
+            tracer.record(f"mongo.{event.command_name}", start, time.perf_counter(), error)
+
+
+mongo_commands: MongoCommandListener = MongoCommandListener()
+
+
+def trace_discord_requests(http_client) -> None:
+    """
+    Records the Discord REST calls made by the bot, given its interactions HTTPClient,
+    as spans named after their method and route.
+    """
+    request = http_client._req
+    if getattr(request, "_traced", False):
+        return
+    send: Callable = request.request
+
+    async def traced_request(route, **kwargs):
+        with tracer.span(f"discord.{route.method} {route.path}"):
+            return await send(route, **kwargs)
+
+    request.request = traced_request
+    request._traced = True
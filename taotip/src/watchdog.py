@@ -0,0 +1,132 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Dict, List, Optional, Tuple
+
+from .metrics import LOOP_BLOCKED_SECONDS, LOOP_LAG_SECONDS, LOOP_STALLS
+
+# frames from these files are the bot's own code, the call sites we can fix
+_PACKAGE_DIR: str = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class CallSite:
+    __slots__ = ("site", "stack", "stalls", "blocked", "longest")
+
+    def __init__(self, site: str, stack: List[str]) -> None:
+        self.site = site
+        self.stack = stack # the innermost frames, from the last stall seen here
+        self.stalls = 0
+        self.blocked = 0.0 # seconds
+        self.longest = 0.0 # seconds
+
+
+class LoopWatchdog:
+    """
+    Finds the calls that block the event loop.
+
+    A task on the loop wakes up every `interval` seconds and measures how late it was.
+    A thread watches that task: when it hasn't woken up for `threshold` seconds, the loop
+    is blocked and the thread captures the loop thread's stack. The lag, once the loop
+    resumes, is attributed to the innermost frame of the bot's own code in that stack.
+    """
+    def __init__(self, threshold: float = 0.1, interval: float = 0.05, summary_interval: float = 300.0) -> None:
+        self.threshold = threshold
+        self.interval = interval
+        self.summary_interval = summary_interval
+        self.sites: Dict[str, CallSite] = {}
+        self._lock = threading.Lock()
+        self._beat: float = time.monotonic()
+        self._captured: Optional[Tuple[float, str, List[str]]] = None # (beat, site, stack) of the current stall
+        self._loop_thread: Optional[int] = None
+        self._stopped = threading.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self, loop: asyncio.AbstractEventLoop) -> None:
+        self._tasks = [loop.create_task(self._heartbeat()), loop.create_task(self._summarize())]
+        threading.Thread(target=self._watch, name="loop-watchdog", daemon=True).start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+    async def _heartbeat(self) -> None:
+        self._loop_thread = threading.get_ident()
+        while True:
+            expected: float = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now: float = time.monotonic()
+            lag: float = max(now - expected, 0.0)
+            with self._lock:
+                captured: Optional[Tuple[float, str, List[str]]] = self._captured
+                self._captured = None
+                self._beat = now
+            LOOP_LAG_SECONDS.observe(lag)
+            if captured is not None:
+                self._record(captured[1], captured[2], lag)
+
+    def _watch(self) -> None:
+        while not self._stopped.wait(self.threshold / 2):
+            with self._lock:
+                beat: float = self._beat
+                already_captured: bool = self._captured is not None and self._captured[0] == beat
+            if self._loop_thread is None or already_captured:
+                continue
+            if time.monotonic() - beat - self.interval < self.threshold:
+                continue
+
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            site, stack = self.call_site(traceback.extract_stack(frame))
+            with self._lock:
+                if self._beat == beat:
+                    self._captured = (beat, site, stack)
+
+    @staticmethod
+    def call_site(stack: traceback.StackSummary) -> Tuple[str, List[str]]:
+        """
+        The innermost frame of the bot's code and the few frames below it.
+        """
+        frames: List[traceback.FrameSummary] = list(stack)
+        own: List[int] = [
+            i for i, frame in enumerate(frames)
+            if frame.filename.startswith(_PACKAGE_DIR) and not frame.filename.endswith("watchdog.py")
+        ]
+        i: int = own[-1] if own else len(frames) - 1
+        frame: traceback.FrameSummary = frames[i]
+        site: str = f"{os.path.relpath(frame.filename, _PACKAGE_DIR)}:{frame.lineno} {frame.name}"
+        # the call site and what it was waiting in
+        stack_lines: List[str] = [f"{f.filename}:{f.lineno} {f.name}" for f in frames[max(i - 2, 0):]][-8:]
+        return site, stack_lines
+
+    def _record(self, site: str, stack: List[str], lag: float) -> None:
+        call_site: Optional[CallSite] = self.sites.get(site)
+        if call_site is None:
+            call_site = self.sites[site] = CallSite(site, stack)
+        call_site.stack = stack
+        call_site.stalls += 1
+        call_site.blocked += lag
+        call_site.longest = max(call_site.longest, lag)
+        LOOP_STALLS.inc(1, site)
+        LOOP_BLOCKED_SECONDS.inc(lag, site)
+
+    def summary(self, top: int = 10) -> str:
+        sites: List[CallSite] = sorted(self.sites.values(), key=lambda s: s.blocked, reverse=True)[:top]
+        if len(sites) == 0:
+            return f"Event loop: no stalls over {self.threshold}s"
+        lines: List[str] = [f"Event loop: blocked at {len(self.sites)} call sites (over {self.threshold}s)"]
+        for s in sites:
+            lines.append(f"  {s.blocked:8.2f}s in {s.stalls:5d} stalls, longest {s.longest:.2f}s: {s.site}")
+            lines.extend(f"      {line}" for line in s.stack)
+        return "\n".join(lines)
+
+    async def _summarize(self) -> None:
+        while True:
+            await asyncio.sleep(self.summary_interval)
+            if len(self.sites) > 0:
+                print(self.summary())
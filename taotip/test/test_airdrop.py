@@ -0,0 +1,67 @@
+import random
+from typing import Dict, List, Tuple
+
+from cryptography.fernet import Fernet
+
+from taotip.src.airdrop import AirdropCheckpoint, ref_time
+from taotip.src.balance import Balance
+from taotip.test.test_db import DBTestCase
+
+
+class TestAirdropCheckpoint(DBTestCase):
+    def tearDown(self) -> None:
+        super().tearDown()
+        self._db.db.airdrops.drop()
+        self._db.db.airdrop_recipients.drop()
+
+    def make_recipients(self, n: int) -> List[Tuple[str, Balance]]:
+        return [
+            (str(random.randint(0, 1000000000)), Balance.from_rao(random.randint(1, 10000000)))
+            for _ in range(n)
+        ]
+
+    async def test_load_resolve(self):
+        key: bytes = Fernet.generate_key()
+        recipients = self.make_recipients(random.randint(2, 20))
+        # One recipient already has an address
+        existing: str = await self._db.create_new_address(key, recipients[0][0])
+
+        checkpoint = AirdropCheckpoint(self._db, "run", "treasury")
+        self.assertEqual(checkpoint.load(recipients), len(recipients))
+        # Loading again on resume adds nothing
+        self.assertEqual(checkpoint.load(recipients), 0)
+
+        await checkpoint.resolve_addresses(key)
+        pending: List[Dict] = checkpoint.pending()
+        self.assertEqual(len(pending), len(recipients))
+        self.assertEqual(
+            self._db.db.airdrop_recipients.find_one({'user': recipients[0][0]})['address'],
+            existing
+        )
+        for doc in pending:
+            self.assertEqual(self._db.get_address_by_user(doc['user']).address, doc['address'])
+
+    async def test_reconcile(self):
+        recipients = self.make_recipients(6)
+        checkpoint = AirdropCheckpoint(self._db, "run", "treasury")
+        checkpoint.load(recipients)
+        docs: List[Dict] = list(self._db.db.airdrop_recipients.find({}))
+
+        checkpoint.mark_submitted(docs[:2], 10, "0x1")
+        checkpoint.mark_submitted(docs[2:4], 11, "0x2")
+        checkpoint.mark_submitted(docs[4:], 12, "0x3")
+
+        # the chain consumed nonce 10 before the run was interrupted
+        self.assertEqual(checkpoint.reconcile(11), 2)
+        submitted: Dict[int, List[Dict]] = checkpoint.submitted()
+        self.assertEqual(sorted(submitted.keys()), [11, 12])
+        self.assertEqual(checkpoint.counts(), {'done': 2, 'submitted': 4})
+
+    def test_run_treasury_mismatch(self):
+        AirdropCheckpoint(self._db, "run", "treasury")
+        with self.assertRaises(Exception):
+            AirdropCheckpoint(self._db, "run", "other treasury")
+
+    def test_ref_time(self):
+        self.assertEqual(ref_time(100), 100)
+        self.assertEqual(ref_time({'ref_time': 100, 'proof_size': 5}), 100)
@@ -0,0 +1,128 @@
+import json
+import os
+import tempfile
+import unittest
+from typing import Dict, List
+from unittest.mock import patch
+
+import mongomock
+from cryptography.fernet import Fernet
+from substrateinterface import Keypair
+
+from taotip.src import backup
+from taotip.src.backup import Backup, read_backup
+from taotip.src.db import Address
+
+
+class TestBackup(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.secret: bytes = Fernet.generate_key()
+        cls.mnemonics: List[str] = [Keypair.generate_mnemonic(12) for _ in range(3)]
+        cls.addresses: List[str] = [Keypair.create_from_mnemonic(mnemonic).ss58_address for mnemonic in cls.mnemonics]
+
+    def setUp(self) -> None:
+        self.collection = mongomock.MongoClient().test.addresses
+        self.collection.insert_many([
+            {"address": address, "mnemonic": Address(address, mnemonic, self.secret).get_encrypted_mnemonic(), "user": str(i)}
+            for i, (address, mnemonic) in enumerate(zip(self.addresses * 5, self.mnemonics * 5))
+        ])
+        self.directory = tempfile.TemporaryDirectory()
+        self.output: str = os.path.join(self.directory.name, "backup")
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    def test_fernet(self):
+        key: bytes = Fernet.generate_key()
+        count: int = Backup(self.collection, self.output, self.secret, "fernet", key, workers=2, chunk_size=4).run()
+
+        self.assertEqual(count, 15)
+        self.assertFalse(os.path.exists(self.output + ".checkpoint"))
+        self.assertEqual(os.stat(self.output).st_mode & 0o777, 0o600)
+        records: List[Dict] = list(read_backup(self.output, key))
+        self.assertEqual([r["user"] for r in records], [str(i) for i in range(15)])
+        self.assertEqual(records[4]["mnemonic"], self.mnemonics[1])
+        self.assertEqual(records[4]["address"], self.addresses[1])
+        with self.assertRaises(Exception):
+            list(read_backup(self.output, Fernet.generate_key()))
+
+        # complete backups are not overwritten
+        with self.assertRaises(FileExistsError):
+            Backup(self.collection, self.output, self.secret, "fernet", key).run()
+
+    def test_polkadot(self):
+        Backup(self.collection, self.output, self.secret, "polkadot", passphrase="correct horse", workers=1, chunk_size=10).run()
+
+        records: List[Dict] = list(read_backup(self.output))
+        self.assertEqual(len(records), 15)
+        keypair: Keypair = Keypair.create_from_encrypted_json(records[2]["json"], "correct horse")
+        self.assertEqual(keypair.ss58_address, self.addresses[2])
+
+    def test_resume_polkadot_other_passphrase(self):
+        calls: List[int] = []
+        encode = backup.encode_chunk
+
+        def interrupted(docs):
+            calls.append(len(docs))
+            if len(calls) == 3:
+                raise KeyboardInterrupt()
+            return encode(docs)
+
+        with patch.object(backup, "ProcessPoolExecutor", InlineExecutor), patch.object(backup, "encode_chunk", interrupted):
+            with self.assertRaises(KeyboardInterrupt):
+                Backup(self.collection, self.output, self.secret, "polkadot", passphrase="correct horse", workers=1, chunk_size=4).run()
+        # entries under two passphrases couldn't all be restored
+        with self.assertRaises(ValueError):
+            Backup(self.collection, self.output, self.secret, "polkadot", passphrase="battery staple", workers=1, chunk_size=4).run()
+
+        with patch.object(backup, "ProcessPoolExecutor", InlineExecutor):
+            count: int = Backup(self.collection, self.output, self.secret, "polkadot", passphrase="correct horse", workers=1, chunk_size=4).run()
+        self.assertEqual(count, 15)
+
+    def test_resume(self):
+        key: bytes = Fernet.generate_key()
+        calls: List[int] = []
+        encode = backup.encode_chunk
+
+        def interrupted(docs):
+            calls.append(len(docs))
+            if len(calls) == 3:
+                raise KeyboardInterrupt()
+            return encode(docs)
+
+        # in process, so the interruption is seen
+        with patch.object(backup, "ProcessPoolExecutor", InlineExecutor), patch.object(backup, "encode_chunk", interrupted):
+            with self.assertRaises(KeyboardInterrupt):
+                Backup(self.collection, self.output, self.secret, "fernet", key, workers=1, chunk_size=4).run()
+        self.assertEqual(os.stat(self.output + ".checkpoint").st_mode & 0o777, 0o600)
+        with open(self.output + ".checkpoint") as f:
+            # chunks are written in order, a chunk behind the one being encoded
+            self.assertEqual(json.load(f)["count"], 4)
+        # chunks encrypted with different keys couldn't be read back
+        with self.assertRaises(ValueError):
+            Backup(self.collection, self.output, self.secret, "fernet", Fernet.generate_key(), workers=1, chunk_size=4).run()
+        # a chunk half written when interrupted
+        with open(self.output, "ab") as f:
+            f.write(b"gAAAAA")
+
+        count: int = Backup(self.collection, self.output, self.secret, "fernet", key, workers=1, chunk_size=4).run()
+        self.assertEqual(count, 15)
+        self.assertEqual([r["user"] for r in read_backup(self.output, key)], [str(i) for i in range(15)])
+
+
+class InlineExecutor:
+    def __init__(self, workers, initializer, initargs) -> None:
+        initializer(*initargs)
+
+    def __enter__(self) -> 'InlineExecutor':
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def submit(self, function, *args):
+        from concurrent.futures import Future
+        future: Future = Future()
+        future.set_result(function(*args))
+        return future
@@ -0,0 +1,46 @@
+import unittest
+
+from taotip.src.balance import Balance
+
+
+class TestBalance(unittest.TestCase):
+    def test_constructors(self):
+        self.assertEqual(Balance(1).rao, 1) # int is rao
+        self.assertEqual(Balance(1.0).rao, 10 ** 9) # float is tao
+        self.assertEqual(Balance.from_tao(0.3).rao, 300000000)
+        self.assertEqual(Balance.from_float(2).rao, 2 * 10 ** 9)
+        self.assertEqual(Balance.from_rao(123).tao, 123 / 10 ** 9)
+
+    def test_parse_tao(self):
+        self.assertEqual(Balance.parse_tao("0.3").rao, 300000000)
+        self.assertEqual(Balance.parse_tao(" 12.123456789123 ").rao, 12123456789) # past the rao is dropped
+        with self.assertRaises(ValueError):
+            Balance.parse_tao("abc")
+        with self.assertRaises(ValueError):
+            Balance.parse_tao("nan")
+
+    def test_arithmetic(self):
+        a: Balance = Balance.from_rao(300)
+        b: Balance = Balance.from_rao(100)
+        self.assertEqual(a + b, Balance.from_rao(400))
+        self.assertEqual(a - b, Balance.from_rao(200))
+        self.assertEqual(a + 5, Balance.from_rao(305)) # numbers are rao
+        self.assertEqual(a // 7, Balance.from_rao(42))
+        self.assertEqual(a * 2, Balance.from_rao(600))
+        self.assertEqual(sum([a, b], Balance(0)), Balance.from_rao(400))
+
+    def test_compare(self):
+        a: Balance = Balance.from_rao(300)
+        self.assertTrue(a > Balance.from_rao(299))
+        self.assertTrue(a <= 300)
+        self.assertFalse(a <= 0.0)
+        self.assertNotEqual(a, None)
+        self.assertEqual(hash(a), hash(Balance.from_rao(300)))
+
+    def test_format(self):
+        self.assertEqual(str(Balance.from_tao(1234.5)), "τ1,234.500000000")
+        self.assertEqual(f"{Balance.from_tao(1.5):0.2f}", "1.50")
+
+
+if __name__ == '__main__':
+    unittest.main()
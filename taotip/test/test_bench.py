@@ -0,0 +1,18 @@
+import unittest
+from types import SimpleNamespace
+from typing import Dict
+
+from taotip.bench.benchmarks import BENCHMARKS, run_benchmark
+
+
+class TestBenchmarks(unittest.IsolatedAsyncioTestCase):
+    async def test_smoke(self):
+        options: SimpleNamespace = SimpleNamespace(
+            ops=3, mongo_uri=None, rpc_latency=0.0, discord_latency=0.0, welcome_concurrency=2, seed=0,
+        )
+        for name in BENCHMARKS:
+            result: Dict = await run_benchmark(name, 20, options)
+            self.assertEqual(result["benchmark"], name)
+            self.assertGreater(result["items"], 0)
+            self.assertGreaterEqual(result["p99_ms"], result["p50_ms"])
+            self.assertGreater(result["peak_rss_mb"], 0)
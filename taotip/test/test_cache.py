@@ -0,0 +1,76 @@
+import time
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import interactions
+
+from taotip.src.cache import EntityCache, TTLCache
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_expiry(self):
+        cache: TTLCache = TTLCache(10, 0.05)
+        cache.set("a", 1)
+        self.assertEqual(cache.get("a"), 1)
+        time.sleep(0.06)
+        self.assertIsNone(cache.get("a"))
+        self.assertEqual(len(cache), 0)
+
+    def test_lru_bound(self):
+        cache: TTLCache = TTLCache(2, 60.0)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a") # a is now the most recently used
+        cache.set("c", 3)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.get("c"), 3)
+
+
+    def test_hit_ratio(self):
+        cache: TTLCache = TTLCache(10, 60.0)
+        self.assertIsNone(cache.hit_ratio())
+        cache.set("a", 1)
+        cache.get("a")
+        cache.get("b")
+        self.assertEqual(cache.hit_ratio(), 0.5)
+
+
+class TestEntityCache(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.cache = EntityCache(100, 60.0)
+
+    async def test_channel_type_dm_from_payload(self):
+        ctx = MagicMock(guild_id=None, get_channel=AsyncMock())
+        self.assertEqual(await self.cache.channel_type(ctx), interactions.ChannelType.DM)
+        ctx.get_channel.assert_not_awaited()
+
+    async def test_channel_type_cached(self):
+        channel = MagicMock(id=2, type=interactions.ChannelType.GUILD_TEXT)
+        ctx = MagicMock(guild_id=1, channel_id=2, get_channel=AsyncMock(return_value=channel))
+        self.assertEqual(await self.cache.channel_type(ctx), interactions.ChannelType.GUILD_TEXT)
+        self.assertEqual(await self.cache.channel_type(ctx), interactions.ChannelType.GUILD_TEXT)
+        ctx.get_channel.assert_awaited_once()
+
+    async def test_get_member_observed(self):
+        member = MagicMock(user=MagicMock(id=5, bot=False))
+        ctx = MagicMock(guild_id=1, member=member, user=member.user, data=None)
+        self.cache.observe(ctx)
+
+        with patch("taotip.src.cache.interactions.get", new_callable=AsyncMock) as mock_get:
+            self.assertIs(await self.cache.get_member(MagicMock(), 1, "5"), member)
+            mock_get.assert_not_awaited()
+
+    async def test_get_member_miss(self):
+        member = MagicMock(user=MagicMock(id=6, bot=True))
+        with patch("taotip.src.cache.interactions.get", new_callable=AsyncMock, return_value=member) as mock_get:
+            self.assertIs(await self.cache.get_member(MagicMock(), 1, 6), member)
+            self.assertIs(await self.cache.get_member(MagicMock(), 1, "6"), member)
+            mock_get.assert_awaited_once()
+
+        self.cache.forget_member(1, 6)
+        self.assertIsNone(self.cache.members.get(("1", "6")))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -4,10 +4,11 @@ from typing import Dict
 from unittest.mock import MagicMock,patch
 from callee import Contains
 
-import bittensor
 from cryptography.fernet import Fernet
 
 from taotip.src import api, db
+from taotip.src.balance import Balance
+from taotip.src.context import RequestContext
 from taotip.test.test_db import DBTestCase
 
 """
@@ -23,7 +24,7 @@ class TestChainWithMock(DBTestCase):
                 process_events=MagicMock(return_value=None),
                 is_success=True
         )
-        amount: bittensor.Balance = bittensor.Balance.from_float(random.random() * 1000 + 2)
+        amount: Balance = Balance.from_float(random.random() * 1000 + 2)
         with patch('substrateinterface.SubstrateInterface.query', return_value=SimpleNamespace(
             value = {
                 'data': {
@@ -39,7 +40,7 @@ class TestChainWithMock(DBTestCase):
                 api_transaction = {
                     "coldkeyadd": addr,
                     "dest": dest_addr.address,
-                    "amount": amount.tao # in tao for this addr
+                    "amount": amount.rao
                 }
                 _transaction = await self._api.create_transaction(api_transaction)
                 _signed_transaction = await self._api.sign_transaction(self._db, _transaction, addr, key_bytes)
@@ -50,7 +51,7 @@ class TestChainWithMock(DBTestCase):
     def test_check_balance(self):
         key_bytes = Fernet.generate_key()
         addr: db.Address = self._api.create_address(key_bytes)
-        bal: bittensor.Balance = bittensor.Balance.from_float(random.random() * 1000 + 2)
+        bal: Balance = Balance.from_float(random.random() * 1000 + 2)
         with patch('substrateinterface.SubstrateInterface.query', return_value=SimpleNamespace(
             value = {
                 'data': {
@@ -62,7 +63,7 @@ class TestChainWithMock(DBTestCase):
 
     def test_check_balance_with_invalid_address(self):
         key_bytes = Fernet.generate_key()
-        bal: bittensor.Balance = bittensor.Balance.from_float(random.random() * 1000 + 2)
+        bal: Balance = Balance.from_float(random.random() * 1000 + 2)
         with patch('substrateinterface.SubstrateInterface.query', return_value=SimpleNamespace(
             value = {
                 'data': {
@@ -80,26 +81,44 @@ class TestChainWithMock(DBTestCase):
         key_bytes = Fernet.generate_key()
         addr: str = await self._db.create_new_address(key_bytes) 
         dest_addr: db.Address = self._api.create_address(Fernet.generate_key())
-        amount: bittensor.Balance = bittensor.Balance.from_float(random.random() * 1000 + 2)
+        amount: Balance = Balance.from_float(random.random() * 1000 + 2)
         
         api_transaction = {
             "coldkeyadd": addr,
             "dest": dest_addr.address,
-            "amount": amount.tao # in tao for this addr
+            "amount": amount.rao
         }
         _, _, paymentinfo = self._api.init_transaction(
             addr, dest_addr.address, amount
         )
-        fee: bittensor.Balance = await self._api.get_fee(addr, dest_addr.address, amount)
+        fee: Balance = await self._api.get_fee(addr, dest_addr.address, amount)
 
         self.assertAlmostEqual(paymentinfo['partialFee'], fee.rao)
 
+    async def test_get_fee_memoized_per_command(self):
+        key_bytes = Fernet.generate_key()
+        addr: str = await self._db.create_new_address(key_bytes)
+        dest_addr: db.Address = self._api.create_address(Fernet.generate_key())
+        amount: Balance = Balance.from_float(random.random() * 1000 + 2)
+
+        rctx: RequestContext = RequestContext()
+        with patch('substrateinterface.SubstrateInterface.get_payment_info', return_value={'partialFee': 100}) as mock_payment_info:
+            fee: Balance = await self._api.get_fee(addr, dest_addr.address, amount, rctx)
+            # Same command builds the transaction after quoting the fee
+            _, _, paymentinfo = self._api.init_transaction(addr, dest_addr.address, amount, rctx)
+            mock_payment_info.assert_called_once()
+            self.assertEqual(fee.rao, paymentinfo['partialFee'])
+
+            # A new command asks the chain again
+            await self._api.get_fee(addr, dest_addr.address, amount, RequestContext())
+            self.assertEqual(mock_payment_info.call_count, 2)
+
 class TestChainWithoutMock(DBTestCase):
     _api: api.API
     _db: db.Database
     
     async def test_send_transaction_fail(self):
-        amount: bittensor.Balance = bittensor.Balance.from_float(random.random() * 1000 + 2)
+        amount: Balance = Balance.from_float(random.random() * 1000 + 2)
         
         key_bytes = Fernet.generate_key()
         addr: str = await self._db.create_new_address(key_bytes) 
@@ -118,7 +137,7 @@ class TestChainWithoutMock(DBTestCase):
         self.assertIsNone(result) # failure to send because of balance
 
     async def test_send_transaction_fail_no_balance(self):
-        amount: bittensor.Balance = bittensor.Balance.from_float(random.random() * 1000 + 2)
+        amount: Balance = Balance.from_float(random.random() * 1000 + 2)
         
         key_bytes = Fernet.generate_key()
         addr: str = await self._db.create_new_address(key_bytes) 
@@ -128,7 +147,7 @@ class TestChainWithoutMock(DBTestCase):
         api_transaction = {
             "coldkeyadd": addr,
             "dest": dest_addr.address,
-            "amount": amount.tao # in tao for this addr
+            "amount": amount.rao
         }
 
         with self.assertRaises(Exception) as e:
@@ -140,7 +159,7 @@ class TestChainWithoutMock(DBTestCase):
         # Create new address
         addr: db.Address = self._api.create_address(key_bytes)
         # Get balance; New address should have balance of 0
-        self.assertEqual(self._api.get_wallet_balance(addr.address), bittensor.Balance.from_rao(0))
+        self.assertEqual(self._api.get_wallet_balance(addr.address), Balance.from_rao(0))
 
     def test_check_balance_with_invalid_address(self):
         with self.assertRaises(Exception) as e:
@@ -153,11 +172,11 @@ class TestChainWithoutMock(DBTestCase):
         key_bytes = Fernet.generate_key()
         addr: str = await self._db.create_new_address(key_bytes) 
         dest_addr: db.Address = self._api.create_address(Fernet.generate_key())
-        amount: bittensor.Balance = bittensor.Balance.from_float(random.random() * 1000 + 2)
+        amount: Balance = Balance.from_float(random.random() * 1000 + 2)
 
         _, _, paymentinfo = self._api.init_transaction(
             addr, dest_addr.address, amount
         )
-        fee: bittensor.Balance = await self._api.get_fee(addr, dest_addr.address, amount)
+        fee: Balance = await self._api.get_fee(addr, dest_addr.address, amount)
 
         self.assertAlmostEqual(paymentinfo['partialFee'], fee.rao)
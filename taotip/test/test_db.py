@@ -1,11 +1,15 @@
+import asyncio
 import random
 from unittest.mock import MagicMock
-import bittensor
+from substrateinterface import Keypair
+from substrateinterface.utils.ss58 import is_valid_ss58_address
 import mongomock
 import unittest
 from cryptography.fernet import Fernet
 from taotip.src import api, db
-from taotip.src.db import Address, Tip
+from taotip.src.balance import Balance
+from taotip.src.db import Address, Rain, Tip
+from taotip.src.events import ADDRESS_ASSIGNED, BALANCE_CHANGED
 
 class DBTestCase(unittest.IsolatedAsyncioTestCase):
     @classmethod
@@ -18,6 +22,7 @@ class DBTestCase(unittest.IsolatedAsyncioTestCase):
         self._db.db.transactions.drop()
         self._db.db.balances.drop()
         self._db.db.tips.drop()
+        self._db.balance_cache.clear()
 
 class TestAddressEncrypt(DBTestCase):
     async def test_encrypt(self):
@@ -56,7 +61,7 @@ class TestAddressEncrypt(DBTestCase):
 
         # Get address from db, should be decrypted
         addr_from_db = self._db.get_address(addr.address, key=key_bytes)
-        keypair = bittensor.Keypair.create_from_mnemonic(addr_from_db.mnemonic)
+        keypair = Keypair.create_from_mnemonic(addr_from_db.mnemonic)
         self.assertEqual(addr.address, keypair.ss58_address)
 
 
@@ -71,9 +76,42 @@ class TestAddressEncrypt(DBTestCase):
         })
 
         wrong_key_bytes = Fernet.generate_key() 
-        # Get address from db, should be decrypted
+        # Get address from db, the mnemonic is decrypted when used
         addr_from_db = self._db.get_address(addr.address, key=wrong_key_bytes)
-        self.assertIsNone(addr_from_db) # Should be None because wrong key
+        self.assertEqual(addr_from_db.address, addr.address)
+        with self.assertRaises(Exception): # wrong key
+            addr_from_db.mnemonic
+
+    async def test_decrypt_lazily(self):
+        key_bytes = Fernet.generate_key()
+        addr: 'db.Address' = self._api.create_address(key_bytes)
+        encrypted: bytes = addr.get_encrypted_mnemonic()
+
+        lazy: Address = Address.encrypted(addr.address, encrypted, key_bytes)
+        self.assertIsNone(lazy._plaintext)
+        self.assertEqual(lazy.get_encrypted_mnemonic(), encrypted)
+        self.assertEqual(lazy.mnemonic, addr.mnemonic)
+        lazy.wipe()
+        self.assertIsNone(lazy._plaintext)
+        self.assertEqual(lazy.mnemonic, addr.mnemonic)
+
+        # no key, for callers that only need the address
+        with self.assertRaises(ValueError):
+            Address.encrypted(addr.address, encrypted, None).mnemonic
+
+    async def test_immutable(self):
+        addr: 'db.Address' = self._api.create_address(Fernet.generate_key())
+        with self.assertRaises(AttributeError):
+            addr.address = "5Other"
+        with self.assertRaises(AttributeError):
+            Tip("1", "2", Balance.from_rao(1)).amount = Balance.from_rao(2)
+        transaction: db.Transaction = db.Transaction("1", 100)
+        with self.assertRaises(AttributeError):
+            transaction.fee = 1
+        self.assertEqual(transaction.with_fee(1).fee, 1)
+        self.assertIsNone(transaction.fee)
+        with self.assertRaises(AttributeError):
+            transaction.__dict__
 
     async def test_create_address_get_encrypted_mnemonic_from_db(self):
         key_bytes = Fernet.generate_key()
@@ -110,7 +148,7 @@ class TestAddressCreate(DBTestCase):
         key_bytes: bytes = Fernet.generate_key()
         addr: str = await self._db.create_new_address(key=key_bytes)
         self.assertIsNotNone(addr)
-        self.assertTrue(bittensor.utils.is_valid_ss58_address(addr, 42)) #bittensor ss58 format
+        self.assertTrue(is_valid_ss58_address(addr, valid_ss58_format=42)) #bittensor ss58 format
 
         # Check if address is in db
         enc_address: Address = self._db.db.addresses.find_one({'address': addr})
@@ -122,12 +160,21 @@ class TestAddressCreate(DBTestCase):
         unenc_mnemonic: str = Address(addr, enc_address['mnemonic'], key_bytes, decrypt=True).mnemonic
         self.assertEqual(unenc_mnemonic, mnemonic)
 
+    async def test_create_address_publishes_event(self):
+        new_users = self._db.events.subscribe(ADDRESS_ASSIGNED)
+        user: str = str(random.randint(0, 1000000))
+        key_bytes: bytes = Fernet.generate_key()
+        await self._db.create_new_address(key=key_bytes, user_id=user)
+        self.assertEqual(new_users.get_nowait(), user)
+        self.assertEqual(await self._db.get_unwelcomed_users([user]), [user])
+        self._db.events.unsubscribe(ADDRESS_ASSIGNED, new_users)
+
 class TestTips(DBTestCase):
     async def test_tip_create(self):
         # Create user with balance
         sender = random.randint(0, 1000000)
         recipient = random.randint(0, 1000000)
-        amount = bittensor.Balance.from_float(random.random() * 1000 + 1.0) # Random float between 1 and 1001
+        amount = Balance.from_float(random.random() * 1000 + 1.0) # Random float between 1 and 1001
 
         tip: Tip = Tip(sender, recipient, amount)
         self.assertEqual(tip.sender, sender)
@@ -144,7 +191,7 @@ class TestTips(DBTestCase):
         self.assertEqual(tip_from_db['sender'], sender)
         self.assertEqual(tip_from_db['recipient'], recipient)
         self.assertEqual(
-            bittensor.Balance.from_rao(tip_from_db['amount']),
+            Balance.from_rao(tip_from_db['amount']),
             amount
         )
         ## Timestamp on mongo loses some precision
@@ -155,8 +202,8 @@ class TestTips(DBTestCase):
         # Create user with balance
         sender = random.randint(0, 1000000)
         recipient = random.randint(0, 1000000)
-        amount: bittensor.Balance = bittensor.Balance.from_float(random.random() * 1000 + 1.0) # Random float between 1 and 1001
-        bal: bittensor.Balance = bittensor.Balance.from_rao(random.randint(0, 100000000000)) + amount
+        amount: Balance = Balance.from_float(random.random() * 1000 + 1.0) # Random float between 1 and 1001
+        bal: Balance = Balance.from_rao(random.randint(0, 100000000000)) + amount
         # Insert user in db
         addr_str: str = await self._db.create_new_address(key, sender)
 
@@ -181,7 +228,7 @@ class TestTips(DBTestCase):
                 await tip.send(self._db, key)
 
                 # Check balance
-                balance_new_expected: bittensor.Balance = bal - amount
+                balance_new_expected: Balance = bal - amount
                 self.assertEqual(await self._db.check_balance(sender), balance_new_expected)    
 
                 # Check if tip is in db
@@ -189,7 +236,7 @@ class TestTips(DBTestCase):
                 self.assertEqual(tip_from_db['sender'], sender)
                 self.assertEqual(tip_from_db['recipient'], recipient)
                 self.assertEqual(
-                    bittensor.Balance.from_rao(tip_from_db['amount']),
+                    Balance.from_rao(tip_from_db['amount']),
                     amount
                 )
                 ## Timestamp on mongo loses some precision
@@ -200,10 +247,10 @@ class TestTips(DBTestCase):
         # Create sender with balance
         sender = random.randint(0, 1000000)
         recipient = sender + 1
-        amount: bittensor.Balance = bittensor.Balance.from_float(random.random() * 1000 + 2)
+        amount: Balance = Balance.from_float(random.random() * 1000 + 2)
         bal: int = amount.rao - random.randint(1, 100)
         bal = bal if bal > 0 else 1 # Ensure balance is positive
-        bal: bittensor.Balance = bittensor.Balance.from_rao(bal)
+        bal: Balance = Balance.from_rao(bal)
 
         # Insert user in db
         addr_str: str = await self._db.create_new_address(key, sender)
@@ -212,7 +259,7 @@ class TestTips(DBTestCase):
         
         # Mock balance check on chain
         with unittest.mock.patch.object(self._api.subtensor, 'get_balance', 
-            side_effect=[bal, bal, bal, bittensor.Balance.from_rao(0)]):
+            side_effect=[bal, bal, bal, Balance.from_rao(0)]):
 
             # Check balance
             self.assertEqual(await self._db.check_balance(sender), bal)
@@ -232,11 +279,11 @@ class TestTips(DBTestCase):
                 # Tip should fail
 
                 # Check balance of sender
-                balance_new_expected_sender: bittensor.Balance = bal # Balance should not change
+                balance_new_expected_sender: Balance = bal # Balance should not change
                 self.assertEqual(await self._db.check_balance(sender), balance_new_expected_sender)
 
                 # Check balance of recipient. Should be unchanged
-                balance_new_expected_rec: bittensor.Balance = bittensor.Balance.from_rao(0) # new balance should still be 0
+                balance_new_expected_rec: Balance = Balance.from_rao(0) # new balance should still be 0
                 self.assertEqual(await self._db.check_balance(recipient), balance_new_expected_rec)    
 
                 # Check if tip is in db
@@ -248,8 +295,8 @@ class TestTips(DBTestCase):
         # Create sender with balance
         sender = random.randint(0, 1000000)
         recipient = sender + 1
-        amount: bittensor.Balance = bittensor.Balance.from_float(random.random() * 1000 + 2)
-        bal: bittensor.Balance = bittensor.Balance.from_rao(0) # No balance
+        amount: Balance = Balance.from_float(random.random() * 1000 + 2)
+        bal: Balance = Balance.from_rao(0) # No balance
 
         # Insert user in db
         addr_str: str = await self._db.create_new_address(key, sender)
@@ -258,7 +305,7 @@ class TestTips(DBTestCase):
         
         # Mock balance check on chain
         with unittest.mock.patch.object(self._api.subtensor, 'get_balance', 
-            side_effect=[bal, bal, bal, bittensor.Balance.from_rao(0)]):
+            side_effect=[bal, bal, bal, Balance.from_rao(0)]):
 
             # Check balance
             self.assertEqual(await self._db.check_balance(sender), bal)
@@ -278,11 +325,11 @@ class TestTips(DBTestCase):
                 # Tip should fail
 
                 # Check balance of sender
-                balance_new_expected_sender: bittensor.Balance = bal # Balance should not change
+                balance_new_expected_sender: Balance = bal # Balance should not change
                 self.assertEqual(await self._db.check_balance(sender), balance_new_expected_sender)
 
                 # Check balance of recipient. Should be unchanged
-                balance_new_expected_rec: bittensor.Balance = bittensor.Balance.from_rao(0) # new balance should still be 0
+                balance_new_expected_rec: Balance = Balance.from_rao(0) # new balance should still be 0
                 self.assertEqual(await self._db.check_balance(recipient), balance_new_expected_rec)    
 
                 # Check if tip is in db
@@ -294,8 +341,8 @@ class TestTips(DBTestCase):
         # Create sender with balance
         sender = random.randint(0, 1000000)
         recipient = random.randint(0, 1000000)
-        amount: bittensor.Balance = bittensor.Balance.from_float(random.random() * 1000 + 2)
-        bal: bittensor.Balance = bittensor.Balance.from_rao(0) # No balance for non-existent sender
+        amount: Balance = Balance.from_float(random.random() * 1000 + 2)
+        bal: Balance = Balance.from_rao(0) # No balance for non-existent sender
 
         # Insert recipient in db, no sender
         
@@ -303,7 +350,7 @@ class TestTips(DBTestCase):
         
         # Mock balance check on chain
         with unittest.mock.patch.object(self._api.subtensor, 'get_balance', 
-            side_effect=[bal, bal, bal, bittensor.Balance.from_rao(0)]):
+            side_effect=[bal, bal, bal, Balance.from_rao(0)]):
 
             # Check balance
             self.assertEqual(await self._db.check_balance(sender), bal)
@@ -323,11 +370,11 @@ class TestTips(DBTestCase):
                 # Tip should fail
 
                 # Check balance of sender
-                balance_new_expected_sender: bittensor.Balance = bal # Balance should not change
+                balance_new_expected_sender: Balance = bal # Balance should not change
                 self.assertEqual(await self._db.check_balance(sender), balance_new_expected_sender)
 
                 # Check balance of recipient. Should be unchanged
-                balance_new_expected_rec: bittensor.Balance = bittensor.Balance.from_rao(0) # new balance should still be 0
+                balance_new_expected_rec: Balance = Balance.from_rao(0) # new balance should still be 0
                 self.assertEqual(await self._db.check_balance(recipient), balance_new_expected_rec)    
 
                 # Check if tip is in db
@@ -339,8 +386,8 @@ class TestTips(DBTestCase):
         # Create user with balance
         sender = random.randint(0, 1000000)
         recipient = random.randint(0, 1000000)
-        amount: bittensor.Balance = bittensor.Balance.from_float(random.random() * 1000 + 1.0) # Random float between 1 and 1001
-        bal: bittensor.Balance = bittensor.Balance.from_rao(random.randint(0, 100000000000)) + amount
+        amount: Balance = Balance.from_float(random.random() * 1000 + 1.0) # Random float between 1 and 1001
+        bal: Balance = Balance.from_rao(random.randint(0, 100000000000)) + amount
         # Insert user in db
         addr_str: str = await self._db.create_new_address(key, sender)
         
@@ -365,7 +412,7 @@ class TestTips(DBTestCase):
                 await tip.send(self._db, key)
 
                 # Check balance
-                balance_new_expected: bittensor.Balance = bal - amount
+                balance_new_expected: Balance = bal - amount
                 self.assertEqual(await self._db.check_balance(sender), balance_new_expected)    
 
                 # Check if tip is in db
@@ -373,8 +420,163 @@ class TestTips(DBTestCase):
                 self.assertEqual(tip_from_db['sender'], sender)
                 self.assertEqual(tip_from_db['recipient'], recipient)
                 self.assertEqual(
-                    bittensor.Balance.from_rao(tip_from_db['amount']),
+                    Balance.from_rao(tip_from_db['amount']),
                     amount
                 )
                 ## Timestamp on mongo loses some precision
                 self.assertAlmostEqual(tip_from_db['time'].timestamp(), tip.time.timestamp(), delta=0.001)
+
+class TestRain(DBTestCase):
+    async def test_rain_split(self):
+        sender = str(random.randint(0, 1000000))
+        recipients = [str(random.randint(0, 1000000)) for _ in range(random.randint(2, 10))]
+        amount: Balance = Balance.from_rao(random.randint(100, 100000000000))
+
+        rain: Rain = Rain(sender, recipients, amount)
+        self.assertEqual([tip.recipient for tip in rain.tips], recipients)
+        # Split evenly, dust stays with the sender
+        for tip in rain.tips:
+            self.assertEqual(tip.amount.rao, amount.rao // len(recipients))
+        self.assertLessEqual(sum(tip.amount.rao for tip in rain.tips), amount.rao)
+
+    async def test_create_new_addresses(self):
+        key: bytes = Fernet.generate_key()
+        users = [str(random.randint(0, 1000000)) for _ in range(random.randint(2, 10))]
+
+        addrs = await self._db.create_new_addresses(key, users)
+        self.assertEqual(set(addrs.keys()), set(users))
+        for user, addr in addrs.items():
+            self.assertEqual(self._db.get_address_by_user(user).address, addr)
+            # Check if mnemonic can be decrypted
+            self.assertIsNotNone(self._db.get_address(addr, key).mnemonic)
+        self.assertEqual(
+            {user: addr.address for user, addr in self._db.get_addresses_by_users(users).items()},
+            addrs
+        )
+
+    async def test_record_tips(self):
+        sender = random.randint(0, 1000000)
+        recipients = [random.randint(0, 1000000) for _ in range(random.randint(2, 10))]
+        amount: Balance = Balance.from_rao(random.randint(100, 100000000000))
+
+        rain: Rain = Rain(sender, recipients, amount)
+        await self._db.record_tips(rain.tips)
+        self.assertEqual(self._db.db.tips.count_documents({'sender': sender}), len(recipients))
+
+class TestBalanceReadModel(DBTestCase):
+    async def test_check_balance_uses_read_model(self):
+        key: bytes = Fernet.generate_key()
+        user = random.randint(0, 1000000)
+        bal: Balance = Balance.from_rao(random.randint(1, 100000000000))
+        await self._db.create_new_address(key, user)
+        # an address from before the read model, with no balance on record
+        self._db.db.balances.delete_many({})
+        self._db.balance_cache.clear()
+
+        with unittest.mock.patch.object(self._api, 'get_current_block', return_value=10):
+            with unittest.mock.patch.object(self._api, 'get_wallet_balance', return_value=bal) as mock_get_balance:
+                self.assertEqual(await self._db.check_balance(user), bal)
+                self.assertEqual(await self._db.check_balance(user), bal)
+                # Only the first check goes to the chain
+                mock_get_balance.assert_called_once()
+
+        record: db.BalanceRecord = self._db.get_cached_balance(user)
+        self.assertEqual(record.block, 10)
+        self.assertEqual(self._db.db.balances.find_one({'user': str(user)})['balance'], bal.rao)
+
+    async def test_get_total_balance(self):
+        balances = [random.randint(1, 100000000000) for _ in range(random.randint(2, 10))]
+        for i, rao in enumerate(balances):
+            self._db.set_balance(f"addr{i}", Balance.from_rao(rao), 1, str(i))
+        self.assertEqual((await self._db.get_total_balance()).rao, sum(balances))
+
+    async def test_update_addr_balance(self):
+        key: bytes = Fernet.generate_key()
+        user = random.randint(0, 1000000)
+        bal: Balance = Balance.from_rao(random.randint(1, 100000000000))
+        addr: str = await self._db.create_new_address(key, user)
+
+        change, user_ = await self._db.update_addr_balance(addr, bal.rao, 5)
+        self.assertEqual(change, bal.rao)
+        self.assertEqual(user_, str(user))
+
+        change, _ = await self._db.update_addr_balance(addr, bal.rao + 100, 6)
+        self.assertEqual(change, 100)
+        self.assertEqual(self._db.get_cached_balance(user).balance.rao, bal.rao + 100)
+
+    async def test_update_addr_balance_first_seen(self):
+        user = random.randint(0, 1000000)
+        bal: Balance = Balance.from_rao(random.randint(1, 100000000000))
+        # an address funded before the read model existed
+        self._db.db.addresses.insert_one({"address": "5Funded", "user": str(user)})
+
+        change, _ = await self._db.update_addr_balance("5Funded", bal.rao, 5)
+        self.assertEqual(change, 0)
+        change, _ = await self._db.update_addr_balance("5Funded", bal.rao + 100, 6)
+        self.assertEqual(change, 100)
+
+    async def test_deposit_read_before_scan(self):
+        user = random.randint(0, 1000000)
+        addr: str = await self._db.create_new_address(Fernet.generate_key(), user)
+        await self._db.update_addr_balance(addr, 1000, 5)
+
+        # a deposit of 500, seen first by a /balance refresh
+        api_ = MagicMock(get_current_block=MagicMock(return_value=6), get_wallet_balance=MagicMock(return_value=Balance.from_rao(1500)))
+        self._db.api, original = api_, self._db.api
+        try:
+            await self._db.refresh_balance(addr, str(user))
+        finally:
+            self._db.api = original
+        self.assertEqual(self._db.get_cached_balance(user).balance.rao, 1500)
+
+        change, _ = await self._db.update_addr_balance(addr, 1500, 7)
+        self.assertEqual(change, 500)
+        change, _ = await self._db.update_addr_balance(addr, 1500, 8)
+        self.assertEqual(change, 0)
+
+    async def test_deposit_read_by_transfer_before_scan(self):
+        sender = random.randint(0, 1000000)
+        sender_addr: str = await self._db.create_new_address(Fernet.generate_key(), sender)
+        recipient = sender + 1
+        recipient_addr: str = await self._db.create_new_address(Fernet.generate_key(), recipient)
+        await self._db.update_addr_balance(sender_addr, 1000, 5)
+        await self._db.update_addr_balance(recipient_addr, 0, 5)
+
+        # a deposit of 500 lands, then the sender tips 100 for a fee of 10
+        self._db.apply_transfer(sender_addr, Balance.from_rao(1390), recipient_addr, Balance.from_rao(100), 7, Balance.from_rao(10))
+        self.assertEqual(self._db.get_cached_balance(sender).balance.rao, 1390)
+
+        change, _ = await self._db.update_addr_balance(sender_addr, 1390, 8)
+        self.assertEqual(change, 500)
+        # the tip isn't a deposit
+        change, _ = await self._db.update_addr_balance(recipient_addr, 100, 8)
+        self.assertEqual(change, 0)
+
+        # a scan that already saw the block of the next transfer isn't moved by it again
+        await self._db.update_addr_balance(sender_addr, 1290, 9)
+        self._db.apply_transfer(sender_addr, Balance.from_rao(1290), recipient_addr, Balance.from_rao(90), 9, Balance.from_rao(10))
+        change, _ = await self._db.update_addr_balance(sender_addr, 1290, 10)
+        self.assertEqual(change, 0)
+
+    async def test_forget_changed_balances(self):
+        changed: asyncio.Queue = self._db.events.subscribe(BALANCE_CHANGED)
+        self._db.set_balance("5Shared", Balance.from_rao(10), 5, "1")
+        self._db.set_balance("5Shared", Balance.from_rao(10), 6, "1")
+        # only changes are relayed
+        self.assertEqual(changed.get_nowait(), "5Shared")
+        self.assertTrue(changed.empty())
+        self._db.events.unsubscribe(BALANCE_CHANGED, changed)
+
+        task = asyncio.ensure_future(self._db.forget_changed_balances())
+        await asyncio.sleep(0)
+        # this instance's own changes keep the cache
+        self._db.events.publish(BALANCE_CHANGED, "5Shared")
+        await asyncio.sleep(0)
+        self.assertIn("5Shared", self._db.balance_cache)
+
+        # another instance changed it
+        self._db.db.balances.update_one({"address": "5Shared"}, {"$set": {"balance": 20}})
+        self._db.events.publish(BALANCE_CHANGED, "5Shared", relayed=True)
+        await asyncio.sleep(0)
+        self.assertEqual(self._db._get_balance_record_by_address("5Shared").balance.rao, 20)
+        task.cancel()
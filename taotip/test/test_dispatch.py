@@ -0,0 +1,74 @@
+import time
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import interactions
+
+from taotip.src.dispatch import DispatchResult, DMDispatcher, RouteRateLimiter, TokenBucket
+
+
+class TestTokenBucket(unittest.IsolatedAsyncioTestCase):
+    async def test_acquire_waits_when_empty(self):
+        bucket: TokenBucket = TokenBucket(2, 0.2)
+        start: float = time.monotonic()
+        for _ in range(3):
+            await bucket.acquire()
+        # The third token refills after 0.1 seconds
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+    async def test_block(self):
+        bucket: TokenBucket = TokenBucket(10, 1.0)
+        bucket.block(0.1)
+        start: float = time.monotonic()
+        await bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+
+class TestDMDispatcher(unittest.IsolatedAsyncioTestCase):
+    def member(self, user: str, error: Exception = None) -> MagicMock:
+        member = MagicMock()
+        member.id = user
+        member.name = f"user{user}"
+        member.send = AsyncMock(side_effect=error)
+        return member
+
+    async def test_dispatch(self):
+        members = {
+            "1": self.member("1"),
+            "2": self.member("2", interactions.LibraryException(50007, "Cannot send messages to this user")),
+            "3": None,
+        }
+
+        async def get(client, obj, object_id, parent_id):
+            return members[str(object_id)]
+
+        dispatcher: DMDispatcher = DMDispatcher(MagicMock(), 123, concurrency=2, limiter=RouteRateLimiter())
+        with patch("taotip.src.dispatch.interactions.get", side_effect=get):
+            result: DispatchResult = await dispatcher.dispatch(["1", "2", "3"], "welcome")
+
+        self.assertEqual(result.sent, ["1"])
+        self.assertEqual([user for user, _ in result.failed], ["2"])
+        self.assertEqual(result.not_found, ["3"])
+        members["1"].send.assert_awaited_once_with("welcome")
+
+    async def test_rate_limited(self):
+        error = interactions.LibraryException(40003, "You are opening direct messages too fast", data={"retry_after": 30.0})
+        member = self.member("1", error)
+
+        async def get(client, obj, object_id, parent_id):
+            return member
+
+        limiter: RouteRateLimiter = RouteRateLimiter()
+        dispatcher: DMDispatcher = DMDispatcher(MagicMock(), 123, limiter=limiter)
+        with patch("taotip.src.dispatch.interactions.get", side_effect=get):
+            result: DispatchResult = await dispatcher.dispatch(["1"], "welcome")
+
+        # not failed, so it is retried later
+        self.assertEqual(result.rate_limited, ["1"])
+        self.assertEqual(result.failed, [])
+        # blocked for as long as Discord asked
+        self.assertGreater(limiter.bucket("POST /users/@me/channels").blocked_until, time.monotonic() + 29)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,102 @@
+import asyncio
+import threading
+import unittest
+from datetime import datetime, timedelta
+
+import mongomock
+
+from taotip.src.events import ADDRESS_ACTIVE, ADDRESS_ASSIGNED, BALANCE_CHANGED, EventBus, EventRelay
+from taotip.src.executor import configure_blocking
+
+
+class TestEventBus(unittest.IsolatedAsyncioTestCase):
+    async def test_publish(self):
+        bus: EventBus = EventBus()
+        first: asyncio.Queue = bus.subscribe(ADDRESS_ASSIGNED)
+        second: asyncio.Queue = bus.subscribe(ADDRESS_ASSIGNED)
+        bus.publish(ADDRESS_ASSIGNED, "123")
+        self.assertEqual(first.get_nowait(), "123")
+        self.assertEqual(second.get_nowait(), "123")
+
+    async def test_publish_no_subscribers(self):
+        bus: EventBus = EventBus()
+        bus.publish(ADDRESS_ASSIGNED, "123")
+
+    async def test_unsubscribe(self):
+        bus: EventBus = EventBus()
+        queue: asyncio.Queue = bus.subscribe(ADDRESS_ASSIGNED)
+        bus.unsubscribe(ADDRESS_ASSIGNED, queue)
+        bus.publish(ADDRESS_ASSIGNED, "123")
+        self.assertTrue(queue.empty())
+
+    async def test_relayed_only(self):
+        bus: EventBus = EventBus()
+        queue: asyncio.Queue = bus.subscribe(BALANCE_CHANGED, local=False)
+        bus.publish(BALANCE_CHANGED, "5Own")
+        bus.publish(BALANCE_CHANGED, "5Other", relayed=True)
+        self.assertEqual(queue.get_nowait(), "5Other")
+        self.assertTrue(queue.empty())
+
+    async def test_publish_from_thread(self):
+        bus: EventBus = EventBus()
+        queue: asyncio.Queue = bus.subscribe(ADDRESS_ASSIGNED)
+        thread = threading.Thread(target=bus.publish, args=(ADDRESS_ASSIGNED, "123"))
+        thread.start()
+        thread.join()
+        self.assertEqual(await asyncio.wait_for(queue.get(), 1.0), "123")
+
+
+class TestEventRelay(unittest.IsolatedAsyncioTestCase):
+    async def test_relay_to_leader(self):
+        db = mongomock.MongoClient().test
+        follower_bus: EventBus = EventBus()
+        leader_bus: EventBus = EventBus()
+        follower: EventRelay = EventRelay(db, follower_bus, "follower", poll_interval=0.01)
+        leader: EventRelay = EventRelay(db, leader_bus, "leader", poll_interval=0.01)
+        tasks = [
+            asyncio.ensure_future(follower.forward()),
+            asyncio.ensure_future(leader.forward()),
+            asyncio.ensure_future(leader.replay(datetime.utcnow() - timedelta(seconds=1))),
+        ]
+        active: asyncio.Queue = leader_bus.subscribe(ADDRESS_ACTIVE)
+        # the forwarders subscribe
+        await asyncio.sleep(0.01)
+
+        follower_bus.publish(ADDRESS_ACTIVE, ("5Addr", "123"))
+        self.assertEqual(await asyncio.wait_for(active.get(), 1.0), ["5Addr", "123"])
+        await asyncio.sleep(0.05)
+        # replayed once, and not forwarded again by the leader
+        self.assertTrue(active.empty())
+        self.assertEqual(db.relayed_events.count_documents({}), 1)
+        for task in tasks:
+            task.cancel()
+
+    async def test_relay_off_the_loop(self):
+        # the relay's Mongo calls run on the blocking pool, like the bot's
+        configure_blocking(2)
+        try:
+            await self.test_relay_to_leader()
+        finally:
+            configure_blocking(0)
+
+    async def test_replay_late_events(self):
+        db = mongomock.MongoClient().test
+        bus: EventBus = EventBus()
+        relay: EventRelay = EventRelay(db, bus, "instance", poll_interval=0.01, skew=5.0)
+        changed: asyncio.Queue = bus.subscribe(BALANCE_CHANGED)
+        now: datetime = datetime.utcnow()
+        db.relayed_events.insert_one({"topic": BALANCE_CHANGED, "payload": "5First", "origin": "other", "time": now})
+        task = asyncio.ensure_future(relay.replay(now - timedelta(seconds=10), (BALANCE_CHANGED,)))
+        self.assertEqual(await asyncio.wait_for(changed.get(), 1.0), "5First")
+
+        # stamped earlier than the event already replayed, by a host whose clock is behind
+        db.relayed_events.insert_one({"topic": BALANCE_CHANGED, "payload": "5Late", "origin": "other", "time": now - timedelta(seconds=2)})
+        self.assertEqual(await asyncio.wait_for(changed.get(), 1.0), "5Late")
+        await asyncio.sleep(0.05)
+        # each replayed once
+        self.assertTrue(changed.empty())
+        task.cancel()
+
+
+if __name__ == '__main__':
+    unittest.main()
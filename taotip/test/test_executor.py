@@ -0,0 +1,82 @@
+import asyncio
+import contextvars
+import threading
+import unittest
+from unittest.mock import AsyncMock, MagicMock
+
+from taotip.src.executor import CommandExecutor, configure_blocking, run_blocking
+
+
+class TestCommandExecutor(unittest.IsolatedAsyncioTestCase):
+    def make_ctx(self) -> MagicMock:
+        return MagicMock(defer=AsyncMock(), send=AsyncMock())
+
+    async def test_defers_before_handler(self):
+        ctx = self.make_ctx()
+        calls = []
+        ctx.defer.side_effect = lambda ephemeral: calls.append("defer")
+
+        async def handler():
+            calls.append("handler")
+
+        await CommandExecutor(4, 1.0).run(ctx, handler, ephemeral=True)
+        self.assertEqual(calls, ["defer", "handler"])
+        ctx.defer.assert_awaited_once_with(ephemeral=True)
+
+    async def test_timeout_does_not_cancel(self):
+        ctx = self.make_ctx()
+        done = asyncio.Event()
+
+        async def handler():
+            await asyncio.sleep(0.2)
+            done.set()
+
+        await CommandExecutor(4, 0.05).run(ctx, handler)
+        # the user is told the command is still running
+        ctx.send.assert_awaited_once()
+        await asyncio.wait_for(done.wait(), 1.0)
+
+    async def test_handler_error(self):
+        ctx = self.make_ctx()
+
+        async def handler():
+            raise Exception("chain unavailable")
+
+        await CommandExecutor(4, 1.0).run(ctx, handler)
+        ctx.send.assert_awaited_once()
+
+    async def test_bounded_concurrency(self):
+        executor: CommandExecutor = CommandExecutor(2, 1.0)
+        running: int = 0
+        peak: int = 0
+
+        async def handler():
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.05)
+            running -= 1
+
+        await asyncio.gather(*[executor.run(self.make_ctx(), handler) for _ in range(6)])
+        self.assertEqual(peak, 2)
+
+
+class TestRunBlocking(unittest.IsolatedAsyncioTestCase):
+    def tearDown(self) -> None:
+        configure_blocking(0)
+
+    async def test_inline_by_default(self):
+        self.assertIs(await run_blocking(threading.current_thread), threading.current_thread())
+
+    async def test_off_the_loop(self):
+        configure_blocking(2)
+        command: contextvars.ContextVar = contextvars.ContextVar("command")
+        command.set("tip")
+        thread, seen = await run_blocking(lambda: (threading.current_thread(), command.get(None)))
+        self.assertIsNot(thread, threading.current_thread())
+        # the call sees the caller's context, e.g. its trace span
+        self.assertEqual(seen, "tip")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import asyncio
+import random
+import unittest
+from datetime import datetime, timedelta
+from typing import List
+
+import mongomock
+
+from taotip.src.jobs import Job, JobQueue, JobWorkerPool
+
+
+class JobsTestCase(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.db = mongomock.MongoClient().test
+        self.queue = JobQueue(self.db, lease_time=60.0)
+
+    def tearDown(self) -> None:
+        self.db.jobs.drop()
+        self.db.job_locks.drop()
+
+
+class TestJobQueue(JobsTestCase):
+    def test_claim_in_order(self):
+        first = self.queue.enqueue("tip", "addr1", {"n": 1})
+        second = self.queue.enqueue("tip", "addr2", {"n": 2})
+
+        job: Job = self.queue.claim()
+        self.assertEqual(job.id, first)
+        self.assertEqual(job.status, "running")
+        self.assertEqual(job.attempts, 1)
+        self.assertEqual(self.queue.claim().id, second)
+        self.assertIsNone(self.queue.claim())
+
+    def test_same_source_serialized(self):
+        first = self.queue.enqueue("tip", "addr1", {"n": 1})
+        second = self.queue.enqueue("withdraw", "addr1", {"n": 2})
+
+        job: Job = self.queue.claim()
+        self.assertEqual(job.id, first)
+        # addr1 is busy until the first job finishes
+        self.assertIsNone(self.queue.claim())
+
+        self.queue.complete(job)
+        self.assertEqual(self.queue.claim().id, second)
+
+    def test_expired_lease_reclaimed(self):
+        self.queue.enqueue("tip", "addr1", {})
+        job: Job = self.queue.claim()
+
+        # the worker died, its leases ran out
+        expired: datetime = datetime.utcnow() - timedelta(seconds=1)
+        self.db.jobs.update_one({"_id": job.id}, {"$set": {"lease_until": expired}})
+        self.db.job_locks.update_one({"_id": "addr1"}, {"$set": {"lease_until": expired}})
+
+        reclaimed: Job = self.queue.claim()
+        self.assertEqual(reclaimed.id, job.id)
+        self.assertEqual(reclaimed.attempts, 2)
+
+    def test_pending_count(self):
+        for i in range(random.randint(1, 10)):
+            self.queue.enqueue("tip", f"addr{i}", {})
+        self.assertEqual(self.queue.pending_count(), self.db.jobs.count_documents({}))
+
+
+class TestJobWorkerPool(JobsTestCase):
+    async def test_run_jobs(self):
+        done: List[int] = []
+
+        async def handler(job: Job) -> None:
+            done.append(job.payload["n"])
+
+        pool = JobWorkerPool(self.queue, {"tip": handler}, num_workers=2, poll_interval=0.01)
+        pool.start(asyncio.get_running_loop())
+        for n in range(5):
+            self.queue.enqueue("tip", f"addr{n % 2}", {"n": n})
+        await asyncio.sleep(0.2)
+        pool.stop()
+
+        self.assertEqual(sorted(done), list(range(5)))
+        self.assertEqual(self.db.jobs.count_documents({"status": "done"}), 5)
+
+    async def test_interrupted_job_not_retried(self):
+        failures: List[str] = []
+
+        async def handler(job: Job) -> None:
+            raise AssertionError("should not run again")
+
+        async def on_failure(job: Job, error: str) -> None:
+            failures.append(error)
+
+        self.queue.enqueue("withdraw", "addr1", {})
+        job: Job = self.queue.claim()
+        self.queue.start(job)
+
+        pool = JobWorkerPool(self.queue, {"withdraw": handler}, on_failure=on_failure)
+        await pool._run(job)
+
+        self.assertEqual(self.db.jobs.find_one({"_id": job.id})["status"], "failed")
+        self.assertEqual(len(failures), 1)
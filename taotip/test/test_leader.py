@@ -0,0 +1,69 @@
+import asyncio
+import unittest
+from datetime import datetime, timedelta
+from typing import List
+
+import mongomock
+
+from taotip.src.leader import LeaderElection
+
+
+class TestLeaderElection(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.db = mongomock.MongoClient().test
+        self.first = LeaderElection(self.db, lease_time=30.0, instance_id="first")
+        self.second = LeaderElection(self.db, lease_time=30.0, instance_id="second")
+
+    def expire(self) -> None:
+        self.db.leases.update_one({"_id": "background"}, {"$set": {"expires": datetime.utcnow() - timedelta(seconds=1)}})
+
+    def test_one_leader(self):
+        self.assertTrue(self.first.try_acquire())
+        self.assertFalse(self.second.try_acquire())
+        # renewed by its holder
+        self.assertTrue(self.first.try_acquire())
+        self.assertTrue(self.first.is_leader)
+        self.assertFalse(self.second.is_leader)
+
+    def test_failover(self):
+        self.first.try_acquire()
+        # the first instance died, its lease ran out
+        self.expire()
+        self.assertTrue(self.second.try_acquire())
+        self.assertFalse(self.first.try_acquire())
+        self.assertFalse(self.first.is_leader)
+
+    def test_release(self):
+        self.first.try_acquire()
+        self.first.release()
+        self.assertFalse(self.first.is_leader)
+        self.assertTrue(self.second.try_acquire())
+
+    async def test_run_tasks_on_leader(self):
+        started: List[str] = []
+
+        async def task(name: str):
+            started.append(name)
+            await asyncio.Event().wait()
+
+        self.first = LeaderElection(self.db, lease_time=0.3, instance_id="first", margin=0.05)
+        self.first.add("task", lambda: task("first"))
+        self.second.add("task", lambda: task("second"))
+        first: asyncio.Task = asyncio.ensure_future(self.first.run())
+        await asyncio.sleep(0.05)
+        second: asyncio.Task = asyncio.ensure_future(self.second.run())
+        await asyncio.sleep(0.05)
+        self.assertEqual(started, ["first"])
+
+        # the leader dies, the other instance takes over as soon as the lease runs out
+        first.cancel()
+        self.first._stop()
+        await asyncio.sleep(0.4)
+        self.assertEqual(started, ["first", "second"])
+        self.assertEqual(self.db.leases.find_one({"_id": "background"})["holder"], "second")
+        second.cancel()
+        self.second._stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import random
+import unittest
+
+from taotip.src.balance import Balance
+from taotip.src.ledger import Reservation, ReservationLedger
+
+
+class TestReservationLedger(unittest.TestCase):
+    def setUp(self) -> None:
+        self.ledger = ReservationLedger()
+
+    def test_reserve(self):
+        user: str = str(random.randint(0, 1000000))
+        amount: Balance = Balance.from_rao(random.randint(1, 1000000))
+        fee: Balance = Balance.from_rao(100)
+        balance: Balance = amount + fee
+
+        reservation: Reservation = self.ledger.reserve(user, amount, fee, balance)
+        self.assertIsNotNone(reservation)
+        self.assertEqual(self.ledger.reserved(user), amount + fee)
+        self.assertEqual(self.ledger.available(user, balance), Balance.from_rao(0))
+
+    def test_reserve_double_spend(self):
+        user: str = str(random.randint(0, 1000000))
+        amount: Balance = Balance.from_rao(random.randint(1, 1000000))
+        fee: Balance = Balance.from_rao(100)
+        # Enough for one tip, not two
+        balance: Balance = amount + amount
+
+        self.assertIsNotNone(self.ledger.reserve(user, amount, fee, balance))
+        self.assertIsNone(self.ledger.reserve(user, amount, fee, balance))
+
+    def test_release(self):
+        user: str = str(random.randint(0, 1000000))
+        amount: Balance = Balance.from_rao(random.randint(1, 1000000))
+        fee: Balance = Balance.from_rao(100)
+        balance: Balance = amount + fee
+
+        reservation: Reservation = self.ledger.reserve(user, amount, fee, balance)
+        self.ledger.release(reservation)
+        self.assertEqual(reservation.state, "released")
+        self.assertEqual(self.ledger.reserved(user), Balance.from_rao(0))
+        # Funds can be reserved again
+        self.assertIsNotNone(self.ledger.reserve(user, amount, fee, balance))
+
+    def test_commit_twice(self):
+        user: str = str(random.randint(0, 1000000))
+        amount: Balance = Balance.from_rao(random.randint(1, 1000000))
+        fee: Balance = Balance.from_rao(100)
+        balance: Balance = (amount + fee) + (amount + fee)
+
+        first: Reservation = self.ledger.reserve(user, amount, fee, balance)
+        second: Reservation = self.ledger.reserve(user, amount, fee, balance)
+        self.ledger.commit(first)
+        self.ledger.commit(first) # no-op
+        self.ledger.release(first) # already resolved, no-op
+        self.assertEqual(first.state, "committed")
+        self.assertEqual(self.ledger.reserved(user), second.total)
+        self.assertEqual(self.ledger.reserved(user, exclude=second), Balance.from_rao(0))
@@ -0,0 +1,31 @@
+import contextlib
+import io
+import unittest
+from types import SimpleNamespace
+
+from taotip.bench.load import parse_mix, run_load
+
+
+class TestLoad(unittest.IsolatedAsyncioTestCase):
+    async def test_smoke(self):
+        options: SimpleNamespace = SimpleNamespace(
+            rates=[10.0], duration=0.5, mix=parse_mix("tip=1,balance=1,withdraw=1,deposit=1"), users=20,
+            rpc_latency=0.0, mongo_latency=0.001, mongo_uri=None, max_concurrent=4, executor=True,
+            poisson=False, stop_above=50.0, seed=0, verbose=True,
+        )
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(io.StringIO()):
+            results = await run_load(options)
+
+        self.assertEqual(len(results), 1)
+        result = results[0]
+        self.assertEqual(result["commands"], 5)
+        self.assertEqual(result["errors"], 0)
+        self.assertEqual(result["deadline_missed"], 0)
+        # handlers report their own failures
+        self.assertNotIn("executor.run", output.getvalue())
+
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix("tip=0.5,balance=0.5"), {"tip": 0.5, "balance": 0.5})
+        with self.assertRaises(ValueError):
+            parse_mix("rain=1")
@@ -4,12 +4,12 @@ import unittest
 from types import SimpleNamespace
 from unittest.mock import AsyncMock, MagicMock, call, patch
 
-import bittensor
 import interactions
 from callee import Contains
 from cryptography.fernet import Fernet
 
 from taotip.src import config, db
+from taotip.src.balance import Balance
 from taotip.src import event_handlers as main
 from taotip.test.test_db import DBTestCase
 
@@ -28,6 +28,8 @@ mock_config_: SimpleNamespace = SimpleNamespace(
     SUBTENSOR_ENDPOINT="fakeSubtensorAddr",
     TESTING=True,
     NUM_DEPOSIT_ADDRESSES=10,
+    BALANCE_REFRESH_INTERVAL=60.0, # seconds
+    SHOW_BALANCE_STALENESS=True,
     HELP_STR="To get your balance, type: `!balance` or `!bal`\n" + \
             "To deposit tao, type: `!deposit <amount>`\n" + \
             "To withdraw your tao, type: `!withdraw <address> <amount>`\n" + \
@@ -43,7 +45,7 @@ class TestMain(DBTestCase):
         self.mock_config = config.Config(mock_config_)
 
     async def test_do_balance_check(self):
-        bal: bittensor.Balance = bittensor.Balance.from_rao(random.randint(1, 10000000))
+        bal: Balance = Balance.from_rao(random.randint(1, 10000000))
         user: int = random.randint(1, 10000000)
         bot_id: str = str(user + 1) # not the same as user
 
@@ -78,7 +80,33 @@ class TestMain(DBTestCase):
 
         with patch.object(self._db, 'check_balance', return_value=bal) as mock_check_balance:
             await main.do_balance_check(self.mock_config, self._db, mock_ctx, mock_user)
-            mock_check_balance.assert_called_once_with(user)
+            mock_check_balance.assert_called_once_with(user, refresh=False, rctx=unittest.mock.ANY)
+
+    async def test_do_balance_check_refresh_rate_limited(self):
+        bal: Balance = Balance.from_rao(random.randint(1, 10000000))
+        user: int = random.randint(1, 10000000)
+
+        mock_user = MagicMock(
+            spec=interactions.User,
+            id=user,
+            bot=False,
+        )
+
+        mock_send = AsyncMock(
+            return_value=None
+        )
+
+        mock_ctx = MagicMock(
+            spec=interactions.CommandContext,
+            send=mock_send,
+        )
+
+        with patch.object(self._db, 'can_refresh_balance', return_value=False):
+            with patch.object(self._db, 'check_balance', return_value=bal) as mock_check_balance:
+                await main.do_balance_check(self.mock_config, self._db, mock_ctx, mock_user, refresh=True)
+                # refresh is denied, answered from the read model
+                mock_check_balance.assert_called_once_with(user, refresh=False, rctx=unittest.mock.ANY)
+                mock_send.assert_awaited_once_with(Contains(f'Your balance is {bal.tao} tao'), ephemeral=True)
 
     async def test_do_deposit(self):
         user_id: int = random.randint(1, 10000000)
@@ -131,7 +159,7 @@ class TestMain(DBTestCase):
         bot_id: str = str(user_id + 1) # not the same as user
 
         withd_addr = self._api.create_address(self.mock_config.COLDKEY_SECRET)
-        amount: bittensor.Balance = bittensor.Balance.from_rao(random.randint(1, 10000000))
+        amount: Balance = Balance.from_rao(random.randint(1, 10000000))
 
         mock_send = AsyncMock(
             return_value=None
@@ -159,19 +187,38 @@ class TestMain(DBTestCase):
         )
 
         mock_config = copy.deepcopy(self.mock_config)
-        mock_new_balance = bittensor.Balance.from_rao(random.randint(1, 2) * amount.rao) - amount
+        mock_new_balance = Balance.from_rao(random.randint(1, 2) * amount.rao) - amount
 
-        with patch.object(db.Transaction, 'withdraw', return_value=mock_new_balance.tao) as mock_withdraw:
+        with patch.object(db.Transaction, 'withdraw', return_value=mock_new_balance) as mock_withdraw:
             await main.do_withdraw(mock_config, self._db, mock_ctx, mock_user, withd_addr.address, amount)
 
-            mock_withdraw.assert_called_once_with(self._db, withd_addr.address, mock_config.COLDKEY_SECRET)
+            mock_withdraw.assert_called_once_with(self._db, withd_addr.address, mock_config.COLDKEY_SECRET, unittest.mock.ANY)
             mock_send.assert_awaited_once_with(Contains(f'Your new balance is: {mock_new_balance.tao} tao'), ephemeral=True)
 
+    async def test_do_withdraw_queued_invalid_address(self):
+        user: str = str(random.randint(1, 10000000))
+        mock_send = AsyncMock(return_value=None)
+        mock_ctx = MagicMock(
+            spec=interactions.CommandContext,
+            channel=MagicMock(spec=interactions.Channel, type=interactions.ChannelType.DM),
+            send=mock_send,
+        )
+        jobs = self._db.jobs = MagicMock()
+        try:
+            with patch.object(self._api, 'verify_coldkeyadd', return_value=False):
+                await main.do_withdraw(self.mock_config, self._db, mock_ctx, MagicMock(spec=interactions.User, id=user), "not-an-address", Balance.from_tao(1))
+        finally:
+            self._db.jobs = None
+
+        # rejected on the spot, not queued
+        jobs.enqueue.assert_not_called()
+        mock_send.assert_awaited_once_with(Contains('withdraw coldkeyadd invalid'), ephemeral=unittest.mock.ANY)
+
     async def test_tip_user(self):
         user: int = random.randint(1, 10000000)
         bot_id: int = user + 1 # not the same as user
         recipient: int = user + 2 # not the same as user or bot_id
-        amount: bittensor.Balance = bittensor.Balance.from_rao(random.randint(1, 10000000))
+        amount: Balance = Balance.from_rao(random.randint(1, 10000000))
 
         mock_send = AsyncMock(
             return_value=None
@@ -0,0 +1,54 @@
+import asyncio
+import unittest
+from typing import List
+
+from taotip.src.memory import MemoryMonitor, rss_bytes
+
+
+class Leak:
+    pass
+
+
+leaked: List[Leak] = []
+
+
+def leak(n: int) -> None:
+    leaked.extend(Leak() for _ in range(n))
+
+
+class TestMemoryMonitor(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self) -> None:
+        # room for whatever else the rest of the suite allocated meanwhile
+        self.monitor: MemoryMonitor = MemoryMonitor(interval=3600.0, top=50)
+        self.monitor.start(asyncio.get_running_loop())
+        # the first snapshot is taken when started
+        await asyncio.sleep(0.5)
+
+    async def asyncTearDown(self) -> None:
+        self.monitor.stop()
+        leaked.clear()
+
+    async def test_growth(self):
+        self.assertEqual(self.monitor.snapshots, 1)
+        self.assertEqual(self.monitor.growing_sites(), [])
+
+        leak(20000)
+        await self.monitor.snapshot()
+
+        sites = self.monitor.growing_sites()
+        self.assertTrue(any("test_memory.py" in self.monitor.site(site) for site in sites))
+        self.assertIn(("Leak", 20000, 20000), self.monitor.growing_types())
+        self.assertIn(("Leak",), self.monitor.type_samples())
+        self.assertEqual(self.monitor.type_samples()[("Tip",)], 0)
+
+        report: str = self.monitor.report()
+        self.assertIn("test_memory.py", report)
+        self.assertIn("Leak 20000 (+20000)", report)
+
+        # nothing grew since the previous snapshot
+        await self.monitor.snapshot()
+        self.assertNotIn("Leak", [name for name, _, _ in self.monitor.growing_types("previous")])
+        self.assertIn(("Leak", 20000, 20000), self.monitor.growing_types())
+
+    def test_rss(self):
+        self.assertGreater(rss_bytes(), 0)
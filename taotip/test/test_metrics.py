@@ -0,0 +1,98 @@
+import unittest
+import urllib.request
+from types import SimpleNamespace
+
+from taotip.src.metrics import Gauge, Histogram, MetricsServer, PoolListener, Registry, timed
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram_render(self):
+        registry: Registry = Registry()
+        histogram: Histogram = registry.histogram("test_seconds", "Test", ["op"], buckets=(0.1, 1.0))
+        histogram.observe(0.05, "a")
+        histogram.observe(0.5, "a")
+        histogram.observe(5.0, "a")
+
+        text: str = registry.render()
+        self.assertIn('test_seconds_bucket{op="a",le="0.1"} 1', text)
+        self.assertIn('test_seconds_bucket{op="a",le="1.0"} 2', text)
+        self.assertIn('test_seconds_bucket{op="a",le="+Inf"} 3', text)
+        self.assertIn('test_seconds_count{op="a"} 3', text)
+        self.assertIn('test_seconds_sum{op="a"} 5.55', text)
+
+    def test_duplicate_name(self):
+        registry: Registry = Registry()
+        registry.gauge("test", "Test")
+        with self.assertRaises(ValueError):
+            registry.gauge("test", "Test")
+
+    def test_gauge_function(self):
+        registry: Registry = Registry()
+        gauge: Gauge = registry.gauge("test_ratio", "Test", ["cache"])
+        gauge.set_function(lambda: 0.5, "a")
+        gauge.set_function(lambda: None, "b") # no lookups yet
+        gauge.set_function(lambda: 1 / 0, "c") # a failing function doesn't break the scrape
+        gauge.set(3, "d")
+
+        text: str = registry.render()
+        self.assertIn('test_ratio{cache="a"} 0.5', text)
+        self.assertNotIn('cache="b"', text)
+        self.assertNotIn('cache="c"', text)
+        self.assertIn('test_ratio{cache="d"} 3.0', text)
+
+    def test_timed(self):
+        histogram: Histogram = Histogram("test_seconds", "Test", ["op"])
+
+        @timed(histogram)
+        def op():
+            return 1
+
+        @timed(histogram, "failing")
+        def failing():
+            raise ValueError()
+
+        self.assertEqual(op(), 1)
+        with self.assertRaises(ValueError):
+            failing()
+        self.assertEqual(histogram.count("op"), 1)
+        self.assertEqual(histogram.count("failing"), 1)
+
+    def test_pool_listener(self):
+        listener: PoolListener = PoolListener()
+        event = SimpleNamespace(address=("localhost", 27017))
+        listener.connection_created(event)
+        listener.connection_created(event)
+        listener.connection_checked_out(event)
+        listener.connection_checked_out(event)
+        listener.connection_checked_in(event)
+        self.assertEqual(listener.samples(), {
+            ("localhost:27017", "open"): 2,
+            ("localhost:27017", "checked_out"): 1,
+        })
+        listener.pool_closed(event)
+        self.assertEqual(listener.samples(), {})
+
+    def test_server(self):
+        registry: Registry = Registry()
+        registry.gauge("test_block", "Test").set(42)
+        server: MetricsServer = MetricsServer(registry, port=0)
+        server.start()
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{server.port}/metrics", timeout=5) as response:
+                self.assertEqual(response.status, 200)
+                self.assertIn("test_block 42.0", response.read().decode())
+        finally:
+            server.stop()
+
+
+class TestTimedAsync(unittest.IsolatedAsyncioTestCase):
+    async def test_timed(self):
+        histogram: Histogram = Histogram("test_seconds", "Test", ["op"])
+
+        @timed(histogram, "command")
+        async def command(ctx, amount: float):
+            return amount
+
+        self.assertEqual(await command(None, 1.0), 1.0)
+        self.assertEqual(histogram.count("command"), 1)
+        self.assertEqual(command.__name__, "command")
@@ -0,0 +1,92 @@
+import asyncio
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from taotip.src import polling
+from taotip.src.db import Transaction
+from taotip.src.polling import DepositPoller, PollSchedule
+
+
+class TestPollSchedule(unittest.TestCase):
+    def setUp(self) -> None:
+        self.now: float = 1000.0
+        patcher = patch.object(polling.time, "monotonic", lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.schedule: PollSchedule = PollSchedule(10.0, 80.0, 30.0)
+
+    def test_new_addresses_spread_out(self):
+        for i in range(100):
+            self.schedule.add(f"5Addr{i}", str(i))
+        dues = [state.due for state in self.schedule.addresses.values()]
+        self.assertTrue(all(self.now <= due <= self.now + 80.0 for due in dues))
+        self.assertLess(len(self.schedule.pop_due(now=self.now + 40.0)), 100)
+        self.assertAlmostEqual(self.schedule.rate, 100 / 80.0)
+
+    def test_activate_then_back_off(self):
+        self.schedule.add("5Addr", "1")
+        self.schedule.activate("5Addr")
+        self.assertEqual(self.schedule.pop_due(), [("5Addr", "1")])
+
+        intervals = []
+        for _ in range(8):
+            self.schedule.polled("5Addr", False)
+            intervals.append(self.schedule.addresses["5Addr"].interval)
+            self.now += intervals[-1]
+        # every min_interval while active, then doubling up to the cap
+        self.assertEqual(intervals, [10.0, 10.0, 10.0, 20.0, 40.0, 80.0, 80.0, 80.0])
+        self.assertAlmostEqual(self.schedule.rate, 1 / 80.0)
+
+        # a change makes it active again
+        self.schedule.polled("5Addr", True)
+        self.assertEqual(self.schedule.addresses["5Addr"].interval, 10.0)
+
+    def test_activate_unknown(self):
+        self.schedule.activate("5Unassigned")
+        self.assertEqual(len(self.schedule), 0)
+        self.schedule.activate("5New", "2")
+        self.assertEqual(self.schedule.pop_due(), [("5New", "2")])
+
+    def test_pop_due(self):
+        for i in range(5):
+            self.schedule.add(f"5Addr{i}", str(i))
+            self.schedule.activate(f"5Addr{i}")
+        # rescheduled entries are only popped once
+        self.schedule.activate("5Addr0")
+        self.assertEqual(len(self.schedule.pop_due(limit=3)), 3)
+        self.assertEqual(len(self.schedule.pop_due()), 2)
+        self.assertEqual(self.schedule.pop_due(), [])
+        self.assertIsNone(self.schedule.next_due())
+
+
+class TestDepositPoller(unittest.TestCase):
+    def test_poll(self):
+        _db = MagicMock()
+        _db.get_all_addresses = AsyncMock(return_value=[
+            {"address": "5Addr1", "user": "1"},
+            {"address": "5Addr2", "user": "2"},
+            {"address": "5Pool", "user": None},
+        ])
+        _api = MagicMock()
+        _api.check_for_deposits = AsyncMock(return_value=[Transaction("2", 5)])
+        schedule: PollSchedule = PollSchedule(10.0, 80.0, 30.0)
+        on_first_pass = AsyncMock()
+        poller: DepositPoller = DepositPoller(_db, _api, schedule, max_batch=1, on_first_pass=on_first_pass)
+
+        asyncio.run(poller.load())
+        self.assertEqual(len(schedule), 2)
+        schedule.activate("5Addr1")
+        schedule.activate("5Addr2")
+
+        asyncio.run(poller.poll())
+        _api.check_for_deposits.assert_awaited_once_with(_db, [{"address": "5Addr1", "user": "1"}])
+        on_first_pass.assert_not_awaited()
+        asyncio.run(poller.poll())
+        self.assertEqual(_api.check_for_deposits.await_args.args[1], [{"address": "5Addr2", "user": "2"}])
+        # every address has been read once
+        on_first_pass.assert_awaited_once()
+        # nothing due until min_interval has passed
+        self.assertEqual(asyncio.run(poller.poll()), [])
+        self.assertEqual(_api.check_for_deposits.await_count, 2)
+        asyncio.run(poller.load())
+        on_first_pass.assert_awaited_once()
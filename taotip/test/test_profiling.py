@@ -0,0 +1,79 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+from typing import List, Optional, Tuple
+
+from taotip.src.profiling import CommandProfiler, ProfileSession
+
+
+def hot_function() -> None:
+    time.sleep(0.05)
+
+
+class TestCommandProfiler(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.directory = tempfile.TemporaryDirectory()
+        self.profiler = CommandProfiler(self.directory.name, top=10, interval=0.002)
+        self.reports: List[Tuple[ProfileSession, str, Optional[str]]] = []
+
+        async def on_report(session: ProfileSession, report: str, path: Optional[str]) -> None:
+            self.reports.append((session, report, path))
+        self.profiler.on_report = on_report
+
+        @self.profiler.profiled("balance")
+        async def balance() -> str:
+            hot_function()
+            return "balance"
+        self.balance = balance
+
+    def tearDown(self) -> None:
+        self.directory.cleanup()
+
+    async def test_not_armed(self):
+        self.assertEqual(await self.balance(), "balance")
+        self.assertIsNone(self.profiler.session)
+        self.assertEqual(self.reports, [])
+
+    async def _profile(self, mode: str) -> str:
+        self.profiler.arm("balance", mode, invocations=2)
+        for _ in range(3):
+            self.assertEqual(await self.balance(), "balance")
+        await asyncio.sleep(0)
+
+        self.assertIsNone(self.profiler.session)
+        self.assertEqual(len(self.reports), 1)
+        session, report, path = self.reports[0]
+        self.assertEqual(session.invocations, 2)
+        with open(path) as f:
+            self.assertEqual(f.read(), report)
+        return report
+
+    async def test_sample(self):
+        report: str = await self._profile("sample")
+        self.assertIn("hot_function", report)
+
+    async def test_deterministic(self):
+        report: str = await self._profile("deterministic")
+        self.assertIn("hot_function", report)
+
+    async def test_window(self):
+        self.profiler.arm("balance", seconds=0.05)
+        await self.balance()
+        await asyncio.sleep(0.1)
+        self.assertIsNone(self.profiler.session)
+        self.assertEqual(self.reports[0][0].invocations, 1)
+
+    async def test_arm(self):
+        with self.assertRaises(ValueError):
+            self.profiler.arm("balance")
+        with self.assertRaises(ValueError):
+            self.profiler.arm("balance", "tracing", invocations=1)
+        self.profiler.arm("balance", invocations=1)
+        with self.assertRaises(ValueError):
+            self.profiler.arm("withdraw", invocations=1)
+
+        self.assertEqual(self.profiler.cancel().invocations, 0)
+        self.assertIsNone(self.profiler.session)
+        self.assertIsNone(self.profiler.cancel())
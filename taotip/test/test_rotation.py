@@ -0,0 +1,76 @@
+import unittest
+from unittest.mock import patch
+
+import mongomock
+from cryptography.fernet import Fernet
+
+from taotip.src import rotation
+from taotip.src.db import Address, cipher, key_version
+from taotip.src.rotation import KeyRotation
+
+from .test_backup import InlineExecutor
+
+
+class TestKeys(unittest.TestCase):
+    def test_multiple_keys(self):
+        old: bytes = Fernet.generate_key()
+        new: bytes = Fernet.generate_key()
+        encrypted: bytes = Address("5Old", "old words", old).get_encrypted_mnemonic()
+
+        # decrypts with any key, encrypts with the first
+        self.assertEqual(Address.encrypted("5Old", encrypted, [new, old]).mnemonic, "old words")
+        reencrypted: bytes = Address("5New", "new words", [new, old]).get_encrypted_mnemonic()
+        self.assertEqual(Address.encrypted("5New", reencrypted, new).mnemonic, "new words")
+        self.assertIs(cipher([new, old]), cipher((new, old)))
+
+        self.assertEqual(key_version([new, old]), key_version(new))
+        self.assertNotEqual(key_version(new), key_version(old))
+
+
+class TestKeyRotation(unittest.TestCase):
+    def setUp(self) -> None:
+        self.old: bytes = Fernet.generate_key()
+        self.new: bytes = Fernet.generate_key()
+        self.db = mongomock.MongoClient().test
+        self.db.addresses.insert_many([
+            {"address": f"5Addr{i}", "mnemonic": Address(f"5Addr{i}", f"words {i}", self.old).get_encrypted_mnemonic(), "user": str(i)}
+            for i in range(25)
+        ])
+
+    def mnemonics(self, key: bytes):
+        return [Address.encrypted(doc["address"], doc["mnemonic"], key).mnemonic for doc in self.db.addresses.find().sort("_id", 1)]
+
+    def test_rotate(self):
+        with patch.object(rotation, "ProcessPoolExecutor", InlineExecutor):
+            count: int = KeyRotation(self.db, [self.new, self.old], batch_size=10, max_rate=10 ** 6).run()
+
+        self.assertEqual(count, 25)
+        self.assertEqual(self.mnemonics(self.new), [f"words {i}" for i in range(25)])
+        self.assertEqual(self.db.addresses.count_documents({"key_version": key_version(self.new)}), 25)
+
+    def test_resume(self):
+        write = KeyRotation._write
+        writes = []
+
+        def interrupted(self, rotated):
+            writes.append(len(rotated))
+            if len(writes) == 2:
+                raise KeyboardInterrupt()
+            return write(self, rotated)
+
+        with patch.object(rotation, "ProcessPoolExecutor", InlineExecutor):
+            with patch.object(KeyRotation, "_write", interrupted), self.assertRaises(KeyboardInterrupt):
+                KeyRotation(self.db, [self.new, self.old], batch_size=10, max_rate=10 ** 6).run()
+            self.assertEqual(KeyRotation(self.db, [self.new, self.old]).remaining(), 15)
+
+            count: int = KeyRotation(self.db, [self.new, self.old], batch_size=10, max_rate=10 ** 6).run()
+        self.assertEqual(count, 25)
+        self.assertEqual(self.mnemonics(self.new), [f"words {i}" for i in range(25)])
+
+    def test_throttle(self):
+        rotation_: KeyRotation = KeyRotation(self.db, [self.new, self.old], batch_size=10, max_rate=1000.0, max_write_latency=0.1)
+        with patch.object(rotation.time, "sleep"):
+            rotation_._throttle(10, 0.5, rotation.time.monotonic())
+            self.assertEqual(rotation_.rate, 500.0)
+            rotation_._throttle(10, 0.01, rotation.time.monotonic())
+            self.assertAlmostEqual(rotation_.rate, 550.0)
@@ -0,0 +1,62 @@
+import threading
+import unittest
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from taotip.src.startup import Readiness, connect_with_retry
+from taotip.src.subtensor import Subtensor
+
+
+class TestConnectWithRetry(unittest.IsolatedAsyncioTestCase):
+    async def test_retries_until_connected(self):
+        connect = MagicMock(side_effect=[Exception("refused"), Exception("refused"), "connected"])
+        with patch("taotip.src.startup.asyncio.sleep", new_callable=AsyncMock) as mock_sleep:
+            result = await connect_with_retry("test", connect, attempts=5, base_delay=1.0)
+        self.assertEqual(result, "connected")
+        self.assertEqual(connect.call_count, 3)
+        # exponential backoff
+        self.assertEqual([call.args[0] for call in mock_sleep.await_args_list], [1.0, 2.0])
+
+    async def test_gives_up(self):
+        connect = MagicMock(side_effect=Exception("refused"))
+        with patch("taotip.src.startup.asyncio.sleep", new_callable=AsyncMock):
+            with self.assertRaises(Exception):
+                await connect_with_retry("test", connect, attempts=3)
+        self.assertEqual(connect.call_count, 3)
+
+
+class TestSubtensorConnections(unittest.TestCase):
+    def test_per_thread(self):
+        with patch.object(Subtensor, "_connect", side_effect=lambda: MagicMock()) as mock_connect:
+            subtensor: Subtensor = Subtensor("local")
+            # nothing is opened until a thread uses it
+            mock_connect.assert_not_called()
+
+            self.assertTrue(subtensor.connect())
+            mine = subtensor.substrate
+            mine.get_block_number.assert_called_once()
+            other = []
+            thread = threading.Thread(target=lambda: other.append(subtensor.substrate))
+            thread.start()
+            thread.join()
+            self.assertIsNot(other[0], mine)
+
+            subtensor.close()
+            mine.close.assert_called_once()
+            self.assertEqual(mock_connect.call_count, 2)
+
+
+class TestReadiness(unittest.IsolatedAsyncioTestCase):
+    async def test_check(self):
+        readiness: Readiness = Readiness()
+        ctx = MagicMock(send=AsyncMock())
+        self.assertFalse(await readiness.check(ctx))
+        ctx.send.assert_awaited_once()
+
+        readiness.set()
+        ctx.send.reset_mock()
+        self.assertTrue(await readiness.check(ctx))
+        ctx.send.assert_not_awaited()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,126 @@
+import asyncio
+import json
+import os
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+from typing import Dict, List
+
+from taotip.src.metrics import Histogram, timed
+from taotip.src.tracing import MongoCommandListener, Tracer, tracer
+
+
+class TestTracer(unittest.IsolatedAsyncioTestCase):
+    def setUp(self) -> None:
+        self.dir = tempfile.TemporaryDirectory()
+        self.path: str = os.path.join(self.dir.name, "traces.jsonl")
+
+    def tearDown(self) -> None:
+        tracer.enabled = False
+        self.dir.cleanup()
+
+    def read_traces(self) -> List[Dict]:
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path) as f:
+            return [json.loads(line) for line in f]
+
+    def test_not_configured(self):
+        _tracer: Tracer = Tracer()
+        with _tracer.span("command", root=True) as span:
+            self.assertIsNone(span)
+
+    def test_child_outside_trace(self):
+        _tracer: Tracer = Tracer()
+        _tracer.configure(self.path, sample_rate=1.0)
+        with _tracer.span("db.transfer") as span:
+            self.assertIsNone(span)
+        self.assertEqual(self.read_traces(), [])
+
+    def test_head_sampled(self):
+        _tracer: Tracer = Tracer()
+        _tracer.configure(self.path, sample_rate=1.0, slow_threshold=60.0)
+        with _tracer.span("command.tip", root=True):
+            with _tracer.span("db.transfer"):
+                with _tracer.span("rpc.get_fee"):
+                    pass
+
+        traces: List[Dict] = self.read_traces()
+        self.assertEqual(len(traces), 1)
+        self.assertEqual(traces[0]["name"], "command.tip")
+        self.assertEqual(traces[0]["sampled"], "head")
+        spans: Dict[str, Dict] = {span["name"]: span for span in traces[0]["spans"]}
+        self.assertIsNone(spans["command.tip"]["parent"])
+        self.assertEqual(spans["db.transfer"]["parent"], spans["command.tip"]["id"])
+        self.assertEqual(spans["rpc.get_fee"]["parent"], spans["db.transfer"]["id"])
+
+    def test_tail_sampled(self):
+        _tracer: Tracer = Tracer()
+        _tracer.configure(self.path, sample_rate=0.0, slow_threshold=0.05)
+        with _tracer.span("command.fast", root=True):
+            pass
+        with _tracer.span("command.slow", root=True):
+            with _tracer.span("db.transfer"):
+                pass
+            time.sleep(0.06)
+
+        traces: List[Dict] = self.read_traces()
+        self.assertEqual([trace["name"] for trace in traces], ["command.slow"])
+        self.assertEqual(traces[0]["sampled"], "slow")
+
+    def test_error_sampled(self):
+        _tracer: Tracer = Tracer()
+        _tracer.configure(self.path, sample_rate=0.0, slow_threshold=60.0)
+        with self.assertRaises(ValueError):
+            with _tracer.span("command.tip", root=True):
+                with _tracer.span("db.transfer"):
+                    raise ValueError()
+
+        traces: List[Dict] = self.read_traces()
+        self.assertEqual(traces[0]["sampled"], "error")
+        self.assertEqual({span["error"] for span in traces[0]["spans"]}, {"ValueError"})
+
+    async def test_task_outlives_root(self):
+        _tracer: Tracer = Tracer()
+        _tracer.configure(self.path, sample_rate=1.0)
+        release: asyncio.Event = asyncio.Event()
+
+        async def handler():
+            with _tracer.span("executor.handler"):
+                await release.wait()
+                with _tracer.span("db.transfer"):
+                    pass
+
+        with _tracer.span("command.tip", root=True):
+            task: asyncio.Task = asyncio.ensure_future(handler())
+            await asyncio.sleep(0)
+        # the root ended but the handler is still running
+        self.assertEqual(self.read_traces(), [])
+
+        release.set()
+        await task
+        traces: List[Dict] = self.read_traces()
+        self.assertEqual(len(traces), 1)
+        self.assertEqual({span["name"] for span in traces[0]["spans"]}, {"command.tip", "executor.handler", "db.transfer"})
+
+    async def test_timed_root(self):
+        tracer.configure(self.path, sample_rate=1.0)
+        commands: Histogram = Histogram("taotip_command_seconds", "Test", ["command"])
+        operations: Histogram = Histogram("taotip_db_seconds", "Test", ["operation"])
+
+        @timed(operations)
+        def get_address_by_user(user: str):
+            # what pymongo calls for the find
+            listener.started(SimpleNamespace(request_id=1))
+            listener.succeeded(SimpleNamespace(request_id=1, command_name="find"))
+
+        @timed(commands, "balance", root=True)
+        async def balance(ctx):
+            get_address_by_user("user")
+
+        listener: MongoCommandListener = MongoCommandListener()
+        await balance(None)
+
+        traces: List[Dict] = self.read_traces()
+        self.assertEqual([span["name"] for span in traces[0]["spans"]], ["command.balance", "db.get_address_by_user", "mongo.find"])
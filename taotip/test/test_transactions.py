@@ -3,12 +3,12 @@ from types import SimpleNamespace
 from typing import Dict
 from unittest.mock import MagicMock, patch
 
-import bittensor
 from cryptography.fernet import Fernet
 from scalecodec.base import ScaleBytes
 from substrateinterface import Keypair
 
 from taotip.src import api, db
+from taotip.src.balance import Balance
 from taotip.src.config import Config
 from taotip.test.test_db import DBTestCase
 
@@ -58,7 +58,7 @@ class TestDeposit(DBTestCase):
         # Form transaction
         transaction: db.Transaction = db.Transaction(
             user,
-            bittensor.Balance.from_float(random.random() * 10000 + 2.0).tao
+            Balance.from_float(random.random() * 10000 + 2.0).rao
         )
         # Get address for user
         address: str = await self._db.get_deposit_addr(transaction)
@@ -72,7 +72,7 @@ class TestDeposit(DBTestCase):
         # Form transaction
         transaction: db.Transaction = db.Transaction(
             user,
-            bittensor.Balance.from_float(random.random() * 10000 + 2.0).tao
+            Balance.from_float(random.random() * 10000 + 2.0).rao
         )
         # Get address for user
         address: str = await self._db.get_deposit_addr(transaction, key_bytes)
@@ -97,16 +97,16 @@ class TestWithdraw(DBTestCase):
         # User now in db. Should have 0 balance on chain
 
         # Attempt to withdraw
-        amount: float = random.random() * 10000 + 2
+        amount: int = Balance.from_float(random.random() * 10000 + 2).rao
         coldkeyadd: str = '5GrwvaEF5zXb26Fz9rcQpDWS57CtERHpNehXCPcNoHGKutQY'
         ## Create Transaction
         transaction: db.Transaction = db.Transaction(str(user), amount)
         with self.assertRaises(db.WithdrawException):
-            with patch.object(self._api, 'get_wallet_balance', return_value=bittensor.Balance.from_rao(0)): # 0 balance
+            with patch.object(self._api, 'get_wallet_balance', return_value=Balance.from_rao(0)): # 0 balance
                 await transaction.withdraw(self._db, coldkeyadd, key_bytes)
         
         # Check that balance is still 0
-        balance: bittensor.Balance = await self._db.check_balance(user)
+        balance: Balance = await self._db.check_balance(user)
         self.assertEqual(balance.tao, 0)
 
     async def test_withdraw_with_nonzero_balance_not_enough(self):   
@@ -114,11 +114,11 @@ class TestWithdraw(DBTestCase):
         user: int = random.randint(0, 1000000)
 
         
-        amount: float = random.random() * 10000 + 2
+        amount: int = Balance.from_float(random.random() * 10000 + 2).rao
         key_bytes: bytes = Fernet.generate_key() 
 
         # More than transaction fee, but not enough to cover transaction
-        bal: bittensor.Balance = bittensor.Balance.from_float(1.0)
+        bal: Balance = Balance.from_float(1.0)
         
         # Create a new address for the user
         new_address: str = await self._db.create_new_address(key_bytes, user)
@@ -126,7 +126,7 @@ class TestWithdraw(DBTestCase):
         # Mock balance check on chain
         with patch.object(self._api, 'get_wallet_balance', return_value=bal):
             # Check that balance is in db
-            balance: bittensor.Balance = await self._db.check_balance(user)
+            balance: Balance = await self._db.check_balance(user)
             self.assertEqual(balance, bal)
 
             # Attempt to withdraw        
@@ -138,7 +138,7 @@ class TestWithdraw(DBTestCase):
                 await transaction.withdraw(self._db, coldkeyadd, key_bytes)
             
             # Check that balance is unchanged
-            balance: bittensor.Balance = await self._db.check_balance(user)
+            balance: Balance = await self._db.check_balance(user)
             self.assertEqual(balance, bal)
 
     async def test_withdraw_with_no_user_address(self):
@@ -149,10 +149,10 @@ class TestWithdraw(DBTestCase):
         # User is not in db
 
         ## Amount to withdraw
-        amount: float = random.random() * 10000 + 2 
+        amount: int = Balance.from_float(random.random() * 10000 + 2).rao
 
         # Check that balance is 0; should be because user is not in db
-        balance: bittensor.Balance = await self._db.check_balance(user)
+        balance: Balance = await self._db.check_balance(user)
         self.assertEqual(balance.tao, 0)
 
         # Attempt to withdraw        
@@ -164,15 +164,15 @@ class TestWithdraw(DBTestCase):
             await transaction.withdraw(self._db, coldkeyadd, key_bytes)
         
         # Check that balance is still 0
-        balance: bittensor.Balance = await self._db.check_balance(user)
+        balance: Balance = await self._db.check_balance(user)
         self.assertEqual(balance.tao, 0)
 
     async def test_sign_transaction(self):
         key_bytes: bytes = Fernet.generate_key()
         # Create address on db 
         addr: str = await self._db.create_new_address(key_bytes)        
-        amount: float = random.random() * 10000 + 2.0
-        addr_bal: bittensor.Balance = bittensor.Balance.from_float(amount + 20.0)
+        amount: Balance = Balance.from_float(random.random() * 10000 + 2.0)
+        addr_bal: Balance = amount + Balance.from_float(20.0)
         # Increase addr balance above amount to withdraw
         self._db.db.addresses.update_one({
             'address': addr,
@@ -183,11 +183,11 @@ class TestWithdraw(DBTestCase):
         })
 
         # Setup mock balance check
-        with patch('bittensor.Subtensor.get_balance', return_value=addr_bal):
+        with patch('taotip.src.subtensor.Subtensor.get_balance', return_value=addr_bal):
             # Create transaction
             transaction: Dict = {
                 'coldkeyadd': addr,
-                'amount': amount,
+                'amount': amount.rao,
                 'dest': '5GrwvaEF5zXb26Fz9rcQpDWS57CtERHpNehXCPcNoHGKutQY',
             }
             transaction: db.Transaction = await self._api.create_transaction(transaction)
@@ -208,9 +208,9 @@ class TestWithdraw(DBTestCase):
 
     async def test_withdraw_success(self):
         user: int = random.randint(0, 1000000)
-        amount: float = random.random() * 10000 + 2
+        amount: Balance = Balance.from_float(random.random() * 10000 + 2)
         key_bytes: bytes = Fernet.generate_key()
-        user_bal: bittensor.Balance = bittensor.Balance.from_float(amount + 20.0)
+        user_bal: Balance = amount + Balance.from_float(20.0)
         
         coldkeyadd: str = '5GrwvaEF5zXb26Fz9rcQpDWS57CtERHpNehXCPcNoHGKutQY'
 
@@ -218,23 +218,23 @@ class TestWithdraw(DBTestCase):
         new_address: str = await self._db.create_new_address(key_bytes, user)
 
         ## Create Transaction
-        transaction: db.Transaction = db.Transaction(user, amount)
+        transaction: db.Transaction = db.Transaction(user, amount.rao)
         api_transaction = {
             "coldkeyadd": new_address,
             "dest": coldkeyadd,
-            "amount": amount # in tao for this addr
+            "amount": amount.rao
         }
 
         # User now in db. Should have 0 balance on chain
         # Expected user_bal after withdrawal        
-        expected_balance: bittensor.Balance = user_bal - (await self._api.get_withdraw_fee(api_transaction)) - bittensor.Balance.from_float(amount)
+        expected_balance: Balance = user_bal - (await self._api.get_withdraw_fee(api_transaction)) - amount
 
         ## Mock balance check on chain
         with patch.object(self._api, 'get_wallet_balance', side_effect=[
             user_bal, user_bal, user_bal, expected_balance, expected_balance
         ]):
             # Check balance using mock chain
-            balance: bittensor.Balance = await self._db.check_balance(user)
+            balance: Balance = await self._db.check_balance(user)
             self.assertEqual(balance, user_bal)
 
             # Check new address is in db
@@ -249,12 +249,11 @@ class TestWithdraw(DBTestCase):
             with patch('substrateinterface.SubstrateInterface.submit_extrinsic', MagicMock(return_value=mock_response)):
                 # Attempt to withdraw
 
-                new_balance: float = await transaction.withdraw(self._db, coldkeyadd, key_bytes)
-                new_balance = bittensor.Balance.from_float(new_balance)
+                new_balance: Balance = await transaction.withdraw(self._db, coldkeyadd, key_bytes)
                 
                 # Check that new balance on chain matches expected balance
                 self.assertEqual(new_balance, expected_balance)
 
                 # Check that balance on chain matches expected balance
-                balance: bittensor.Balance = await self._db.check_balance(user)
+                balance: Balance = await self._db.check_balance(user)
                 self.assertEqual(balance, expected_balance)
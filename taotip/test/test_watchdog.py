@@ -0,0 +1,40 @@
+import asyncio
+import time
+import unittest
+
+from taotip.src.watchdog import LoopWatchdog
+
+
+def blocking_call() -> None:
+    time.sleep(0.3)
+
+
+class TestLoopWatchdog(unittest.IsolatedAsyncioTestCase):
+    async def test_blocking_call_site(self):
+        watchdog: LoopWatchdog = LoopWatchdog(threshold=0.1, interval=0.01, summary_interval=60.0)
+        watchdog.start(asyncio.get_running_loop())
+        try:
+            await asyncio.sleep(0.05)
+            blocking_call()
+            await asyncio.sleep(0.05)
+        finally:
+            watchdog.stop()
+
+        self.assertEqual(len(watchdog.sites), 1)
+        site = next(iter(watchdog.sites.values()))
+        self.assertIn("test_watchdog.py", site.site)
+        self.assertIn("blocking_call", site.site)
+        self.assertEqual(site.stalls, 1)
+        self.assertGreater(site.longest, 0.2)
+        self.assertIn("blocking_call", watchdog.summary())
+
+    async def test_no_stalls(self):
+        watchdog: LoopWatchdog = LoopWatchdog(threshold=0.1, interval=0.01, summary_interval=60.0)
+        watchdog.start(asyncio.get_running_loop())
+        try:
+            await asyncio.sleep(0.1)
+        finally:
+            watchdog.stop()
+
+        self.assertEqual(watchdog.sites, {})
+        self.assertIn("no stalls", watchdog.summary())